@@ -0,0 +1,183 @@
+# import
+## batteries
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+
+
+# global variables
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.cache',
+                            'leylab_pipelines', 'DB_cache.sqlite')
+EVICT_EVERY = 1000
+
+
+# functions
+def add_args(parser):
+    """Adding the cache options to an argparse parser
+    """
+    cache = parser.add_argument_group('Cache')
+    cache.add_argument('--cache', default=DEFAULT_PATH,
+                       help='SQLite file caching remote query results (default: %(default)s)')
+    cache.add_argument('--cache-ttl', type=float, default=30.0,
+                       help='Days before a cached result expires; 0 = never (default: %(default)s)')
+    cache.add_argument('--cache-size', type=float, default=1000.0,
+                       help='Max cache size (Mb); least recently used results are evicted (default: %(default)s)')
+    cache.add_argument('--no-cache', action='store_true', default=False,
+                       help='Do not use the cache (default: %(default)s)')
+    return cache
+
+
+def from_args(args):
+    """Creating a Cache object from parsed args (None if --no-cache)
+    """
+    if args.no_cache is True:
+        return None
+    return Cache(args.cache, ttl=args.cache_ttl * 86400,
+                 max_size=args.cache_size * 1024 ** 2)
+
+
+def normalize_query(query):
+    """Normalizing a query (ID or dict of params) to a string key
+    """
+    if isinstance(query, dict):
+        return json.dumps(query, sort_keys=True)
+    if isinstance(query, (list, tuple)):
+        return json.dumps([str(x).strip() for x in query])
+    return str(query).strip()
+
+
+class Cache(object):
+    """On-disk cache of remote query results.
+    Results are keyed on (endpoint, normalized query) and stored as JSON
+    in an SQLite database (WAL mode), so concurrent jobs (processes or
+    threads) can safely read & write the same cache file. Note: SQLite
+    locking is not reliable on some network file systems (eg., NFS).
+
+    Results expire after `ttl` seconds, and the least recently used
+    results are evicted once the cache exceeds `max_size` bytes.
+    """
+    def __init__(self, path=DEFAULT_PATH, ttl=30 * 86400, max_size=1024 ** 3):
+        """path : SQLite file path
+        ttl : seconds before a result expires (0 or None = never)
+        max_size : max total size of the cached results (bytes)
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._n_set = 0
+        self._local = threading.local()
+        self._conns = []
+        self._lock = threading.Lock()
+        # creating the db
+        outdir = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        conn = self.conn()
+        conn.execute('CREATE TABLE IF NOT EXISTS cache ('
+                     ' endpoint TEXT NOT NULL, query TEXT NOT NULL,'
+                     ' value TEXT NOT NULL, size INTEGER NOT NULL,'
+                     ' created REAL NOT NULL, accessed REAL NOT NULL,'
+                     ' PRIMARY KEY (endpoint, query)) WITHOUT ROWID')
+        conn.execute('CREATE INDEX IF NOT EXISTS cache_accessed'
+                     ' ON cache (accessed)')
+
+    def conn(self):
+        """SQLite connection for the current thread
+        """
+        try:
+            return self._local.conn
+        except AttributeError:
+            pass
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None,
+                               check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        self._local.conn = conn
+        with self._lock:
+            self._conns.append(conn)
+        return conn
+
+    def expired(self, created, now=None):
+        if not self.ttl:
+            return False
+        if now is None:
+            now = time.time()
+        return now - created > self.ttl
+
+    def get(self, endpoint, query):
+        """Getting a cached result; None if not cached (or expired)
+        """
+        query = normalize_query(query)
+        conn = self.conn()
+        row = conn.execute('SELECT value, created FROM cache'
+                           ' WHERE endpoint = ? AND query = ?',
+                           (endpoint, query)).fetchone()
+        now = time.time()
+        if row is None or self.expired(row[1], now):
+            with self._lock:
+                self.misses += 1
+            return None
+        conn.execute('UPDATE cache SET accessed = ?'
+                     ' WHERE endpoint = ? AND query = ?',
+                     (now, endpoint, query))
+        with self._lock:
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, endpoint, query, value):
+        """Caching a result (must be JSON serializable & not None)
+        """
+        if value is None:
+            return
+        query = normalize_query(query)
+        value = json.dumps(value)
+        now = time.time()
+        self.conn().execute('INSERT OR REPLACE INTO cache'
+                            ' (endpoint, query, value, size, created, accessed)'
+                            ' VALUES (?, ?, ?, ?, ?, ?)',
+                            (endpoint, query, value, len(value), now, now))
+        with self._lock:
+            self._n_set += 1
+            evict = self._n_set % EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Removing expired results, then least recently used results
+        until the cache is <= max_size
+        """
+        conn = self.conn()
+        if self.ttl:
+            conn.execute('DELETE FROM cache WHERE created < ?',
+                         (time.time() - self.ttl,))
+        total = conn.execute('SELECT SUM(size) FROM cache').fetchone()[0]
+        if total is None or total <= self.max_size:
+            return
+        # freeing down to 90% of max_size
+        to_free = total - self.max_size * 0.9
+        cutoff = None
+        for accessed,size in conn.execute('SELECT accessed, size FROM cache'
+                                          ' ORDER BY accessed'):
+            cutoff = accessed
+            to_free -= size
+            if to_free <= 0:
+                break
+        if cutoff is not None:
+            conn.execute('DELETE FROM cache WHERE accessed <= ?', (cutoff,))
+
+    def close(self):
+        self.evict()
+        with self._lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns = []
+        self._local = threading.local()
+
+    def report(self):
+        msg = 'Cache: {} hits, {} misses ({})\n'
+        sys.stderr.write(msg.format(self.hits, self.misses, self.path))
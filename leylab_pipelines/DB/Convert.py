@@ -1,17 +1,34 @@
 # import
 ## batteries
+import os
 import argparse
 import requests
 import sys
 import re
 import warnings
-import multiprocessing as mp
+import functools
+import itertools
+import xml.etree.ElementTree as ET
 try:
     from urllib import urlencode
 except ImportError:
     from urllib.parse import urlencode
 ## 3rd party
-import xmltodict
+import numpy as np
+## package
+from leylab_pipelines.DB import HTTP
+from leylab_pipelines.DB import Cache
+from leylab_pipelines.DB import IDMap
+from leylab_pipelines.DB import Journal
+
+
+# global variables
+## ID types (in the `LLP-DB idmap` store) for each conversion method
+IDMAP_TYPES = {'accession2taxonomy' : ('accession', 'taxid'),
+               'entrezgene2uniprot' : ('entrez', 'uniprot'),
+               'uniprot2entrezgene' : ('uniprot', 'entrez'),
+               'hgnc2entrezgene' : ('hgnc', 'entrez'),
+               'entreztrangene2entrezgene' : ('ensembl', 'entrez')}
 
 
 # functions
@@ -25,12 +42,43 @@ def parse_args(test_args=None, subparsers=None):
     epi = """DESCRIPTION:
     Convert between various gene or protein IDs using entrez API requests.
 
-    Entrez requests can be done in parallel. 
+    Entrez requests can be done in parallel. All requests share one
+    connection pool and are rate limited to the NCBI limits
+    (3 requests/sec, or 10 requests/sec with an NCBI API key).
 
     IDs:
       If the IDs are provided in a table, select the column delimiter and 
       column number (1-indexed). 
       The list of IDs can be provided via STDIN by using `STDIN`
+
+    BATCHES:
+      EntrezGene2Uniprot & Uniprot2EntrezGene conversions send
+      --batch-size IDs per UniProt request.
+
+    DUPLICATES:
+      Each unique ID is only converted once; the conversion is then
+      written for every occurrence of the ID.
+
+    OUTPUT:
+      Converted IDs are written as soon as they are available (in input
+      order, unless --unordered is used).
+
+    CACHE:
+      Conversions are cached on disk (see --cache), so IDs converted
+      in previous runs are not re-queried.
+
+    OFFLINE MAPPING:
+      With --idmap, IDs are first converted in bulk with a local ID
+      mapping store (built with `LLP-DB idmap` from NCBI/UniProt/HGNC
+      mapping files). Only IDs not in the store are queried remotely,
+      or none at all with --offline.
+
+    CHECKPOINTS:
+      Converted IDs are recorded in a journal (see --journal) as they
+      complete. If a job dies, re-run it with --resume to only convert
+      the remaining IDs. Failed conversions (NA) are not journaled, so
+      --resume also retries them. The journal is removed once the job
+      completes with no failures.
     """
     if subparsers:
         parser = subparsers.add_parser('convert', description=desc, epilog=epi,
@@ -56,12 +104,31 @@ def parse_args(test_args=None, subparsers=None):
                     help='Column containing the IDs (default: %(default)s)')
     io.add_argument('-o', '--outfile', default='-',
                      help='Output file name; "-" if to STDOUT (default: %(default)s)')
+    io.add_argument('-u', '--unordered', action='store_true', default=False,
+                     help='Write IDs as they are converted instead of in input order (default: %(default)s)')
     io.add_argument('-e', '--email', default='dummyemail@dummybunny.info',
                      help='user email address (default: %(default)s)')
 
+    io.add_argument('-k', '--api-key', default=os.environ.get('NCBI_API_KEY'),
+                     help='NCBI API key; $NCBI_API_KEY by default (default: %(default)s)')
+
     misc = parser.add_argument_group('Misc')
-    misc.add_argument('-p', '--procs', type=int, default=1,
-                      help='Number of processors to use (default: %(default)s)')
+    misc.add_argument('-p', '--procs', type=int, default=4,
+                      help='Number of parallel requests (default: %(default)s)')
+    misc.add_argument('--executor', default='async', choices=HTTP.EXECUTORS,
+                      help='Concurrency mode for the parallel requests: asyncio + thread pool, or just a thread pool (default: %(default)s)')
+    misc.add_argument('-t', '--tries', type=int, default=3,
+                      help='Number of tries to make each request (default: %(default)s)')
+    misc.add_argument('-b', '--batch-size', type=int, default=100,
+                      help='IDs per request for methods with batch queries (EntrezGene2Uniprot & Uniprot2EntrezGene) (default: %(default)s)')
+
+    local = parser.add_argument_group('Offline mapping')
+    local.add_argument('--idmap', default=None,
+                       help='Local ID mapping store (see `LLP-DB idmap`) (default: %(default)s)')
+    local.add_argument('--offline', action='store_true', default=False,
+                       help='Only use --idmap; IDs not in the store are "NA" (default: %(default)s)')
+    Journal.add_args(parser)
+    Cache.add_args(parser)
 
     # running test args
     if test_args:
@@ -74,18 +141,60 @@ def main(args=None):
     if args is None:
         args = parse_args()
 
-    # reading IDs
+    # reading & deduplicating IDs
     IDs = read_IDs(args.IDs, sep=args.sep, column=args.column)
+    uniq_IDs, codes = dedup_IDs(IDs)
+    report_dedup(uniq_IDs, codes)
+
+    # local ID mapping store
+    idmap = None
+    if args.idmap is not None:
+        if not os.path.isfile(args.idmap):
+            raise IOError('Cannot find --idmap file: {}'.format(args.idmap))
+        idmap = IDMap.IDMap(args.idmap)
+    elif args.offline is True:
+        raise ValueError('--offline requires --idmap')
 
-    # conversion    
-    IDs = get_conversion(IDs, args.email, args.method, procs=args.procs)
+    # conversion of unique IDs (streaming), skipping journaled IDs
+    cache = Cache.from_args(args)
+    journal = Journal.from_args(args, params={'method' : args.method.lower()})
+    convert = functools.partial(get_conversion, email=args.email,
+                                method=args.method, procs=args.procs,
+                                tries=args.tries, api_key=args.api_key,
+                                cache=cache, ordered=not args.unordered,
+                                batch_size=args.batch_size,
+                                idmap=idmap, offline=args.offline,
+                                executor=args.executor)
+    if journal is None:
+        IDs = convert(uniq_IDs)
+    else:
+        IDs = journal.resume(uniq_IDs, convert, ordered=not args.unordered)
+    IDs = expand_IDs(IDs, uniq_IDs, codes, ordered=not args.unordered)
     
     # writing IDs
     write_IDs(IDs, args.outfile)
+    if journal is not None:
+        journal.close(remove=True)
+    if cache is not None:
+        cache.report()
+        cache.close()
+    if idmap is not None:
+        idmap.close()
+
+
+def format_ID(ID):
+    """ID (or list of IDs) to string; None = 'NA'
+    """
+    if ID is None:
+        return 'NA'
+    if isinstance(ID, (list, tuple)):
+        return ','.join([format_ID(x) for x in ID])
+    return str(ID)
 
 
 def write_IDs(IDs, outfile='-'):
-    """writing out IDs
+    """writing out IDs as they are generated
+    IDs : iterable of [orig_ID, new_ID]
     """
     if outfile == '-':
         outF = sys.stdout
@@ -95,37 +204,162 @@ def write_IDs(IDs, outfile='-'):
     header = '\t'.join(['orig_ID', 'new_ID'])
     outF.write(header + '\n')
     for x in IDs:
-        outF.write('\t'.join(x) + '\n')
+        outF.write('\t'.join([format_ID(y) for y in x]) + '\n')
+        outF.flush()
 
     if outfile != '-':
         outF.close()    
     
 
-def get_conversion(IDs, email, method, procs=1):
-    conv = Conversion(email)
-
-    if procs < 2:
-        procs = None
-    pool = mp.Pool(processes = procs)
-
-    if method.lower() == 'accession2taxonomy':
-        IDs = pool.map(conv.convert_accession_to_taxid, IDs)
-    elif method.lower() == 'entrezgene2uniprot':
-        IDs = pool.map(conv.convert_entrez_to_uniprot, IDs)
-    elif method.lower() == 'uniprot2entrezgene':
-        IDs = pool.map(convert_uniprot_to_entrez, IDs)
-    elif method.lower() == 'hgnc2entrezgene':
-        IDs = pool.map(convert_hgnc_to_entrez, IDs)
-    elif method.lower() == 'entreztrangene2entrezgene':
-        IDs = pool.map(convert_ensembl_to_entrez, IDs)
-    else:
+def get_conversion(IDs, email, method, procs=1, tries=3, api_key=None,
+                   cache=None, ordered=True, batch_size=100,
+                   idmap=None, offline=False, executor='async'):
+    """Converting IDs with parallel requests via a shared HTTP client.
+    Yields [orig_ID, new_ID] as the conversions complete
+    (in the order of IDs if ordered=True).
+    If the method has a batch version, batch_size IDs are sent per request.
+    idmap : IDMap store; IDs are converted locally (in bulk) if possible,
+            and only the other IDs are queried remotely
+    offline : no remote queries; IDs not in idmap are not converted
+    executor : HTTP.Client executor ('async' or 'threads')
+    """
+    # local conversion only
+    if idmap is not None and offline:
+        for x in local_conversion(idmap, method, IDs):
+            yield x
+        return
+
+    with HTTP.Client(workers=procs, tries=tries, api_key=api_key,
+                     executor=executor) as client:
+        conv = Conversion(email, client=client, cache=cache)
+        if idmap is None:
+            for x in remote_conversion(conv, client, method, IDs, ordered,
+                                       batch_size):
+                yield x
+            return
+        # local conversion, with the misses queried remotely. The misses
+        # are read ahead (via tee) by the remote queries, while the
+        # local conversions are yielded in place of the misses as the
+        # remote conversions come in.
+        local1,local2 = itertools.tee(local_conversion(idmap, method, IDs))
+        misses = (x[0] for x in local1 if x[1] is None)
+        remote = remote_conversion(conv, client, method, misses, ordered,
+                                   batch_size)
+        for x in local2:
+            if x[1] is None:
+                x = next(remote)
+            yield x
+
+
+def local_conversion(idmap, method, IDs):
+    """Converting IDs with a local ID mapping store (IDMap).
+    Yields [orig_ID, new_ID]; new_ID = None if not in the store.
+    """
+    try:
+        src,dst = IDMAP_TYPES[method.lower()]
+    except KeyError:
         msg = 'Method "{}" not recognized'
         raise IOError(msg.format(method))
-    return IDs
+    for x in idmap.convert(src, dst, IDs):
+        yield x
+
+
+def remote_conversion(conv, client, method, IDs, ordered=True, batch_size=100):
+    """Converting IDs with remote queries (see get_conversion)
+    """
+    # batch queries
+    func = conv.get_batch_method(method)
+    if func is not None and batch_size > 1:
+        for x in client.imap(func, batches(IDs, batch_size), ordered=ordered):
+            for y in x:
+                yield y
+        return
+    # single-ID queries
+    func = conv.get_method(method)
+    def convert(ID):
+        ret = func(ID)
+        if ret is None:
+            ret = [ID, None]
+        return ret
+    for x in client.imap(convert, IDs, ordered=ordered):
+        yield x
+
+
+def batches(IDs, batch_size=100):
+    """Splitting IDs into lists of <= batch_size IDs (lazily)
+    """
+    batch = []
+    for ID in IDs:
+        batch.append(ID)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def dedup_IDs(IDs):
+    """Deduplicating IDs.
+    IDs : iterable of IDs
+    Returns (unique IDs, index array); the unique IDs are in order of
+    first appearance, and index[i] = position of the i-th ID in the unique IDs
+    """
+    uniq = {}
+    codes = []
+    for ID in IDs:
+        codes.append(uniq.setdefault(ID, len(uniq)))
+    return list(uniq.keys()), np.array(codes, dtype=np.int64)
+
+
+def report_dedup(uniq_IDs, codes):
+    """Reporting the number of duplicate IDs (requests saved)
+    """
+    n_IDs = len(codes)
+    n_uniq = len(uniq_IDs)
+    if n_IDs > 0:
+        ratio = 1 - n_uniq / float(n_IDs)
+    else:
+        ratio = 0.0
+    msg = 'Unique IDs: {} of {} ({:.1f}% duplicates); requests saved: {}\n'
+    sys.stderr.write(msg.format(n_uniq, n_IDs, ratio * 100, n_IDs - n_uniq))
+
+
+def expand_IDs(conversions, uniq_IDs, codes, ordered=True):
+    """Fanning out the conversions of the unique IDs to all IDs.
+    conversions : iterable of [orig_ID, new_ID] for each unique ID
+    uniq_IDs, codes : unique IDs & index array from dedup_IDs
+    ordered : if True, the conversions must be in unique-ID order, and
+              they are yielded in the original ID order. Otherwise, each
+              conversion is yielded (once per occurrence) as it arrives.
+    """
+    if len(codes) == 0:
+        return
+    n_uniq = len(uniq_IDs)
+    if ordered:
+        # last row of each unique ID (when its conversion can be dropped)
+        last = np.zeros(n_uniq, dtype=np.int64)
+        np.maximum.at(last, codes, np.arange(len(codes)))
+        # unique IDs are numbered by first appearance, so row i can be
+        # written once conversion codes[i] is available
+        done = {}
+        row = 0
+        for i,x in enumerate(conversions):
+            done[i] = x
+            while row < len(codes) and codes[row] <= i:
+                code = codes[row]
+                yield done[code]
+                if last[code] == row:
+                    del done[code]
+                row += 1
+    else:
+        counts = dict(zip(uniq_IDs, np.bincount(codes, minlength=n_uniq)))
+        for x in conversions:
+            for i in range(counts[x[0]]):
+                yield x
     
 
 def read_IDs(infile, sep='\t', column=1):
-    """Reading in IDs
+    """Reading in IDs (lazily)
     """
     column = column - 1
     if infile == 'STDIN':
@@ -133,20 +367,141 @@ def read_IDs(infile, sep='\t', column=1):
     else:
         inF = open(infile, 'r')
 
-    IDs = []
     for line in inF:
         line = line.rstrip().split(sep)
-        IDs.append(line[column])
+        yield line[column]
 
     if infile != 'STDIN':
         inF.close()
+
+
+def cached(endpoint):
+    """Decorator for caching the results of Conversion methods.
+    Only successful conversions (new ID is not None) are cached.
+    endpoint : name of the remote endpoint used by the method
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, ID):
+            if self.cache is None:
+                return method(self, ID)
+            new_ID = self.cache.get(endpoint, ID)
+            if new_ID is not None:
+                return [ID, new_ID]
+            ret = method(self, ID)
+            if ret is not None:
+                self.cache.set(endpoint, ID, ret[1])
+            return ret
+        return wrapper
+    return decorator
+
+
+def cached_batch(endpoint):
+    """Decorator for caching the results of batch Conversion methods.
+    Only the IDs not found in the cache are passed to the method.
+    endpoint : name of the remote endpoint used by the method
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, IDs):
+            if self.cache is None:
+                return method(self, IDs)
+            new_IDs = {}
+            for ID in IDs:
+                new_ID = self.cache.get(endpoint, ID)
+                if new_ID is not None:
+                    new_IDs[ID] = new_ID
+            misses = [ID for ID in IDs if ID not in new_IDs]
+            if len(misses) > 0:
+                for ID,new_ID in method(self, misses):
+                    self.cache.set(endpoint, ID, new_ID)
+                    new_IDs[ID] = new_ID
+            return [[ID, new_IDs.get(ID)] for ID in IDs]
+        return wrapper
+    return decorator
+
+
+def xml_tag(elem):
+    """XML element tag without the namespace
+    """
+    return elem.tag.rsplit('}', 1)[-1]
+
+
+def iterparse_response(r, tags):
+    """Incrementally parsing an XML response (requests.Response made with
+    stream=True). The raw byte stream is parsed as it is downloaded.
+    Yields each element with a (namespace-free) tag in `tags` once the
+    element is complete. Each element is cleared & removed from its
+    parent after it is processed (unless it is part of a yielded
+    element), so memory use is flat. The caller can stop iterating (and
+    close the response) once it has what it needs, so the rest of the
+    response is never downloaded or parsed.
+    """
+    r.raw.decode_content = True
+    # open elements & the number of them with a tag in tags
+    stack = []
+    n_tags = 0
+    for event,elem in ET.iterparse(r.raw, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            if xml_tag(elem) in tags:
+                n_tags += 1
+            continue
+        stack.pop()
+        if xml_tag(elem) in tags:
+            n_tags -= 1
+            yield elem
+        if n_tags == 0:
+            elem.clear()
+            if len(stack) > 0:
+                stack[-1].remove(elem)
+
+
+def esearch_IDs(r):
+    """IDs from an esearch response: None if no IDs,
+    a str if 1 ID, else a list of IDs
+    """
+    IDs = [elem.text for elem in iterparse_response(r, ('Id',))]
+    if len(IDs) == 0:
+        return None
+    if len(IDs) == 1:
+        return IDs[0]
     return IDs
 
 
+def parse_uniprot_entries(xml):
+    """Parsing UniProt XML entries.
+    Yields (accessions, GeneIDs) for each entry; the primary accession is first
+    """
+    root = ET.fromstring(xml)
+    for entry in root:
+        if xml_tag(entry) != 'entry':
+            continue
+        accessions = []
+        geneIDs = []
+        for child in entry:
+            tag = xml_tag(child)
+            if tag == 'accession':
+                accessions.append(child.text)
+            elif tag == 'dbReference' and child.get('type') == 'GeneID':
+                geneIDs.append(child.get('id'))
+        yield accessions, geneIDs
+
+
 class Conversion(object):
-    def __init__(self, email):
+    NCBI_URL = 'http://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
+    UNIPROT_URL = 'http://www.uniprot.org/uniprot/'
+    HGNC_URL = 'http://rest.genenames.org/fetch/hgnc_id/'
+
+    def __init__(self, email, client=None, cache=None):
         """email is required
+        client : HTTP.Client object; a new client is created if None
+        cache : Cache.Cache object; no caching if None
         """
+        if client is None:
+            client = HTTP.Client()
+        self.client = client
+        self.cache = cache
         self.params = {}
         self.email = email
         self.params['tool'] = 'PyEntrez'
@@ -156,7 +511,30 @@ class Conversion(object):
             raise ValueError("Enter a valid Email Address")
         self.params["email"] = email
         self.options = urlencode(self.params, doseq=True)
-        
+
+    def get_method(self, method):
+        """Getting the conversion method for a `--method` name
+        """
+        methods = {'accession2taxonomy' : self.convert_accession_to_taxid,
+                   'entrezgene2uniprot' : self.convert_entrez_to_uniprot,
+                   'uniprot2entrezgene' : self.convert_uniprot_to_entrez,
+                   'hgnc2entrezgene' : self.convert_hgnc_to_entrez,
+                   'entreztrangene2entrezgene' : self.convert_ensembl_to_entrez}
+        try:
+            return methods[method.lower()]
+        except KeyError:
+            msg = 'Method "{}" not recognized'
+            raise IOError(msg.format(method))
+
+    def get_batch_method(self, method):
+        """Getting the batch conversion method for a `--method` name
+        (None if the method has no batch version)
+        """
+        methods = {'entrezgene2uniprot' : self.convert_entrez_to_uniprot_batch,
+                   'uniprot2entrezgene' : self.convert_uniprot_to_entrez_batch}
+        return methods.get(method.lower())
+
+    @cached('esearch/gene')
     def convert_ensembl_to_entrez(self, ensembl):
         """Convert Ensembl Id to Entrez Gene Id
         """        
@@ -165,116 +543,185 @@ class Conversion(object):
         else:
             raise(IndexError)
         # Submit resquest to NCBI eutils/Gene database
-        server = "http://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?" + self.options + "&db=gene&term={0}".format(ensembl)
-        r = requests.get(server, headers={"Content-Type": "text/xml"})
+        server = self.NCBI_URL + "esearch.fcgi?" + self.options + "&db=gene&term={0}".format(ensembl)
+        r = self.client.get(server, headers={"Content-Type": "text/xml"},
+                            stream=True)
         if not r.ok:
             r.raise_for_status()
             sys.exit()
         # Process Request
-        response = r.text
-        info = xmltodict.parse(response)
-        try:
-            geneId = info['eSearchResult']['IdList']['Id']
-        except TypeError:
+        with r:
+            geneId = esearch_IDs(r)
+        if geneId is None:
             sys.stderr.write('WARNING: No Entrez ID for "{}"\n'.format(ensembl))
-            geneId = None
         return [ensembl, geneId]
 
+    @cached('genenames/hgnc_id')
     def convert_hgnc_to_entrez(self, hgnc):
         """Convert HGNC Id to Entrez Gene Id
         """
-        entrezdict = {}
-        server = "http://rest.genenames.org/fetch/hgnc_id/{0}".format(hgnc)
-        r = requests.get(server, headers={ "Content-Type" : "application/json"})
+        server = self.HGNC_URL + "{0}".format(hgnc)
+        r = self.client.get(server, headers={ "Content-Type" : "application/json"},
+                            stream=True)
         if not r.ok:
             r.raise_for_status()
             sys.exit()
-        response = r.text
-        info = xmltodict.parse(response)
-        try:
-            for data in info['response']['result']['doc']['str']:
-                if data['@name'] == 'entrez_id':
-                    entrezdict[data['@name']] = data['#text']
-                if data['@name'] == 'symbol':
-                    entrezdict[data['@name']] = data['#text']
-        except KeyError:
-            sys.stderr.write('WARNING: No Entrez ID for "{}"\n'.format(hgnc))            
-            entrezdict = None
-        try:
-            entrezdict = entrezdict['entrez_id']
-        except (KeyError, TypeError):
-            entrezdict = None
+        # stopping at the 1st entrez_id
+        entrez = None
+        with r:
+            for data in iterparse_response(r, ('str',)):
+                if data.get('name') == 'entrez_id':
+                    entrez = data.text
+                    break
+        if entrez is None:
+            sys.stderr.write('WARNING: No Entrez ID for "{}"\n'.format(hgnc))
 
-        return [hgnc, entrezdict]
+        return [hgnc, entrez]
 
+    @cached('uniprot/geneid')
     def convert_entrez_to_uniprot(self, entrez):
         """Convert Entrez Id to Uniprot Id
         """
-        server = "http://www.uniprot.org/uniprot/?query=%22GENEID+{0}%22&format=xml".format(entrez)
-        r = requests.get(server, headers={ "Content-Type" : "text/xml"})
+        server = self.UNIPROT_URL + "?query=%22GENEID+{0}%22&format=xml".format(entrez)
+        r = self.client.get(server, headers={ "Content-Type" : "text/xml"},
+                            stream=True)
         if not r.ok:
             r.raise_for_status()
             sys.exit()
-        response = r.text
-        info = xmltodict.parse(response)
-        try:
-            data = info['uniprot']['entry']['accession'][0]
-        except TypeError:
-            data = info['uniprot']['entry'][0]['accession'][0]
+        # stopping at the 1st accession of the 1st entry
+        data = None
+        with r:
+            for elem in iterparse_response(r, ('accession',)):
+                data = elem.text
+                break
         return [entrez, data]
 
+    @cached('esearch/gene/uniprot')
     def convert_uniprot_to_entrez(self, uniprot):
         """Convert Uniprot Id to Entrez Id
         """
         # Submit request to NCBI eutils/Gene Database
-        server = "http://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?" + self.options + "&db=gene&term={0}".format(uniprot)
-        r = requests.get(server, headers={ "Content-Type" : "text/xml"})
+        server = self.NCBI_URL + "esearch.fcgi?" + self.options + "&db=gene&term={0}".format(uniprot)
+        r = self.client.get(server, headers={ "Content-Type" : "text/xml"},
+                            stream=True)
         if not r.ok:
             r.raise_for_status()
             sys.exit()
         # Process Request
-        response = r.text
-        info = xmltodict.parse(response)
-        geneId = info['eSearchResult']['IdList']['Id']
+        with r:
+            geneId = esearch_IDs(r)
         # check to see if more than one result is returned
         # if you have more than more result then check which Entrez Id returns the same uniprot Id entered.
-        if len(geneId) > 1:
+        if isinstance(geneId, list):
             for x in geneId:
                 c = self.convert_entrez_to_uniprot(x)[1]
+                if c is None:
+                    continue
                 c = c.lower()
                 u = uniprot.lower()
                 if c==u:
                     return [uniprot, x]
+            return [uniprot, None]
         else:
             return [uniprot, geneId]
 
+    def query_uniprot(self, query):
+        """UniProt query (1 request); returns the XML response
+        """
+        params = {'query' : query, 'format' : 'xml'}
+        r = self.client.get(self.UNIPROT_URL, params=params,
+                            headers={ "Content-Type" : "text/xml"})
+        if not r.ok:
+            r.raise_for_status()
+            sys.exit()
+        return r.content
+
+    @cached_batch('uniprot/geneid')
+    def convert_entrez_to_uniprot_batch(self, entrez_ids):
+        """Convert Entrez Ids to Uniprot Ids, with 1 request for all IDs.
+        Returns a list of [entrez, uniprot]
+        """
+        query = ' OR '.join(['geneid:{}'.format(x) for x in entrez_ids])
+        # first (primary) accession of the first entry for each gene
+        uniprot = {}
+        if len(entrez_ids) > 0:
+            xml = self.query_uniprot(query)
+            for accessions,geneIDs in parse_uniprot_entries(xml):
+                for x in geneIDs:
+                    if x not in uniprot and len(accessions) > 0:
+                        uniprot[x] = accessions[0]
+        return [[x, uniprot.get(x)] for x in entrez_ids]
+
+    @cached_batch('uniprot/accession')
+    def convert_uniprot_to_entrez_batch(self, uniprot_ids):
+        """Convert Uniprot Ids to Entrez Ids, with 1 request for all IDs,
+        plus 1 request for all IDs mapping to >1 gene.
+        For an ID mapping to >1 gene, the gene whose Uniprot Id
+        (see convert_entrez_to_uniprot) is the query ID is selected.
+        Returns a list of [uniprot, entrez]
+        """
+        query = ' OR '.join(['accession:{}'.format(x) for x in uniprot_ids])
+        # candidate genes for each ID
+        candidates = {}
+        if len(uniprot_ids) > 0:
+            xml = self.query_uniprot(query)
+            for accessions,geneIDs in parse_uniprot_entries(xml):
+                for i,x in enumerate(accessions):
+                    x = x.lower()
+                    # primary accession match takes precedence
+                    if i == 0 or x not in candidates:
+                        candidates[x] = geneIDs
+        # disambiguation (in memory, with 1 bulk request)
+        ambig = set()
+        for x in uniprot_ids:
+            geneIDs = candidates.get(x.lower(), [])
+            if len(geneIDs) > 1:
+                ambig.update(geneIDs)
+        gene2uniprot = {}
+        if len(ambig) > 0:
+            for entrez,uniprot in self.convert_entrez_to_uniprot_batch(sorted(ambig)):
+                if uniprot is not None:
+                    gene2uniprot[entrez] = uniprot.lower()
+        # selecting the entrez ID
+        ret = []
+        for x in uniprot_ids:
+            geneIDs = candidates.get(x.lower(), [])
+            entrez = None
+            if len(geneIDs) == 1:
+                entrez = geneIDs[0]
+            for y in geneIDs:
+                if len(geneIDs) > 1 and gene2uniprot.get(y) == x.lower():
+                    entrez = y
+                    break
+            ret.append([x, entrez])
+        return ret
+
+    @cached('efetch/nuccore')
     def convert_accession_to_taxid(self, accessionid):
         """Convert Accession Id to Tax Id
         """
         # Submit request to NCBI eutils/Taxonomy Database
-        server = "http://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?" + self.options + "&db=nuccore&id={0}&retmode=xml".format(accessionid)
-        r = requests.get(server, headers={ "Content-Type" : "text/xml"})
+        server = self.NCBI_URL + "efetch.fcgi?" + self.options + "&db=nuccore&id={0}&retmode=xml".format(accessionid)
+        r = self.client.get(server, headers={ "Content-Type" : "text/xml"},
+                            stream=True)
         if not r.ok:
             try:
                 r.raise_for_status()
             except requests.exceptions.HTTPError:
                 sys.stderr.write('WARNING: No taxonomy ID for "{}"\n'.format(accessionid)) 
+            r.close()
             return [accessionid, None]
-        # Process Request
-        response = r.text
-        records = xmltodict.parse(response)
-        try:
-            for i in records['GBSet']['GBSeq']['GBSeq_feature-table']['GBFeature']['GBFeature_quals']['GBQualifier']:
-                for key, value in i.items():
-                    if value == 'db_xref':
-                        taxid = i['GBQualifier_value']
-                        taxid = taxid.split(':')[1]
-                        return [accessionid, taxid]
-        except:
-            for i in records['GBSet']['GBSeq']['GBSeq_feature-table']['GBFeature'][0]['GBFeature_quals']['GBQualifier']:
-                for key, value in i.items():
-                    if value == 'db_xref':
-                        taxid = i['GBQualifier_value']
-                        taxid = taxid.split(':')[1]
-                        return [accessionid, taxid]
+        # Process Request: incremental parsing of the GenBank record,
+        # stopping at the 1st 'taxon:' db_xref (in the source feature), so
+        # the rest of the record (features, sequence) is never downloaded
+        with r:
+            try:
+                for qual in iterparse_response(r, ('GBQualifier',)):
+                    if qual.findtext('GBQualifier_name') != 'db_xref':
+                        continue
+                    value = qual.findtext('GBQualifier_value', '')
+                    if value.startswith('taxon:'):
+                        return [accessionid, value.split(':')[1]]
+            except ET.ParseError:
+                sys.stderr.write('WARNING: Could not parse record for "{}"\n'.format(accessionid))
         return [accessionid, None]
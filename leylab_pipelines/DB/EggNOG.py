@@ -2,11 +2,22 @@
 ## batteries
 import os
 import sys
+import gzip
+import threading
 import argparse
-import requests
 import warnings
 import functools
-import multiprocessing as mp
+import tempfile
+from email.utils import formatdate, parsedate_tz, mktime_tz
+## package
+from leylab_pipelines.DB import HTTP
+from leylab_pipelines.DB import Cache
+
+
+# global variables
+EGGNOG_URL = 'http://eggnogapi.embl.de/nog_data/'
+CHUNK_SIZE = 1024 ** 2
+CACHE_MAX_SIZE = 1024 ** 2
 
 
 # functions
@@ -19,8 +30,34 @@ def parse_args(test_args=None, subparsers=None):
     desc = get_desc()
     epi = """DESCRIPTION:
     Download EggNOG database data (in parallel) with the EggNOG API.
+    All requests share one connection pool and failed requests are retried.
 
     To find EggNOG group names, you can use the EggNOG website (http://eggnogdb.embl.de/#/app/home)
+
+    Downloaded data is cached on disk (see --cache), so NOGs downloaded
+    in previous runs are not re-downloaded. Only small responses
+    (<= 1 Mb) are cached.
+
+    Responses are streamed to disk in chunks (via a temporary file that
+    is renamed once complete), so partial files are never left behind.
+
+    SYNC:
+      off = all NOGs are downloaded
+      skip = NOGs with existing output files are skipped
+      conditional = existing output files are only re-downloaded if the
+        server reports them as modified (If-Modified-Since)
+
+    ARCHIVE:
+      With --archive, all NOG attributes are appended to 1 file (instead
+      of 1 file per NOG in --outdir), with each attribute compressed as
+      a separate gzip member; "ARCHIVE.idx" is a table of each member's
+      name, byte offset, size & server modification time. Any member can
+      be read without reading the rest of the archive, eg.,:
+        tail -c +$((offset + 1)) ARCHIVE | head -c $size | gzip -dc
+      or with leylab_pipelines.DB.EggNOG.Archive(ARCHIVE).read(name).
+      The archive as a whole is also a valid gzip file (all members).
+      Re-running with --archive appends to the archive (see --sync);
+      for re-downloaded members, the last index entry is used.
     """
     if subparsers:
         parser = subparsers.add_parser('eggnog', description=desc, epilog=epi,
@@ -38,10 +75,20 @@ def parse_args(test_args=None, subparsers=None):
                     help='attribute (default: %(default)s)')    
     io.add_argument('-o', '--outdir', default='.',
                     help='Output directory (default: %(default)s)')                        
+    io.add_argument('-s', '--sync', default='off',
+                    choices=['off', 'skip', 'conditional'],
+                    help='Existing output file handling; see description (default: %(default)s)')
+    io.add_argument('-A', '--archive', default=None,
+                    help='Append all output to this indexed archive file instead of --outdir; see description (default: %(default)s)')
 
     misc = parser.add_argument_group('Misc')
-    misc.add_argument('-p', '--procs', type=int, default=1,
-                      help='Number of processors to use (default: %(default)s)')
+    misc.add_argument('-p', '--procs', type=int, default=4,
+                      help='Number of parallel requests (default: %(default)s)')
+    misc.add_argument('--executor', default='async', choices=HTTP.EXECUTORS,
+                      help='Concurrency mode for the parallel requests: asyncio + thread pool, or just a thread pool (default: %(default)s)')
+    misc.add_argument('-t', '--tries', type=int, default=3,
+                      help='Number of tries to make each request (default: %(default)s)')
+    Cache.add_args(parser)
 
     # running test args
     if test_args:
@@ -60,17 +107,38 @@ def main(args=None):
     nog_names = filter_nog_names(nog_names)
 
     # writing content
-    procs = int(args.procs)
-    if procs < 2:
-        procs = None
-    pool = mp.Pool(processes = procs)
-    func = functools.partial(write_content, attribute=args.attribute, outdir=args.outdir)
-    outfiles = pool.map(func, nog_names)
+    cache = Cache.from_args(args)
+    archive = None
+    if args.archive is not None:
+        archive = Archive(args.archive, mode='a')
+    with HTTP.Client(workers=args.procs, tries=args.tries,
+                     executor=args.executor) as client:
+        func = functools.partial(write_content, attribute=args.attribute,
+                                 outdir=args.outdir, client=client,
+                                 cache=cache, sync=args.sync,
+                                 archive=archive)
+        n_write = 0
+        n_skip = 0
+        for x in client.imap(func, nog_names, ordered=False):
+            if x is None:
+                n_skip += 1
+                continue
+            n_write += 1
+            if archive is None:
+                msg = 'File written: {}\n'
+                sys.stderr.write(msg.format(x))
+    if cache is not None:
+        cache.report()
+        cache.close()
 
     # status
-    for x in outfiles:
-        msg = 'File written: {}\n'
-        sys.stderr.write(msg.format(x))
+    if archive is not None:
+        archive.close()
+        msg = 'NOG attributes added to {}: {}\n'
+        sys.stderr.write(msg.format(args.archive, n_write))
+    if n_skip > 0:
+        msg = 'Files up to date (skipped): {}\n'
+        sys.stderr.write(msg.format(n_skip))
 
     
 def read_nog_names(infile):
@@ -127,31 +195,248 @@ def get_ext(attribute):
         return ''
 
 
-def write_content(nog_name, attribute, outdir):
-    # creating output file name
-    if not os.path.isdir(outdir):
-        os.makedirs(outdir)
-    outfile = '_'.join([nog_name, attribute]) + get_ext(attribute)
-    outfile = os.path.join(outdir, outfile)
-    
-    # attribute
+def get_url(nog_name, attribute):
+    """EggNOG API url & cache endpoint for a NOG attribute
+    """
     if attribute == 'go_terms' or attribute == 'domains':
         dataformat = 'json'
     else:
         dataformat = 'file'
+    url = EGGNOG_URL + '{}/{}/{}'.format(dataformat, attribute, nog_name)
+    endpoint = 'nog_data/{}/{}'.format(dataformat, attribute)
+    return url, endpoint
+
+
+def atomic_write(outfile, chunks):
+    """Writing chunks (bytes) to a temporary file in the output directory,
+    which is then renamed to outfile (so outfile is never partial)
+    """
+    outdir = os.path.dirname(os.path.abspath(outfile))
+    fd,tmpfile = tempfile.mkstemp(dir=outdir, suffix='.tmp',
+                                  prefix='.' + os.path.basename(outfile))
+    try:
+        with os.fdopen(fd, 'wb') as outF:
+            for chunk in chunks:
+                outF.write(chunk)
+        os.replace(tmpfile, outfile)
+    except BaseException:
+        if os.path.isfile(tmpfile):
+            os.remove(tmpfile)
+        raise
+
+
+def last_modified(r):
+    """Last-Modified header of a response as a timestamp (None if missing)
+    """
+    try:
+        return mktime_tz(parsedate_tz(r.headers['Last-Modified']))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def write_content(nog_name, attribute, outdir, client=None, cache=None,
+                  sync='off', archive=None):
+    """Downloading a NOG attribute to a file in outdir.
+    The response is streamed to disk in chunks.
+    sync : 'off' = always download; 'skip' = skip if the file exists;
+           'conditional' = only download if modified on the server
+    archive : Archive to append to instead of writing a file in outdir
+    Returns the output file (None if skipped)
+    """
+    # creating output file name
+    outfile = '_'.join([nog_name, attribute]) + get_ext(attribute)
+    if archive is not None:
+        dest = ArchiveMember(archive, outfile)
+    else:
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        dest = OutFile(os.path.join(outdir, outfile))
+    exists = dest.exists()
+    if sync == 'skip' and exists:
+        return None
 
     # request
-    ## url
-    url = 'http://eggnogapi.embl.de/nog_data/{}/{}/{}'
-    url = url.format(dataformat, attribute, nog_name)
-    print(url)
+    url,endpoint = get_url(nog_name, attribute)
+    ## cached?
+    if cache is not None and not (sync == 'conditional' and exists):
+        content = cache.get(endpoint, nog_name)
+        if content is not None:
+            dest.write([content.encode('utf-8')])
+            return dest.name
+    ## conditional request
+    headers = None
+    mtime = dest.mtime()
+    if sync == 'conditional' and exists and mtime is not None:
+        headers = {'If-Modified-Since' : formatdate(mtime, usegmt=True)}
     ## checking request
-    r = requests.get(url)
-    if not r.ok:
-        r.raise_for_status()
-        sys.exit()
-    ## writing
-    with open(outfile, 'w') as outF:
-        outF.write(r.text)
+    if client is None:
+        client = HTTP.Client()
+    r = client.get(url, headers=headers, stream=True)
+    with r:
+        if r.status_code == 304:
+            return None
+        if not r.ok:
+            r.raise_for_status()
+            sys.exit()
+        ## streaming to disk (small responses are also cached)
+        small = []
+        def chunks():
+            size = 0
+            for chunk in r.iter_content(CHUNK_SIZE):
+                size += len(chunk)
+                if size <= CACHE_MAX_SIZE:
+                    small.append(chunk)
+                yield chunk
+            if size > CACHE_MAX_SIZE:
+                del small[:]
+        ## server modification time (for conditional requests)
+        dest.write(chunks(), mtime=last_modified(r))
+    if cache is not None and len(small) > 0:
+        try:
+            cache.set(endpoint, nog_name, b''.join(small).decode('utf-8'))
+        except UnicodeDecodeError:
+            pass
     
-    return outfile
+    return dest.name
+
+
+class OutFile(object):
+    """Output file destination of write_content
+    """
+    def __init__(self, path):
+        self.name = path
+
+    def exists(self):
+        return os.path.isfile(self.name)
+
+    def mtime(self):
+        if not self.exists():
+            return None
+        return os.path.getmtime(self.name)
+
+    def write(self, chunks, mtime=None):
+        atomic_write(self.name, chunks)
+        if mtime is not None:
+            os.utime(self.name, (mtime, mtime))
+
+
+class ArchiveMember(object):
+    """Archive member destination of write_content
+    """
+    def __init__(self, archive, member):
+        self.archive = archive
+        self.member = member
+        self.name = '{}:{}'.format(archive.path, member)
+
+    def exists(self):
+        return self.member in self.archive
+
+    def mtime(self):
+        return self.archive.mtime(self.member)
+
+    def write(self, chunks, mtime=None):
+        self.archive.add(self.member, chunks, mtime=mtime)
+
+
+class Archive(object):
+    """Single-file store of NOG attributes (see `--archive`).
+    Each member is a gzip member appended to the archive file, and
+    indexed in PATH.idx (name, offset, size, mtime), so any member can be
+    read with 1 seek. Members are compressed in the calling thread (spooled
+    to a temporary file if large), and only the append is serialized.
+    """
+    INDEX_HEADER = ['name', 'offset', 'size', 'mtime']
+
+    def __init__(self, path, mode='r'):
+        """path : archive file path
+        mode : 'r' = read; 'a' = append (the archive is created if needed)
+        """
+        self.path = path
+        self.index_path = path + '.idx'
+        self.mode = mode
+        self.index = {}
+        if os.path.isfile(self.index_path):
+            self.load_index()
+        elif mode == 'r':
+            raise IOError('Cannot find archive index: {}'.format(self.index_path))
+        self._lock = threading.Lock()
+        if mode == 'a':
+            self._fh = open(path, 'ab')
+            new_index = not os.path.isfile(self.index_path)
+            self._idx = open(self.index_path, 'a')
+            if new_index:
+                self._idx.write('\t'.join(self.INDEX_HEADER) + '\n')
+                self._idx.flush()
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def names(self):
+        return list(self.index.keys())
+
+    def load_index(self):
+        with open(self.index_path) as inF:
+            for i,line in enumerate(inF):
+                line = line.rstrip('\n').split('\t')
+                if i == 0 or len(line) < 4:
+                    continue
+                mtime = float(line[3]) if line[3] != '' else None
+                # the last entry of a re-added member is used
+                self.index[line[0]] = (int(line[1]), int(line[2]), mtime)
+
+    def mtime(self, name):
+        try:
+            return self.index[name][2]
+        except KeyError:
+            return None
+
+    def add(self, name, chunks, mtime=None):
+        """Compressing chunks (bytes) & appending them as member `name`
+        """
+        with tempfile.SpooledTemporaryFile(max_size=8 * CHUNK_SIZE) as tmp:
+            with gzip.GzipFile(filename=name, mode='wb', fileobj=tmp,
+                               mtime=0) as gz:
+                for chunk in chunks:
+                    gz.write(chunk)
+            size = tmp.tell()
+            tmp.seek(0)
+            with self._lock:
+                self._fh.seek(0, os.SEEK_END)
+                offset = self._fh.tell()
+                while True:
+                    data = tmp.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    self._fh.write(data)
+                self._fh.flush()
+                # indexing after the member is written
+                mtime_str = '' if mtime is None else str(mtime)
+                line = [name, str(offset), str(size), mtime_str]
+                self._idx.write('\t'.join(line) + '\n')
+                self._idx.flush()
+                self.index[name] = (offset, size, mtime)
+
+    def read(self, name):
+        """Reading (uncompressed) member `name`
+        """
+        try:
+            offset,size,mtime = self.index[name]
+        except KeyError:
+            raise KeyError('"{}" not in archive {}'.format(name, self.path))
+        if self.mode == 'a':
+            with self._lock:
+                self._fh.flush()
+        with open(self.path, 'rb') as inF:
+            inF.seek(offset)
+            return gzip.decompress(inF.read(size))
+
+    def close(self):
+        if self.mode == 'a':
+            self._fh.close()
+            self._idx.close()
@@ -0,0 +1,288 @@
+# import
+## batteries
+import sys
+import time
+import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED
+from concurrent.futures import wait as futures_wait
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+## 3rd party
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# global variables
+NCBI_HOST = 'eutils.ncbi.nlm.nih.gov'
+RETRY_STATUS = (429, 500, 502, 503, 504)
+EXECUTORS = ['async', 'threads']
+
+
+# functions
+def loop_running():
+    """Is an asyncio event loop running in this thread?
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def ncbi_rate(api_key=None):
+    """Max requests per second allowed by the NCBI E-utilities
+    (3 without an API key; 10 with an API key)
+    """
+    if api_key is None or api_key == '':
+        return 3
+    return 10
+
+
+def windowed_imap(items, submit, wait, ordered=True, window=1):
+    """Yielding the results of calls submitted for each item, with
+    <= window items in flight or waiting to be yielded.
+    submit : function(item) -> future
+    wait : function(pending futures) -> (done, pending), returning once
+           >=1 future is done
+    ordered : yield results in the order of items; otherwise in the
+              order that the calls complete
+    Pending futures are cancelled if the generator is closed early.
+    """
+    items = iter(items)
+    pending = set()
+    idx = {}
+    done_buf = {}
+    n_submit = 0
+    n_yield = 0
+    try:
+        while True:
+            # filling the window
+            while len(pending) + len(done_buf) < window:
+                try:
+                    x = next(items)
+                except StopIteration:
+                    break
+                fut = submit(x)
+                idx[fut] = n_submit
+                pending.add(fut)
+                n_submit += 1
+            if len(pending) == 0:
+                break
+            # waiting for >=1 call to complete
+            done, pending = wait(pending)
+            if ordered:
+                for fut in done:
+                    done_buf[idx.pop(fut)] = fut.result()
+                while n_yield in done_buf:
+                    yield done_buf.pop(n_yield)
+                    n_yield += 1
+            else:
+                for fut in sorted(done, key=lambda f: idx[f]):
+                    idx.pop(fut)
+                    yield fut.result()
+    finally:
+        for fut in pending:
+            fut.cancel()
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket rate limiter
+    rate : tokens (requests) per second
+    capacity : max burst size; the default of 1 spaces requests evenly
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Taking a token; blocks until the token is available.
+        Returns the number of seconds waited.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # reserving the token (the bucket can go negative)
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            wait = -self._tokens / self.rate
+        time.sleep(wait)
+        return wait
+
+
+class Client(object):
+    """HTTP client shared by all requests of a DB command.
+    * connections are pooled (keep-alive) via one requests.Session
+    * requests are rate limited per host with token buckets
+      (NCBI E-utilities: 3 or 10 requests/sec, see ncbi_rate())
+    * failed requests (connection errors, HTTP 429 & 5xx) are retried
+      with jittered exponential backoff
+    * imap() & map() run a function over many items concurrently with
+      asyncio, with the blocking requests calls done in a thread pool
+      (executor='async'), or with just a thread pool (executor='threads')
+    """
+    def __init__(self, workers=1, tries=3, backoff=1.0, timeout=60,
+                 api_key=None, rates=None, executor='async'):
+        """workers : max number of concurrent requests
+        tries : max number of tries per request
+        backoff : base retry delay (seconds)
+        timeout : request timeout (seconds)
+        api_key : NCBI API key (raises the NCBI rate limit)
+        rates : {host : requests/sec}; hosts not listed are not rate limited
+        executor : 'async' or 'threads' (see imap)
+        """
+        if executor not in EXECUTORS:
+            msg = 'Executor "{}" not recognized'
+            raise ValueError(msg.format(executor))
+        self.executor = executor
+        self.workers = max(int(workers), 1)
+        self.tries = max(int(tries), 1)
+        self.backoff = float(backoff)
+        self.timeout = timeout
+        self.api_key = api_key
+        # rate limits
+        self.rates = {NCBI_HOST : ncbi_rate(api_key)}
+        if rates is not None:
+            self.rates.update(rates)
+        self._limiters = {}
+        self._lock = threading.Lock()
+        # connection pool
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def limiter(self, host):
+        """Getting the rate limiter for a host (None if no limit)
+        """
+        with self._lock:
+            try:
+                return self._limiters[host]
+            except KeyError:
+                pass
+            rate = self.rates.get(host)
+            if rate is None:
+                limiter = None
+            else:
+                limiter = TokenBucket(rate)
+            self._limiters[host] = limiter
+            return limiter
+
+    def retry_delay(self, attempt, r=None):
+        """Seconds to wait before the next try.
+        The 'Retry-After' header is used if provided by the server;
+        otherwise exponential backoff with random jitter.
+        """
+        if r is not None:
+            try:
+                return float(r.headers['Retry-After'])
+            except (KeyError, ValueError):
+                pass
+        delay = self.backoff * 2 ** attempt
+        return delay / 2.0 + random.uniform(0, delay / 2.0)
+
+    def get(self, url, params=None, headers=None, stream=False):
+        """GET request with rate limiting & retries.
+        Returns the requests.Response of the last try.
+        """
+        host = urlparse(url).netloc
+        if self.api_key and host == NCBI_HOST:
+            params = dict(params or {})
+            params['api_key'] = self.api_key
+        limiter = self.limiter(host)
+
+        for i in range(self.tries):
+            if limiter is not None:
+                limiter.acquire()
+            try:
+                r = self.session.get(url, params=params, headers=headers,
+                                     timeout=self.timeout, stream=stream)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as e:
+                if i >= self.tries - 1:
+                    raise
+                msg = 'WARNING: {} for "{}". Retrying\n'
+                sys.stderr.write(msg.format(e.__class__.__name__, url))
+                time.sleep(self.retry_delay(i))
+                continue
+            if r.status_code not in RETRY_STATUS or i >= self.tries - 1:
+                return r
+            msg = 'WARNING: status code = {} for "{}". Retrying\n'
+            sys.stderr.write(msg.format(r.status_code, url))
+            delay = self.retry_delay(i, r)
+            r.close()
+            time.sleep(delay)
+
+    def imap(self, func, items, ordered=True, window=None):
+        """Calling func on each item, with <= self.workers calls at a time.
+        Results are yielded as they complete, so they can be written out
+        before the last call finishes.
+        items : iterable (consumed lazily)
+        ordered : yield results in the order of items; otherwise in the
+                  order that the calls complete
+        window : max number of items in flight or waiting to be yielded
+                 (default: 4 * workers); this keeps memory usage flat
+        The 'threads' executor is used if an asyncio event loop is already
+        running in this thread (eg., in a Jupyter notebook).
+        """
+        if window is None:
+            window = self.workers * 4
+        window = max(int(window), self.workers)
+        if self.executor == 'threads' or loop_running():
+            return self._imap_threads(func, items, ordered, window)
+        return self._imap_async(func, items, ordered, window)
+
+    def _imap_async(self, func, items, ordered, window):
+        loop = asyncio.new_event_loop()
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        def submit(x):
+            return loop.run_in_executor(executor, func, x)
+        def wait(pending):
+            return loop.run_until_complete(
+                asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED))
+        results = windowed_imap(items, submit, wait, ordered, window)
+        try:
+            for x in results:
+                yield x
+        finally:
+            results.close()
+            executor.shutdown(wait=True)
+            loop.close()
+
+    def _imap_threads(self, func, items, ordered, window):
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        def submit(x):
+            return executor.submit(func, x)
+        def wait(pending):
+            return futures_wait(pending, return_when=FIRST_COMPLETED)
+        results = windowed_imap(items, submit, wait, ordered, window)
+        try:
+            for x in results:
+                yield x
+        finally:
+            results.close()
+            executor.shutdown(wait=True)
+
+    def map(self, func, items):
+        """Calling func on each item, with <= self.workers calls at a time.
+        Returns a list of results in the same order as items.
+        """
+        return list(self.imap(func, items))
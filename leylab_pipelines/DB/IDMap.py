@@ -0,0 +1,247 @@
+# import
+## batteries
+import sys
+import gzip
+import sqlite3
+import argparse
+
+
+# global variables
+FORMATS = ['acc2taxid', 'gene2accession', 'gene2ensembl', 'uniprot', 'hgnc']
+INSERT_CHUNK = 100000
+LOOKUP_CHUNK = 500
+
+
+# functions
+def get_desc():
+    desc = 'Build a local ID mapping store for offline ID conversion'
+    return desc
+
+def parse_args(test_args=None, subparsers=None):
+    # desc
+    desc = get_desc()
+    epi = """DESCRIPTION:
+    Ingest ID mapping files into a compact, indexed local store (SQLite).
+    The store can be used by `convert --idmap` to convert IDs locally in
+    bulk; only IDs missing from the store are queried remotely.
+    Run multiple times (with different --format values) to add mappings
+    to the same store.
+
+    FORMATS (files can be gzip'ed):
+      acc2taxid = NCBI accession2taxid (accession[.version] -> taxID)
+        ftp://ftp.ncbi.nih.gov/pub/taxonomy/accession2taxid/
+      gene2accession = NCBI gene2accession (accession[.version] -> taxID)
+        ftp://ftp.ncbi.nih.gov/gene/DATA/gene2accession.gz
+      gene2ensembl = NCBI gene2ensembl (Ensembl transcript/gene -> Entrez gene)
+        ftp://ftp.ncbi.nih.gov/gene/DATA/gene2ensembl.gz
+      uniprot = UniProt idmapping.dat (UniProt <-> Entrez gene)
+        ftp://ftp.uniprot.org/pub/databases/uniprot/current_release/knowledgebase/idmapping/
+      hgnc = HGNC export with "HGNC ID" & "NCBI Gene ID" columns (HGNC -> Entrez gene)
+        https://www.genenames.org/download/custom/
+    """
+    if subparsers:
+        parser = subparsers.add_parser('idmap', description=desc, epilog=epi,
+                                       formatter_class=argparse.RawTextHelpFormatter)
+    else:
+        parser = argparse.ArgumentParser(description=desc, epilog=epi,
+                                         formatter_class=argparse.RawTextHelpFormatter)
+
+    # args
+    io = parser.add_argument_group('Input/Output')
+    io.add_argument('mapfile', metavar='mapfile', type=str, nargs='+',
+                    help='>=1 ID mapping file')
+    io.add_argument('-f', '--format', default='uniprot', choices=FORMATS,
+                    help='Mapping file format (default: %(default)s)')
+    io.add_argument('-o', '--outfile', default='idmap.sqlite',
+                    help='ID mapping store; created if it does not exist (default: %(default)s)')
+
+    # running test args
+    if test_args:
+        args = parser.parse_args(test_args)
+        return args
+
+
+def main(args=None):
+    # Input
+    if args is None:
+        args = parse_args()
+
+    # ingesting
+    idmap = IDMap(args.outfile)
+    for infile in args.mapfile:
+        msg = 'Ingesting {} file: {}\n'
+        sys.stderr.write(msg.format(args.format, infile))
+        n = idmap.ingest(read_mapfile(infile, args.format))
+        sys.stderr.write('  Number of mappings added: {}\n'.format(n))
+    idmap.close()
+
+
+def open_file(infile):
+    if infile.endswith('.gz'):
+        return gzip.open(infile, 'rt')
+    return open(infile, 'r')
+
+
+def strip_version(ID):
+    return ID.rsplit('.', 1)[0]
+
+
+def read_mapfile(infile, file_format):
+    """Reading an ID mapping file.
+    Yields (src_type, dst_type, src_ID, dst_ID)
+    """
+    parsers = {'acc2taxid' : parse_acc2taxid,
+               'gene2accession' : parse_gene2accession,
+               'gene2ensembl' : parse_gene2ensembl,
+               'uniprot' : parse_uniprot,
+               'hgnc' : parse_hgnc}
+    try:
+        parser = parsers[file_format.lower()]
+    except KeyError:
+        msg = 'Mapping file format "{}" not recognized'
+        raise ValueError(msg.format(file_format))
+    with open_file(infile) as inF:
+        for x in parser(inF):
+            yield x
+
+
+def parse_acc2taxid(inF):
+    for line in inF:
+        line = line.rstrip('\n').split('\t')
+        if line[0] == 'accession' or len(line) < 3:
+            continue
+        yield ('accession', 'taxid', line[0], line[2])
+        yield ('accession', 'taxid', line[1], line[2])
+
+
+def parse_gene2accession(inF):
+    for line in inF:
+        if line.startswith('#'):
+            continue
+        line = line.rstrip('\n').split('\t')
+        # RNA, protein & genomic accessions
+        for i in (3, 5, 7):
+            if i >= len(line) or line[i] == '-':
+                continue
+            yield ('accession', 'taxid', line[i], line[0])
+            yield ('accession', 'taxid', strip_version(line[i]), line[0])
+
+
+def parse_gene2ensembl(inF):
+    for line in inF:
+        if line.startswith('#'):
+            continue
+        line = line.rstrip('\n').split('\t')
+        if len(line) < 5:
+            continue
+        # Ensembl gene & transcript
+        for i in (2, 4):
+            if line[i] == '-':
+                continue
+            yield ('ensembl', 'entrez', line[i], line[1])
+            yield ('ensembl', 'entrez', strip_version(line[i]), line[1])
+
+
+def parse_uniprot(inF):
+    for line in inF:
+        line = line.rstrip('\n').split('\t')
+        if len(line) < 3 or line[1] != 'GeneID':
+            continue
+        yield ('uniprot', 'entrez', line[0], line[2])
+        yield ('entrez', 'uniprot', line[2], line[0])
+
+
+def parse_hgnc(inF):
+    header = inF.readline().rstrip('\n').split('\t')
+    header = [x.lower().replace(' ', '_') for x in header]
+    try:
+        hgnc_col = header.index('hgnc_id')
+    except ValueError:
+        raise ValueError('HGNC file: no "HGNC ID" column')
+    entrez_col = None
+    for x in ('ncbi_gene_id', 'entrez_id', 'entrez_gene_id',
+              'ncbi_gene_id(supplied_by_ncbi)'):
+        if x in header:
+            entrez_col = header.index(x)
+            break
+    if entrez_col is None:
+        raise ValueError('HGNC file: no "NCBI Gene ID" column')
+    for line in inF:
+        line = line.rstrip('\n').split('\t')
+        if max(hgnc_col, entrez_col) >= len(line) or line[entrez_col] == '':
+            continue
+        hgnc = line[hgnc_col]
+        yield ('hgnc', 'entrez', hgnc, line[entrez_col])
+        # "HGNC:9245" -> "9245"
+        if hgnc.startswith('HGNC:'):
+            yield ('hgnc', 'entrez', hgnc[5:], line[entrez_col])
+
+
+class IDMap(object):
+    """Indexed local store of ID mappings (SQLite).
+    Each (src_type, dst_type, src_ID) maps to 1 dst_ID; if a mapping file
+    has >1 dst_ID for an ID, the first one is kept.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS idmap ('
+                          ' src TEXT NOT NULL, dst TEXT NOT NULL,'
+                          ' src_id TEXT NOT NULL, dst_id TEXT NOT NULL,'
+                          ' PRIMARY KEY (src, dst, src_id)) WITHOUT ROWID')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def ingest(self, mappings):
+        """Adding mappings: iterable of (src_type, dst_type, src_ID, dst_ID).
+        Returns the number of mappings added.
+        """
+        self.conn.execute('PRAGMA synchronous=OFF')
+        sql = 'INSERT OR IGNORE INTO idmap VALUES (?, ?, ?, ?)'
+        n_before = self.conn.total_changes
+        chunk = []
+        for x in mappings:
+            chunk.append(x)
+            if len(chunk) >= INSERT_CHUNK:
+                self.conn.executemany(sql, chunk)
+                self.conn.commit()
+                chunk = []
+        if len(chunk) > 0:
+            self.conn.executemany(sql, chunk)
+        self.conn.commit()
+        self.conn.execute('PRAGMA synchronous=FULL')
+        return self.conn.total_changes - n_before
+
+    def lookup(self, src, dst, IDs):
+        """Looking up IDs in bulk; returns {src_ID : dst_ID} for IDs found
+        """
+        found = {}
+        IDs = list(IDs)
+        for i in range(0, len(IDs), LOOKUP_CHUNK):
+            chunk = IDs[i:i+LOOKUP_CHUNK]
+            sql = ('SELECT src_id, dst_id FROM idmap'
+                   ' WHERE src = ? AND dst = ? AND src_id IN ({})')
+            sql = sql.format(','.join(['?'] * len(chunk)))
+            for src_id,dst_id in self.conn.execute(sql, [src, dst] + chunk):
+                found[src_id] = dst_id
+        return found
+
+    def convert(self, src, dst, IDs, chunk_size=10000):
+        """Converting IDs locally, looking up chunk_size IDs at a time.
+        Yields [ID, dst_ID] (dst_ID = None if not in the store)
+        """
+        chunk = []
+        for ID in IDs:
+            chunk.append(ID)
+            if len(chunk) >= chunk_size:
+                for x in self._convert_chunk(src, dst, chunk):
+                    yield x
+                chunk = []
+        for x in self._convert_chunk(src, dst, chunk):
+            yield x
+
+    def _convert_chunk(self, src, dst, IDs):
+        found = self.lookup(src, dst, IDs)
+        return [[ID, found.get(ID)] for ID in IDs]
@@ -0,0 +1,169 @@
+# import
+## batteries
+import os
+import sys
+import json
+import time
+
+
+# global variables
+FLUSH_EVERY = 100     # records
+FLUSH_SECS = 5.0      # seconds
+
+
+# functions
+def add_args(parser):
+    """Adding the checkpoint options to an argparse parser
+    """
+    ckpt = parser.add_argument_group('Checkpoint')
+    ckpt.add_argument('--journal', default=None,
+                      help='Checkpoint journal of completed IDs; "<outfile>.journal" by default if writing to a file (default: %(default)s)')
+    ckpt.add_argument('--resume', action='store_true', default=False,
+                      help='Resume a job from its journal; completed IDs are not re-queried (default: %(default)s)')
+    return ckpt
+
+
+def from_args(args, params=None, stdout=('-', 'STDOUT')):
+    """Creating a Journal object from parsed args
+    (None if writing to STDOUT & no --journal).
+    params : job parameters that must match when resuming (eg., the method)
+    """
+    path = args.journal
+    if path is None and args.outfile not in stdout:
+        path = args.outfile + '.journal'
+    if path is None:
+        if args.resume is True:
+            raise ValueError('--resume requires --journal or --outfile')
+        return None
+    return Journal(path, params=params, resume=args.resume)
+
+
+def is_failed(x):
+    """A result is a failure if it is None or has a null value
+    (eg., [ID, None] for an ID that could not be converted)
+    """
+    return x is None or any(v is None for v in x[1:])
+
+
+class Journal(object):
+    """Append-only checkpoint journal of completed results.
+    The first line holds the job parameters; each other line is
+    `ID<tab>JSON result`. Failed results (see is_failed) are not
+    journaled, so they are re-queried on resume. Lines are buffered &
+    flushed every FLUSH_EVERY records or FLUSH_SECS seconds, so a crash
+    loses little work and the journal adds little overhead. A partial
+    last line (crash mid-write) is ignored on resume.
+    """
+    def __init__(self, path, params=None, resume=False):
+        """path : journal file path
+        params : job parameters (JSON serializable)
+        resume : load the results in an existing journal & append to it;
+                 otherwise, the journal is started over
+        """
+        self.path = path
+        self.params = params
+        self.done = {}
+        self.failed = 0
+        self._n = 0
+        self._last_flush = time.time()
+        if resume and os.path.isfile(path):
+            self.load()
+            self._fh = open(path, 'a')
+            msg = 'Resuming from {}: {} IDs already done\n'
+            sys.stderr.write(msg.format(path, len(self.done)))
+        else:
+            if resume:
+                msg = 'WARNING: no journal at {}; starting over\n'
+                sys.stderr.write(msg.format(path))
+            self._fh = open(path, 'w')
+            self._fh.write(json.dumps(params) + '\n')
+            self._fh.flush()
+
+    def load(self):
+        """Loading the completed results in the journal
+        """
+        with open(self.path) as inF:
+            params = json.loads(inF.readline() or 'null')
+            if params != self.params:
+                msg = 'Journal {} is for a different job ({}); use a new --journal'
+                raise ValueError(msg.format(self.path, params))
+            for line in inF:
+                if not line.endswith('\n'):
+                    break
+                try:
+                    ID,value = line.rstrip('\n').split('\t', 1)
+                    value = json.loads(value)
+                except ValueError:
+                    break
+                if not is_failed(value):
+                    self.done[ID] = value
+        # dropping a partial last line before appending
+        self._truncate_partial()
+
+    def _truncate_partial(self):
+        size = os.path.getsize(self.path)
+        if size == 0:
+            return
+        with open(self.path, 'rb+') as outF:
+            outF.seek(size - 1)
+            if outF.read(1) == b'\n':
+                return
+            outF.seek(0)
+            data = outF.read()
+            outF.truncate(data.rfind(b'\n') + 1)
+
+    def add(self, ID, value):
+        self._fh.write(str(ID) + '\t' + json.dumps(value) + '\n')
+        self._n += 1
+        now = time.time()
+        if self._n % FLUSH_EVERY == 0 or now - self._last_flush >= FLUSH_SECS:
+            self._fh.flush()
+            self._last_flush = now
+
+    def record(self, results):
+        """Recording each result ([ID, ...]) as it is yielded.
+        Failed results (see is_failed) are not recorded, so they are
+        retried on resume.
+        """
+        for x in results:
+            if is_failed(x):
+                self.failed += 1
+            else:
+                self.add(x[0], x)
+            yield x
+
+    def resume(self, IDs, func, ordered=True):
+        """Merging completed results with new results.
+        IDs : list of unique IDs
+        func : function(iterable of IDs) -> iterable of results, for the
+               IDs not yet done (in order, if ordered=True)
+        Yields the results for all IDs (in the order of IDs if
+        ordered=True; otherwise, completed results are yielded first).
+        New results are recorded in the journal.
+        """
+        todo = (x for x in IDs if x not in self.done)
+        new = self.record(func(todo))
+        if not ordered:
+            for ID in IDs:
+                if ID in self.done:
+                    yield self.done[ID]
+            for x in new:
+                yield x
+            return
+        for ID in IDs:
+            try:
+                yield self.done[ID]
+            except KeyError:
+                yield next(new)
+
+    def close(self, remove=False):
+        """Closing the journal; remove=True if the job completed.
+        The journal is kept if any IDs failed, so that they can be
+        retried with --resume.
+        """
+        self._fh.close()
+        if remove and self.failed > 0:
+            msg = 'WARNING: {} IDs failed; re-run with --resume to retry them (journal: {})\n'
+            sys.stderr.write(msg.format(self.failed, self.path))
+        elif remove and os.path.isfile(self.path):
+            os.remove(self.path)
@@ -2,12 +2,13 @@
 ## batteries
 import os
 import sys
-import time
 import argparse
-import requests
 import functools
-import multiprocessing as mp
 import xml.etree.ElementTree as ET
+## package
+from leylab_pipelines.DB import HTTP
+from leylab_pipelines.DB import Cache
+from leylab_pipelines.DB import Journal
 
 
 # functions
@@ -20,9 +21,23 @@ def parse_args(test_args=None, subparsers=None):
     desc = get_desc()
     epi = """DESCRIPTION:
     Get NCBI lineages for >=1 taxonomy ID (in parallel).
-    The entrez API is used for querying.
+    The entrez API is used for querying. All requests share one
+    connection pool and are rate limited to the NCBI limits
+    (3 requests/sec, or 10 requests/sec with an NCBI API key).
 
     If you have many thousands of IDs, then consider using taxID2LinTbl instead.
+
+    Lineages are written as soon as they are retrieved (in input order,
+    unless --unordered is used).
+
+    Lineages are cached on disk (see --cache), so taxIDs queried
+    in previous runs are not re-queried.
+
+    Retrieved lineages are recorded in a journal (see --journal) as they
+    complete. If a job dies, re-run it with --resume to only query the
+    remaining taxIDs. Failed lookups are not journaled, so --resume also
+    retries them. The journal is removed once the job completes with no
+    failures.
     """
     if subparsers:
         parser = subparsers.add_parser('taxID2lin', description=desc, epilog=epi,
@@ -43,16 +58,24 @@ def parse_args(test_args=None, subparsers=None):
                      help='Header in input table? (default: %(default)s)')
     io.add_argument('-o', '--outfile', default='STDOUT',
                      help='Output file name; "STDOUT" if to STDOUT (default: %(default)s)')
+    io.add_argument('-u', '--unordered', action='store_true', default=False,
+                     help='Write lineages as they are retrieved instead of in input order (default: %(default)s)')
 
     lin = parser.add_argument_group('Lineage')
     lin.add_argument('-l', '--levels', type=int, default=8,
                      help='Number of taxonomic levels (default: %(default)s)')                     
 
     misc = parser.add_argument_group('Misc')
+    misc.add_argument('-k', '--api-key', default=os.environ.get('NCBI_API_KEY'),
+                      help='NCBI API key; $NCBI_API_KEY by default (default: %(default)s)')
     misc.add_argument('-t', '--tries', type=int, default=3,
                       help='Number of tries to make each request. (default: %(default)s)')
-    misc.add_argument('-p', '--procs', type=int, default=1,
-                      help='Number of processors to use. (default: %(default)s)')
+    misc.add_argument('-p', '--procs', type=int, default=4,
+                      help='Number of parallel requests. (default: %(default)s)')
+    misc.add_argument('--executor', default='async', choices=HTTP.EXECUTORS,
+                      help='Concurrency mode for the parallel requests: asyncio + thread pool, or just a thread pool (default: %(default)s)')
+    Cache.add_args(parser)
+    Journal.add_args(parser)
 
     # running test args
     if test_args:
@@ -68,33 +91,57 @@ def main(args=None):
     # getting taxonomy IDs
     taxIDs = get_taxIDs(args.taxID, col_idx=args.column, sep=args.sep, header=args.header)
 
-    # getting lineages
-    procs = int(args.procs)
-    if procs < 2:
-        procs = None
-    pool = mp.Pool(processes = procs)
-    func = functools.partial(query_ncbi_lineage, levels=args.levels, tries=args.tries)
-    lineages = pool.map(func, taxIDs)
-
-    # writing lineages
-    write_lineages(lineages, args.outfile, args.levels)
+    # getting & writing lineages (streaming)
+    cache = Cache.from_args(args)
+    journal = Journal.from_args(args, params={'levels' : args.levels})
+    with HTTP.Client(workers=args.procs, tries=args.tries,
+                     api_key=args.api_key, executor=args.executor) as client:
+        func = functools.partial(query_ncbi_lineage, levels=args.levels,
+                                 client=client, cache=cache)
+        query = functools.partial(client.imap, func,
+                                  ordered=not args.unordered)
+        if journal is None:
+            lineages = query(taxIDs)
+        else:
+            lineages = journal.resume(taxIDs, query,
+                                      ordered=not args.unordered)
+        write_lineages(lineages, args.outfile, args.levels)
+    if journal is not None:
+        journal.close(remove=True)
+    if cache is not None:
+        cache.report()
+        cache.close()
 
 
 def write_lineages(lineages, outfile, levels):
+    """Writing lineages as they are generated
+    """
     if outfile == 'STDOUT':
         outF = sys.stdout
     else:
-        outF = open(outfile, 'r')
+        outF = open(outfile, 'w')
 
     header = ['taxID'] + ['rank_{}'.format(x+1) for x in range(levels)]
     outF.write('\t'.join(header) + '\n')
 
     for lin in lineages:
-        outF.write('\t'.join(lin) + '\n')
+        if lin is None:
+            continue
+        outF.write('\t'.join([format_taxon(x) for x in lin]) + '\n')
+        outF.flush()
 
-    outF.close()
+    if outfile != 'STDOUT':
+        outF.close()
         
 
+def format_taxon(x):
+    """Taxon name to string; None (failed lookup) = 'unclassified'
+    """
+    if x is None:
+        return 'unclassified'
+    return str(x)
+
+
 def get_taxIDs(infile, col_idx=1, sep='\t', header=False):
     col_idx = int(col_idx) - 1
 
@@ -125,44 +172,64 @@ def get_taxIDs(infile, col_idx=1, sep='\t', header=False):
             sys.stderr.write(msg.format(x))
             
     # ret
-    return taxIDs.keys()
+    return list(taxIDs.keys())
     
 
-def query_ncbi_lineage(taxon_id, levels=9, tries=3):
+def format_lineage(taxon_id, lin, levels=9):
+    """Truncating or expanding (with 'unclassified') a lineage
+    to `levels` taxonomic levels
+    """
+    if len(lin) > levels:
+        lin = lin[0:levels]
+    elif len(lin) < levels:
+        lin = lin + ['unclassified'] * (levels - len(lin))
+    return [taxon_id] + lin
+
+
+def query_ncbi_lineage(taxon_id, levels=9, tries=3, client=None, cache=None):
     """Obtain the NCBI lineage for a taxon ID
     
     Parameters
     ----------
     taxon_id : int
         The taxon ID of interest
+    levels : int
+        Number of taxonomic levels to return
+    tries : int
+        Number of tries to make the request (if no client provided)
+    client : HTTP.Client
+        Shared HTTP client (rate limiting & retries)
+    cache : Cache.Cache
+        Cache of full lineages (no caching if None)
     
     Returns
     -------
     list or None
         Each taxon name or None if unable to retreive the taxon details
+        (the taxon names are None if the request failed)
     """
     url = "http://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
+
+    # cached lineage?
+    if cache is not None:
+        lin = cache.get('efetch/taxonomy', taxon_id)
+        if lin is not None:
+            return format_lineage(taxon_id, lin, levels)
     
     # Define our parameters to use in our query
     params = {'db': 'taxonomy',  # We want to query the taxonomy database
               'id': taxon_id}    # We're requesting detail on the taxon ID specifically
     
-    for i in range(tries):
-        # Make the request
-        r = requests.get(url, params=params)
-    
-        # Bail if we received a bad status
-        if r.status_code != 200:
-            if i < tries-1:
-                msg = 'WARNING: status code = {} for taxID {}. Retrying\n'
-                sys.stderr.write(msg.format(r.status_code, taxon_id))
-                time.sleep(3)
-            else:
-                msg = 'WARNING: status code = {} for taxID {}. Giving up\n'
-                sys.stderr.write(msg.format(r.status_code, taxon_id))
-                return [taxon_id] + ['unclassified'] * levels
-        else:
-            break
+    # Make the request (retried by the client)
+    if client is None:
+        client = HTTP.Client(tries=tries)
+    r = client.get(url, params=params)
+
+    # Bail if we received a bad status
+    if r.status_code != 200:
+        msg = 'WARNING: status code = {} for taxID {}. Giving up\n'
+        sys.stderr.write(msg.format(r.status_code, taxon_id))
+        return [taxon_id] + [None] * levels
     
     # NCBI returns XML, so we need to parse the "content" of our request into a usable structure
     tree = ET.fromstring(r.content)
@@ -176,12 +243,10 @@ def query_ncbi_lineage(taxon_id, levels=9, tries=3):
     if lineage is not None:
         # splitting lineages
         lin = [v.strip() for v in lineage.text.split(';')]
+        if cache is not None:
+            cache.set('efetch/taxonomy', taxon_id, lin)
         # expanding if needed
-        if len(lin) > levels:
-            lin = lin[0:levels]
-        elif len(lin) < levels:
-            lin = lin + ['unclassified'] * (levels - len(lin))
-        return [taxon_id] + lin
+        return format_lineage(taxon_id, lin, levels)
         
     else:
         return None
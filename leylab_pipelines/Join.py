@@ -1,14 +1,37 @@
 # import
 ## batteries
 import os
+import io
 import sys
+import time
+import csv
 import glob
+import gzip
+import json
+import mmap
 import tempfile
 import argparse
 import logging
+import re
 import shutil
+import operator
+import pickle
+import uuid
+import functools
+import importlib.util
+import threading
+import contextlib
+try:
+    import resource
+except ImportError:
+    resource = None
 ## 3rd party
+import numpy as np
+import pandas as pd
+import dask
 import dask.dataframe as dd
+from dask.callbacks import Callback
+from dask.utils import key_split
 ## package
 from leylab_pipelines import Utils 
 
@@ -35,15 +58,162 @@ def parse_args(test_args=None, subparsers=None):
          --join 'accession=Acc'
       This can be extended to multiple column joins with a comma-sep list.
 
+    MULTI-TABLE JOIN:
+      >2 tables can be joined in 1 pass: the 1st table is joined with the
+      2nd table, that result is joined with the 3rd table, etc. Use 1
+      --join per joined table (table 2, 3, ...), with the left column(s)
+      from the joined table so far and the right column(s) from the
+      next table. For example, to add taxIDs & then lineages to hits:
+         LLP join hits.txt acc2taxid.txt lineages.txt \\
+           --join 'accession=acc' --join 'taxid=tax_id'
+      If only 1 --join is provided, it is used for all joins.
+      --how applies to all joins. -L applies to the left column(s) of
+      each join, and --columnsL/--filterL to the 1st table;
+      -R/--columnsR/--filterR apply to each joined table (2, 3, ...).
+      The whole chain runs in 1 dask pipeline (no intermediate files):
+      each table <= --broadcast-max is broadcast (loaded into memory
+      once) if the join type is supported (inner or left); the other
+      tables are joined with a dask hash join (see KEY ENCODING). With
+      --engine index, all joined tables must have a join index. The sort
+      engine & --presorted only support 2 tables.
+
     DTYPEs:
       The -L and -R options designate the dtypes (eg. 'object' or 'float')
       for the columns that are joined (see JOIN). The dtypes MUST match for
-      the matched joined columns. If only 1 dtype is provided for multiple 
+      the matched joined columns; joining on columns of different kinds
+      (eg., int & str) raises an error. If only 1 dtype is provided for multiple 
       join columns, then that dtype is applied to all join columns.
+      Integer dtypes (eg., 'int64') are the most memory-efficient keys.
+
+    KEY ENCODING:
+      String join keys of the dask engine can be dictionary-encoded
+      before the merge: the unique keys of both tables are collected (in
+      1 pass over just the join columns) into 1 shared, sorted dictionary
+      per join column pair, and both tables are merged on the integer
+      codes (the keys are decoded in the output). This reduces the memory
+      & shuffle volume of keys stored as python objects. The key memory
+      usage before & after encoding is logged.
+      auto = keys stored as python objects (eg., dtype 'object', or 'str'
+        if pandas does not use pyarrow strings) are converted to (compact)
+        pyarrow strings; no extra pass over the tables
+      dict = dictionary-encode all string keys
+      none = no encoding
+      Keys with other dtypes (eg., int) are never encoded.
+
+    ENGINES:
+      dask = hash join of both tables with dask.dataframe.merge, which
+        shuffles both tables (spilling to *.partd temp dirs)
+      broadcast = the smaller table is loaded into memory & hashed once,
+        and the larger table is streamed past it in partitions (in
+        parallel); no shuffle. Supported for --how inner, and for
+        left/right joins if the larger table is the left/right table.
+      sort = external sort-merge join: each table is read in chunks that
+        fit in --memory, which are sorted by the join key(s) & written as
+        compressed runs to --tmp-dir. The runs are then k-way merged &
+        the 2 sorted tables are merge-joined, with the output streamed
+        (in key order). Memory usage is bounded by --memory, for tables
+        of any size, unless the rows of 1 join key do not fit in memory
+        in both tables (a warning is logged); a key with too many rows in
+        just 1 table is joined in chunks. Supports all --how joins.
+      index = the table with a join index (see INDEX) is not read; the
+        rows matching each partition of the other table are fetched by
+        their offsets in the table file. Supported for --how inner, and
+        for left/right joins if the indexed table is the right/left table.
+      auto = index if a table has an (up-to-date) index on the join
+        column; otherwise broadcast if the smaller table file is <= --broadcast-max
+        (and the join type is supported); otherwise sort if the smaller
+        table file is > --memory; otherwise dask
+      presorted = see --presorted (PRESORTED)
+
+    PRESORTED:
+      If both tables are (uncompressed, text) tables already sorted by the
+      join column(s) (in the order of the join column dtypes; missing keys
+      first), --presorted joins them without a shuffle: split keys are
+      sampled at evenly spaced offsets of the larger table, the offset of
+      each split key in each table is found by binary search, and the
+      matching key ranges of both tables are read & merged in parallel
+      (1 range per --npartitions; by default, 1 per --blocksize of the
+      larger table). The output is written in key order. Supports the
+      inner, left, right & outer joins. Unsorted key ranges raise an
+      error. --presorted cannot be combined with --engine.
+
+    SEMI/ANTI JOIN:
+      --how semi = the rows of the left table with key(s) in the right table
+      --how anti = the rows of the left table with key(s) NOT in the right table
+      Only the left table columns are written. The set of unique keys of
+      the right table is loaded into memory (only the join columns are
+      read), and the left table is streamed past it in partitions (in
+      parallel), so the output starts with the 1st partition & memory
+      usage is bounded by the key set. Missing keys never match. --engine
+      does not apply. For >2 tables, each table filters the rows of the
+      1st table.
+
+    INDEX:
+      --build-index REF writes a join index of the (uncompressed, text)
+      table REF on the column --index-key: the row offsets of REF sorted
+      by key hash (REF.idx.npy, memory-mapped by later joins) & its
+      metadata (REF.idx.json). Later joins on that column use the index
+      (see ENGINES) until REF is modified. Only single-column joins can
+      use an index. If no tables are provided, just the index is built.
+         LLP join --build-index lineages.txt --index-key taxid
+
+    SCHEDULER:
+      The dask & broadcast engines run on a dask scheduler:
+      threads = 1 process, --procs threads (dask default)
+      processes = --procs worker processes
+      distributed = local dask.distributed cluster of --procs worker
+        processes, each limited to --worker-memory (requires the
+        `distributed` package)
+      Input tables are read in partitions of --blocksize bytes (gzip'ed
+      tables are 1 partition each). The partition counts are logged.
+
+    FORMATS:
+      Tables ending in ".parquet" (or ".pq", or a directory of parquet
+      files) or ".feather" (or ".arrow") are read as columnar tables
+      (requires the `pyarrow` package); all other tables are read as
+      delimited text (see --sep). The dtypes of the join columns (see
+      DTYPEs) are applied to all formats.
+      --columnsL/--columnsR = comma-sep list of the columns to read from
+        the table (the join columns are always read). Only these
+        columns are read from parquet/feather tables.
+      --filterL/--filterR = comma-sep list of row filters that must all
+        be true, in the format: 'COLUMN OP VALUE', where OP is one of
+        ==, !=, <, <=, >, >=
+        For example: --filterR 'evalue<1e-5,pident>=90'
+        For parquet/feather tables, the filters are pushed down to the
+        reader (row groups that cannot match are skipped).
 
     OUTPUT:
-      The table partitions will be written to separate temporary files, then
-      joined into the final output file (designated with --outfile)
+      The joined table partitions are streamed to the output file
+      (designated with --outfile) in order as they are computed.
+      Partitions computed ahead of the next partition to write are held
+      in memory (up to 256 Mb) or spilled to a temporary file. If the output file ends in ".gz", the
+      output is gzip'ed (each partition is compressed in parallel).
+      If the output file ends in ".parquet" or ".feather", the output is
+      a parquet file (1 row group per partition) or a feather (arrow IPC)
+      file (requires the `pyarrow` package).
+
+    PROFILE:
+      --profile FILE writes a JSON report of the join to FILE:
+      stages = wall time (seconds) of each stage: plan (reading the
+        small/key tables & building the task graph), execute (computing
+        & writing the output; streamed), sort_runs (sort engine; part
+        of execute)
+      tasks = time (seconds, summed over workers) & number of tasks per
+        task type (eg., read, shuffle, merge, format); local schedulers
+        only (null with --scheduler distributed)
+      write = time (seconds) & number of blocks written to the output
+      rows = rows in each input table (before filtering) & in the output,
+        counted as the tables are read (from the metadata of parquet &
+        feather tables; indexed rows for a table joined with its index).
+        The rows of text tables read by dask tasks are only counted with
+        --scheduler threads (null otherwise)
+      partitions = number of partitions of each input table & the output
+      peak_rss_mb = peak resident memory of this process & of its child
+        (worker) processes
+      spill_bytes = peak size of the *.partd shuffle & sort engine run
+        files in the temp dir(s)
+      unsupported = why any of the above are null
     """
     if subparsers:
         parser = subparsers.add_parser('join', description=desc, epilog=epi,
@@ -54,25 +224,69 @@ def parse_args(test_args=None, subparsers=None):
 
     # args
     io = parser.add_argument_group('Input/Output')
-    io.add_argument('table', metavar='table', type=str, nargs=2,
-                     help='File names of the tables to join on')
+    io.add_argument('table', metavar='table', type=str, nargs='*',
+                     help='File names of the tables (>=2) to join on. See MULTI-TABLE JOIN')
     io.add_argument('-o', '--outfile', default='-',
                      help='Output file name; "-" if to STDOUT (default: %(default)s)')
+    io.add_argument('--columnsL', default=None,
+                     help='Columns to read from the left table; all if None. See FORMATS (default: %(default)s)')
+    io.add_argument('--columnsR', default=None,
+                     help='Columns to read from the right table; all if None. See FORMATS (default: %(default)s)')
+    io.add_argument('--filterL', default=None,
+                     help='Row filters for the left table. See FORMATS (default: %(default)s)')
+    io.add_argument('--filterR', default=None,
+                     help='Row filters for the right table. See FORMATS (default: %(default)s)')
     jn = parser.add_argument_group('How to join')
-    jn.add_argument('-j', '--join', default='1=1',
-                     help='Columns to join on. See DESCRIPTION (default: %(default)s)')
+    jn.add_argument('-j', '--join', default=None, action='append',
+                     help='Columns to join on; 1 per joined table. See DESCRIPTION (default: 1=1)')
     jn.add_argument('-H', '--how', default='inner',
-                     help='How to join the tables (default: %(default)s)')                    
+                     choices=['inner', 'left', 'right', 'outer', 'semi', 'anti'],
+                     help='How to join the tables. See SEMI/ANTI JOIN (default: %(default)s)')                    
     jn.add_argument('-s', '--sep', default='\t',
                      help='Column separator (default: %(default)s)')
     jn.add_argument('-L', '--dtypeL', default='str',
                      help='dtype(s) for left table join column(s) (default: %(default)s)')    
     jn.add_argument('-R', '--dtypeR', default='str',
                      help='dtype(s) for right table join column(s) (default: %(default)s)')    
+    jn.add_argument('-e', '--engine', default='auto',
+                    choices=['auto', 'dask', 'broadcast', 'sort', 'index'],
+                    help='Join engine. See DESCRIPTION (default: %(default)s)')
+    jn.add_argument('-b', '--broadcast-max', type=float, default=256,
+                    help='Max size (Mb) of the smaller table file for auto-selecting the broadcast engine (default: %(default)s)')
+    jn.add_argument('-M', '--memory', default='2G',
+                    help='Memory budget of the sort engine (eg., 500M or 4G) (default: %(default)s)')
+    jn.add_argument('--presorted', action='store_true', default=False,
+                    help='The tables are sorted by the join column(s). See PRESORTED (default: %(default)s)')
+
+    idx = parser.add_argument_group('Index')
+    idx.add_argument('--build-index', default=None, metavar='REF',
+                     help='Build a join index of table REF. See INDEX (default: %(default)s)')
+    idx.add_argument('--index-key', default=None,
+                     help='Column of REF to index; the 1st column if None (default: %(default)s)')
 
     misc = parser.add_argument_group('Misc')
     misc.add_argument('-c', '--clean', action='store_false', default=True,
                       help='Remove *.partd files from the temporary dir. (default: %(default)s)')
+    misc.add_argument('-p', '--procs', type=int, default=None,
+                      help='Number of workers; all cores if None (default: %(default)s)')
+    misc.add_argument('--scheduler', default='threads',
+                      choices=['threads', 'processes', 'distributed'],
+                      help='dask scheduler. See DESCRIPTION (default: %(default)s)')
+    misc.add_argument('--worker-memory', default='auto',
+                      help='Memory limit per worker (eg., 4G); distributed scheduler only (default: %(default)s)')
+    misc.add_argument('--blocksize', default='64M',
+                      help='Input partition size (eg., 64M) (default: %(default)s)')
+    misc.add_argument('--npartitions', type=int, default=None,
+                      help='Number of output partitions of the dask engine; max of the inputs if None (default: %(default)s)')
+    misc.add_argument('--key-encoding', default='auto', choices=['auto', 'dict', 'none'],
+                      help='Encoding of string join keys of the dask engine. See KEY ENCODING (default: %(default)s)')
+    misc.add_argument('-T', '--tmp-dir', default=None,
+                      help='Directory for the sort engine runs; the system temp dir if None (default: %(default)s)')
+    misc.add_argument('--profile', default=None, metavar='FILE',
+                      help='Write a JSON profile of the join to FILE. See PROFILE (default: %(default)s)')
+
+    # the parser, for check_args
+    parser.set_defaults(join_parser=parser)
 
     # running test args
     if test_args:
@@ -80,6 +294,23 @@ def parse_args(test_args=None, subparsers=None):
         return args
         
 
+def check_args(args, parser):
+    """Checking user input: incompatible options are a parser error
+    (usage message & exit code 2)
+    """
+    error = parser.error
+    if len(args.table) > 2:
+        if args.engine == 'sort':
+            error('The sort engine only supports 2 tables')
+        if args.presorted:
+            error('--presorted only supports 2 tables')
+    if args.presorted:
+        if args.engine != 'auto':
+            error('--presorted is a join engine; it cannot be used with --engine {}'.format(args.engine))
+        if args.how in ('semi', 'anti'):
+            error('--presorted cannot be used with --how {}'.format(args.how))
+
+
 def parse_join(join_str):
     """Parsing joing string in form of 'X=X,Y=Y'
     """
@@ -87,7 +318,8 @@ def parse_join(join_str):
     for x in join_str.split(','):
         y = x.split('=')
         if len(y) != 2:
-            msg = '--join should be in format "X=X,Y=Y"'
+            msg = '--join should be in format "X=X,Y=Y": {}'
+            raise ValueError(msg.format(join_str))
         try:
             join_on['left'].append(y[0])
         except KeyError:
@@ -108,42 +340,662 @@ def parse_dtype(dtype_str, join_on):
         msg = 'The number of dtypes should be 1 or the same length as --join'
         raise ValueError(msg)
     else:
-        dtypes = {x[i]:dtypes[i] for i in range(len(dtypes))}
+        dtypes = {join_on[i]:dtypes[i] for i in range(len(dtypes))}
     return dtypes
 
 
-def get_table(infile, sep='\t', dtype=None):
-    if infile.endswith('.gz'):
-        compression = 'gzip'
+TASK_STAGES = [('read', 'read'), ('shuffle', 'shuffle'), ('partd', 'shuffle'),
+               ('barrier', 'shuffle'), ('merge', 'merge'), ('block', 'format')]
+
+class Profile(object):
+    """Profile of 1 join run (see PROFILE); created by main & passed to
+    the engines. All methods are no-ops unless enabled.
+    scheduler : dask scheduler of the run. Task timings need a local
+      scheduler (threads or processes), and the rows of text tables read
+      by dask tasks can only be counted by the tasks with the threads
+      scheduler (the tasks share this object); otherwise they are
+      reported as unsupported.
+    """
+    def __init__(self, enabled=False, scheduler='threads'):
+        self.enabled = enabled
+        self.scheduler = scheduler
+        self.start = time.time()
+        self.stages = {}
+        self.tasks = {}
+        self.rows = {}
+        self.partitions = {}
+        self.write_stats = None
+        self.unsupported = {}
+        self.spill_bytes = 0
+        self.token = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        if enabled and scheduler == 'distributed':
+            msg = 'task timings require a local scheduler (--scheduler threads or processes)'
+            self.unsupported['tasks'] = msg
+
+    def __dask_tokenize__(self):
+        # by identity (see BroadcastTable)
+        return self.token
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Timing a stage (wall time)"""
+        if not self.enabled:
+            yield
+            return
+        t = time.time()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0) + time.time() - t
+
+    def add_rows(self, name, n, part=0):
+        """Rows of partition part of table name; a recomputed partition
+        is only counted once
+        """
+        if self.enabled:
+            with self._lock:
+                self.rows.setdefault(name, {})[part] = n
+
+    def table_rows(self, infile):
+        """Rows of a parquet/feather table, from its metadata"""
+        if self.enabled:
+            self.add_rows(infile, arrow_dataset(infile).count_rows())
+
+    def task_rows(self, name):
+        """Can the read tasks of table name count its rows? (threads
+        scheduler only; otherwise, its rows are reported as unsupported)
+        """
+        if not self.enabled:
+            return False
+        if self.scheduler == 'threads':
+            return True
+        self.rows[name] = None
+        msg = 'rows of text tables read by dask tasks require --scheduler threads'
+        self.unsupported['rows'] = msg
+        return False
+
+    def set_partitions(self, name, n):
+        if self.enabled:
+            self.partitions[name] = n
+
+    def add_task(self, name, seconds):
+        with self._lock:
+            x = self.tasks.setdefault(name, [0, 0.0])
+            x[0] += 1
+            x[1] += seconds
+
+    def callback(self):
+        """dask callback timing each task (submit to done), by task name
+        (null context if disabled or not supported)
+        """
+        if not self.enabled or 'tasks' in self.unsupported:
+            return contextlib.nullcontext()
+        starts = {}
+        def pretask(key, dsk, state):
+            starts[key] = time.time()
+        def posttask(key, result, dsk, state, worker_id):
+            if key in starts:
+                self.add_task(key_split(key), time.time() - starts.pop(key))
+        return Callback(pretask=pretask, posttask=posttask)
+
+    @contextlib.contextmanager
+    def monitor_spill(self, dirs, interval=0.5):
+        """Polling the size of the spill files in dirs (peak size)"""
+        if not self.enabled:
+            yield
+            return
+        done = threading.Event()
+        def poll():
+            while True:
+                size = 0
+                for d in dirs:
+                    for x in glob.glob(os.path.join(d, 'tmp*.partd')) + \
+                             glob.glob(os.path.join(d, 'LLP_join_*')):
+                        for root,_,files in os.walk(x):
+                            for f in files:
+                                try:
+                                    size += os.path.getsize(os.path.join(root, f))
+                                except OSError:
+                                    pass
+                self.spill_bytes = max(self.spill_bytes, size)
+                if done.wait(interval):
+                    break
+        thread = threading.Thread(target=poll)
+        thread.daemon = True
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
+
+    def report(self):
+        total = time.time() - self.start
+        # sort_runs is part of execute (the sort engine is a generator)
+        stages = {'plan' : total - sum([y for x,y in self.stages.items()
+                                        if x != 'sort_runs'])}
+        stages.update(self.stages)
+        stages['total'] = total
+        tasks = None
+        if 'tasks' not in self.unsupported:
+            tasks = {}
+            for name,(n,secs) in sorted(self.tasks.items()):
+                stage = [y for x,y in TASK_STAGES if x in name]
+                stage = stage[0] if len(stage) > 0 else name
+                x = tasks.setdefault(stage, {'n' : 0, 'seconds' : 0.0})
+                x['n'] += n
+                x['seconds'] += secs
+        rows = {x : None if y is None else sum(y.values())
+                for x,y in self.rows.items()}
+        rss = {}
+        if resource is not None:
+            # kb on linux, bytes on mac
+            scale = 1024 ** 2 if sys.platform == 'darwin' else 1024
+            rss['self'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+            rss['children'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+        return {'stages' : stages, 'tasks' : tasks, 'write' : self.write_stats,
+                'rows' : rows, 'partitions' : self.partitions,
+                'peak_rss_mb' : rss, 'spill_bytes' : self.spill_bytes,
+                'unsupported' : self.unsupported}
+
+    def write(self, outfile):
+        with open(outfile, 'w') as outF:
+            json.dump(self.report(), outF, indent=2, sort_keys=True)
+            outF.write('\n')
+        logging.info('profile written to: {}'.format(outfile))
+
+
+def count_partition(df, name, profile, partition_info=None):
+    """Counting the rows of a partition of table name (in its read task)
+    """
+    part = partition_info['number'] if partition_info else 0
+    profile.add_rows(name, len(df), part)
+    return df
+
+
+def table_format(infile):
+    """Table format from the file name: 'parquet', 'feather' or 'text'
+    """
+    x = infile.lower()
+    if x.endswith(('.parquet', '.pq')) or os.path.isdir(infile):
+        return 'parquet'
+    if x.endswith(('.feather', '.arrow')):
+        return 'feather'
+    return 'text'
+
+
+def path_size(infile):
+    """Size (bytes) of a file or of all files in a directory
+    """
+    if not os.path.isdir(infile):
+        return os.path.getsize(infile)
+    size = 0
+    for root,dirs,files in os.walk(infile):
+        size += sum([os.path.getsize(os.path.join(root, x)) for x in files])
+    return size
+
+
+def parse_columns(columns_str, join_on):
+    """Parsing a comma-sep list of columns to read; the join columns
+    are always included. Returns None if all columns are read.
+    """
+    if columns_str is None:
+        return None
+    columns = list(join_on)
+    for x in columns_str.split(','):
+        x = x.strip()
+        if x != '' and x not in columns:
+            columns.append(x)
+    return columns
+
+
+FILTER_OPS = {'==' : operator.eq, '!=' : operator.ne,
+              '<=' : operator.le, '>=' : operator.ge,
+              '<' : operator.lt, '>' : operator.gt}
+
+def parse_filters(filter_str):
+    """Parsing row filters in the form of 'X>1,Y==abc'
+    Returns a list of (column, op, value) (or None if no filters)
+    """
+    if filter_str is None:
+        return None
+    filters = []
+    for x in filter_str.split(','):
+        m = re.match(r'^\s*(.+?)\s*(==|!=|<=|>=|<|>|=)\s*(.*?)\s*$', x)
+        if m is None:
+            msg = 'Cannot parse filter "{}"; use eg., "evalue<1e-5"'
+            raise ValueError(msg.format(x))
+        col,op,value = m.groups()
+        if op == '=':
+            op = '=='
+        for func in (int, float):
+            try:
+                value = func(value)
+                break
+            except ValueError:
+                pass
+        filters.append((col, op, value))
+    return filters
+
+
+def apply_filters(df, filters):
+    """Rows (of a pandas or dask dataframe) that pass all filters
+    """
+    if not filters:
+        return df
+    mask = None
+    for col,op,value in filters:
+        x = FILTER_OPS[op](df[col], value)
+        mask = x if mask is None else mask & x
+    return df[mask]
+
+
+def read_columns(columns, filters):
+    """Columns to read: the selected columns + the filter columns
+    """
+    if columns is None or not filters:
+        return columns
+    return columns + [x[0] for x in filters if x[0] not in columns]
+
+
+def select_rows(df, dtype=None, columns=None, filters=None):
+    """Filtering the rows, selecting the columns (in table order) &
+    setting the join column dtypes of a pandas or dask dataframe
+    """
+    df = apply_filters(df, filters)
+    if columns is not None:
+        df = df[[x for x in df.columns if x in columns]]
+    if dtype:
+        df = set_dtypes(df, dtype)
+    return df
+
+
+def set_dtypes(df, dtype):
+    """Casting the columns in dtype ({column : dtype}) of a pandas or dask
+    dataframe; missing values stay missing (eg., not 'nan' for str)
+    """
+    if not isinstance(dtype, dict):
+        dtype = {x:dtype for x in df.columns}
+    cols = {}
+    for col,x in dtype.items():
+        if col in df.columns:
+            cols[col] = df[col].astype(x).where(df[col].notnull())
+    return df.assign(**cols) if len(cols) > 0 else df
+
+
+def arrow_dataset(infile):
+    """parquet/feather table as a pyarrow dataset
+    """
+    try:
+        import pyarrow.dataset as ds
+    except ImportError:
+        msg = 'Reading parquet/feather tables requires the "pyarrow" package'
+        raise ImportError(msg)
+    fmt = table_format(infile)
+    return ds.dataset(infile, format='ipc' if fmt == 'feather' else fmt)
+
+
+def filter_expression(filters):
+    """Row filters as a pyarrow dataset expression (for pushdown)
+    """
+    if not filters:
+        return None
+    import pyarrow.dataset as ds
+    expr = None
+    for col,op,value in filters:
+        x = FILTER_OPS[op](ds.field(col), value)
+        expr = x if expr is None else expr & x
+    return expr
+
+
+def read_table(infile, sep='\t', dtype=None, columns=None, filters=None,
+               profile=None):
+    """Reading a whole table (any format) into memory (pandas)
+    profile : Profile counting the rows of the table
+    """
+    if profile is None:
+        profile = Profile()
+    if table_format(infile) == 'text':
+        df = pd.read_csv(infile, sep=sep, dtype=dtype,
+                         usecols=read_columns(columns, filters))
+        profile.add_rows(infile, len(df))
+    else:
+        profile.table_rows(infile)
+        df = arrow_dataset(infile).to_table(columns=read_columns(columns, filters),
+                                            filter=filter_expression(filters))
+        df = df.to_pandas()
+    return select_rows(df, dtype, columns, filters)
+
+
+def read_chunks(infile, sep='\t', dtype=None, chunksize=100000,
+                columns=None, filters=None, profile=None):
+    """Reading a table (any format) in chunks of <= chunksize rows.
+    Yields pandas dataframes (>=1, even if the table is empty).
+    profile : Profile counting the rows of the table
+    """
+    if profile is None:
+        profile = Profile()
+    usecols = read_columns(columns, filters)
+    if table_format(infile) == 'text':
+        reader = pd.read_csv(infile, sep=sep, dtype=dtype, usecols=usecols,
+                             chunksize=chunksize)
+        for i,df in enumerate(reader):
+            profile.add_rows(infile, len(df), i)
+            yield select_rows(df, dtype, columns, filters)
+        return
+    profile.table_rows(infile)
+    dataset = arrow_dataset(infile)
+    batches = dataset.to_batches(columns=usecols, batch_size=chunksize,
+                                 filter=filter_expression(filters))
+    # batches are split at row groups; combining into chunks
+    import pyarrow as pa
+    buf = []
+    n_rows = 0
+    for batch in batches:
+        buf.append(batch)
+        n_rows += batch.num_rows
+        if n_rows >= chunksize:
+            df = pa.Table.from_batches(buf).to_pandas()
+            yield select_rows(df, dtype, columns, filters)
+            buf = []
+            n_rows = 0
+    if len(buf) > 0 or n_rows == 0:
+        schema = dataset.schema
+        if usecols is not None:
+            schema = pa.schema([schema.field(x) for x in usecols])
+        df = pa.Table.from_batches(buf, schema=schema).to_pandas()
+        yield select_rows(df, dtype, columns, filters)
+
+
+def get_table(infile, sep='\t', dtype=None, blocksize=64 * 1024 ** 2,
+              columns=None, filters=None, profile=None):
+    """Table (any format) as a dask dataframe
+    columns : columns to read (None = all)
+    filters : [(column, op, value)] row filters (None = no filtering)
+    profile : Profile counting the rows & partitions of the table
+    """
+    if profile is None:
+        profile = Profile()
+    usecols = read_columns(columns, filters)
+    fmt = table_format(infile)
+    if fmt == 'parquet':
+        profile.table_rows(infile)
+        df = dd.read_parquet(infile, columns=usecols, filters=filters or None)
+    elif fmt == 'feather':
+        # no partitioned feather reader; partitioning in memory
+        df = read_table(infile, dtype=dtype, columns=columns, filters=filters,
+                        profile=profile)
+        npartitions = max(int(path_size(infile) / blocksize), 1)
+        df = dd.from_pandas(df, npartitions=npartitions, sort=False)
+        logging.info('{}: {} partitions'.format(infile, df.npartitions))
+        profile.set_partitions(infile, df.npartitions)
+        return(df)
     else:
-        compression = None
-    df = dd.read_csv(infile, sep=sep, dtype=dtype, compression=compression)
+        if infile.endswith('.gz'):
+            compression = 'gzip'
+            blocksize = None
+        else:
+            compression = None
+        df = dd.read_csv(infile, sep=sep, dtype=dtype, compression=compression,
+                         blocksize=blocksize, usecols=usecols)
+        if profile.task_rows(infile):
+            df = df.map_partitions(count_partition, infile, profile, meta=df._meta)
+    df = select_rows(df, dtype, columns, filters)
+    logging.info('{}: {} partitions'.format(infile, df.npartitions))
+    profile.set_partitions(infile, df.npartitions)
     return(df)
 
 
-def write_tmp(df):
-    # writing out temporary files
-    tmpDir = tempfile.gettempdir()
-    tempFile = next(tempfile._get_candidate_names())
-    tempFile = os.path.join(tmpDir, tempFile + '*.txt')
-    logging.info('writing temporary files to: {}'.format(tempFile))
-    df.to_csv(tempFile, index=False, sep='\t')
-    return tempFile
+@contextlib.contextmanager
+def dask_scheduler(scheduler='threads', procs=None, worker_memory='auto'):
+    """Running dask computations (in the context) on a scheduler:
+    'threads', 'processes' or 'distributed' (a local cluster)
+    """
+    if scheduler == 'distributed':
+        try:
+            from dask.distributed import Client, LocalCluster
+        except ImportError:
+            msg = 'The distributed scheduler requires the "distributed" package'
+            raise ImportError(msg)
+        if worker_memory != 'auto':
+            worker_memory = parse_size(worker_memory)
+        cluster = LocalCluster(n_workers=procs, threads_per_worker=1,
+                               memory_limit=worker_memory)
+        client = Client(cluster)
+        logging.info('dask distributed cluster: {}'.format(client.dashboard_link))
+        try:
+            yield client
+        finally:
+            client.close()
+            cluster.close()
+        return
+    if worker_memory != 'auto':
+        logging.warning('--worker-memory only applies to the distributed scheduler')
+    with dask.config.set(scheduler=scheduler, num_workers=procs):
+        yield None
+
+
+class OrderedWriter(object):
+    """Writing blocks (bytes or arrow tables) to an output in block order,
+    as the blocks are produced (in any order, by >=1 thread).
+    Out-of-order blocks are held until all preceding blocks are written:
+    in memory up to max_buffer bytes, and spilled (pickled) to a temp
+    file beyond that, so memory usage is bounded however far the blocks
+    are computed ahead of the next block to write.
+    """
+    def __init__(self, outF, max_buffer=256 * 1024 ** 2, tmpdir=None):
+        self.outF = outF
+        self.max_buffer = max_buffer
+        self.tmpdir = tmpdir
+        self.n_blocks = 0
+        self.n_bytes = 0
+        self.n_rows = 0
+        self.n_spilled = 0
+        self.write_time = 0.0
+        self._buf = {}
+        self._buf_bytes = 0
+        self._spill = None
+        self._lock = threading.Lock()
+
+    def put(self, i, data, n_rows=0):
+        with self._lock:
+            if i != self.n_blocks:
+                self.hold(i, data, n_rows)
+                return
+            self.write(data, n_rows)
+            while self.n_blocks in self._buf:
+                self.write(*self.release(self.n_blocks))
+
+    def hold(self, i, data, n_rows):
+        """Holding an out-of-order block (in memory or spilled)"""
+        size = block_size(data)
+        if self._buf_bytes + size <= self.max_buffer:
+            self._buf[i] = (data, n_rows, size, None)
+            self._buf_bytes += size
+            return
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile(dir=self.tmpdir, prefix='LLP_join_')
+        self._spill.seek(0, os.SEEK_END)
+        offset = self._spill.tell()
+        pickle.dump(data, self._spill, protocol=pickle.HIGHEST_PROTOCOL)
+        self._buf[i] = (None, n_rows, 0, offset)
+        self.n_spilled += 1
+
+    def release(self, i):
+        """(data, n_rows) of a held block"""
+        data,n_rows,size,offset = self._buf.pop(i)
+        self._buf_bytes -= size
+        if offset is not None:
+            self._spill.seek(offset)
+            data = pickle.load(self._spill)
+        return data, n_rows
+
+    def write(self, data, n_rows):
+        t = time.time()
+        self.outF.write(data)
+        self.write_time += time.time() - t
+        self.n_bytes += block_size(data)
+        self.n_rows += n_rows
+        self.n_blocks += 1
+
+    def close(self):
+        """Removing the spill file (the output is not closed)"""
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+
+def block_size(data):
+    """Size (bytes) of an output block (bytes or an arrow table)"""
+    return data.nbytes if hasattr(data, 'nbytes') else len(data)
+
+
+class ArrowOutput(object):
+    """parquet or feather (arrow IPC) output file, written 1 table
+    (partition) at a time. The schema is set by the 1st table; all-null
+    columns of the 1st table are written as strings.
+    """
+    def __init__(self, outfile, fmt='parquet'):
+        if importlib.util.find_spec('pyarrow') is None:
+            msg = 'Writing parquet/feather tables requires the "pyarrow" package'
+            raise ImportError(msg)
+        self.outfile = outfile
+        self.fmt = fmt
+        self.schema = None
+        self._writer = None
+
+    def open(self, schema):
+        import pyarrow as pa
+        fields = [pa.field(x.name, pa.string()) if pa.types.is_null(x.type) else x
+                  for x in schema]
+        self.schema = pa.schema(fields, metadata=schema.metadata)
+        if self.fmt == 'parquet':
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(self.outfile, self.schema)
+        else:
+            options = pa.ipc.IpcWriteOptions(compression='lz4')
+            self._writer = pa.ipc.new_file(self.outfile, self.schema,
+                                           options=options)
 
+    def write(self, table):
+        if self._writer is None:
+            self.open(table.schema)
+        if not table.schema.equals(self.schema):
+            table = table.cast(self.schema)
+        self._writer.write_table(table)
 
-def write_table(infile, outfile, conn='w', header=True):
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def output_format(outfile):
+    """Output format: 'text', 'gzip', 'parquet' or 'feather'
+    """
     if outfile == '-':
-        with open(infile, 'r') as inF:
-            if header == False:
-                line = inF.readline()
-            for line in inF:
-                sys.stdout.write(line)
-    else:
-        with open(infile, 'r') as inF, open(outfile, conn) as outF:
-            if header == False:
-                line = inF.readline()
-            for line in inF:
-                outF.write(line)
+        return 'text'
+    fmt = table_format(outfile)
+    if fmt == 'text' and outfile.endswith('.gz'):
+        return 'gzip'
+    return fmt
+
+
+def open_output(outfile, block_size=4 * 1024 ** 2):
+    """Opening the output (binary, or an ArrowOutput); '-' = STDOUT
+    """
+    if outfile == '-':
+        return sys.stdout.buffer
+    fmt = output_format(outfile)
+    if fmt in ('parquet', 'feather'):
+        return ArrowOutput(outfile, fmt)
+    return open(outfile, 'wb', buffering=block_size)
+
+
+def partition_bytes(df, sep='\t', header=True, compress=False):
+    """Table partition (pandas) to delimited text (bytes); gzip'ed if compress
+    """
+    data = df.to_csv(sep=sep, index=False, header=header).encode('utf-8')
+    if compress:
+        data = gzip.compress(data)
+    return data
+
+
+def partition_block(df, sep='\t', header=True, fmt='text'):
+    """Table partition (pandas) to an output block: bytes for 'text' &
+    'gzip' output, or an arrow table for 'parquet' & 'feather' output
+    """
+    if fmt in ('parquet', 'feather'):
+        import pyarrow as pa
+        return pa.Table.from_pandas(df, preserve_index=False)
+    return partition_bytes(df, sep=sep, header=header, compress=(fmt == 'gzip'))
+
+
+def output_block(df, sep='\t', header=True, fmt='text'):
+    """[number of rows, output block] of a table partition. A list, so
+    that the block can be dropped (see write_partitions) once written.
+    """
+    return [len(df), partition_block(df, sep=sep, header=header, fmt=fmt)]
+
+
+def profile_writer(writer, profile):
+    """Recording the output rows, partitions & write time"""
+    profile.add_rows('output', writer.n_rows)
+    profile.set_partitions('output', writer.n_blocks)
+    if profile.enabled:
+        profile.write_stats = {'n' : writer.n_blocks, 'seconds' : writer.write_time}
+
+
+def write_partitions(df, outfile='-', sep='\t', client=None, profile=None):
+    """Streaming the partitions of a dask dataframe to outfile in order.
+    All partitions are computed in 1 pass, and each partition is written
+    (as 1 block) as soon as it & all preceding partitions are done.
+    If outfile ends in '.gz', each partition is compressed by its worker
+    as a separate gzip member (a multi-member gzip file). For parquet &
+    feather output, each partition is converted to arrow by its worker.
+    client : dask.distributed client (None = local scheduler)
+    profile : Profile of the join
+    Returns the number of bytes written (uncompressed for arrow output).
+    """
+    if profile is None:
+        profile = Profile()
+    fmt = output_format(outfile)
+    outF = open_output(outfile)
+    writer = OrderedWriter(outF)
+    try:
+        blocks = [dask.delayed(output_block)(part, sep, i == 0, fmt)
+                  for i,part in enumerate(df.to_delayed())]
+        logging.info('writing {} partitions to: {}'.format(len(blocks), outfile))
+        with profile.stage('execute'):
+            if client is not None:
+                # futures are written (& released) in order
+                for i,fut in enumerate(client.compute(blocks)):
+                    n_rows,data = fut.result()
+                    writer.put(i, data, n_rows)
+                    fut.release()
+            else:
+                # each block is written as soon as its task is done
+                # (posttask callbacks run in the scheduler's thread), &
+                # dropped from its result list; the scheduler only keeps
+                # the [n_rows, None] results
+                idx = {x.key : i for i,x in enumerate(blocks)}
+                def posttask(key, result, dsk, state, worker_id):
+                    if key in idx:
+                        writer.put(idx[key], result[1], result[0])
+                        result[1] = None
+                with profile.callback(), Callback(posttask=posttask):
+                    dask.compute(*blocks, optimize_graph=False)
+        profile_writer(writer, profile)
+    finally:
+        writer.close()
+        if outfile == '-':
+            outF.flush()
+        else:
+            outF.close()
+    return writer.n_bytes
 
 def clean_partd(tmpDir=None):
     if tmpDir is None:
@@ -158,39 +1010,1294 @@ def clean_partd(tmpDir=None):
         except PermissionError:
             pass
 
+
+def broadcast_supported(how, large_is_left):
+    """Can the join be done per partition of the larger table?
+    """
+    if how == 'inner':
+        return True
+    return (how == 'left' and large_is_left) or (how == 'right' and not large_is_left)
+
+
+def select_engine(tables, how='inner', engine='auto', broadcast_max=256,
+                  memory=None):
+    """Selecting the join engine.
+    broadcast_max : max size (Mb) of the smaller table for broadcasting
+    memory : memory budget (bytes) of the sort engine
+    Returns (engine, index of the smaller table)
+    """
+    sizes = [path_size(x) for x in tables]
+    small = 0 if sizes[0] <= sizes[1] else 1
+    supported = broadcast_supported(how, large_is_left=(small == 1))
+    if engine == 'broadcast' and not supported:
+        msg = 'The broadcast engine does not support --how {} with the larger table on the {}'
+        raise ValueError(msg.format(how, 'right' if small == 0 else 'left'))
+    if engine == 'auto':
+        if supported and sizes[small] <= broadcast_max * 1024 ** 2:
+            engine = 'broadcast'
+        elif memory is not None and sizes[small] > memory:
+            engine = 'sort'
+        else:
+            engine = 'dask'
+    logging.info('join engine: {}'.format(engine))
+    return engine, small
+
+
+def key_kind(dtype):
+    """Kind of a join key dtype: keys of different kinds never match
+    """
+    if isinstance(dtype, pd.CategoricalDtype):
+        dtype = dtype.categories.dtype
+    if pd.api.types.is_numeric_dtype(dtype):
+        return 'numeric'
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'datetime'
+    if is_string_dtype(dtype):
+        return 'string'
+    return str(dtype)
+
+
+def check_key_dtypes(left_dtypes, right_dtypes, left_on, right_on):
+    """Raising a ValueError (as pd.merge does) if matched join columns
+    have dtypes of different kinds (eg., int & str), which would
+    otherwise silently match no keys
+    """
+    for x,y,dx,dy in zip(left_on, right_on, left_dtypes, right_dtypes):
+        if key_kind(dx) != key_kind(dy):
+            msg = 'Cannot join on "{}" ({}) and "{}" ({}); use -L/-R to set matching dtypes'
+            raise ValueError(msg.format(x, dx, y, dy))
+
+
+class BroadcastTable(object):
+    """In-memory (small) table, with its join keys hashed once
+    for lookups by the partitions of the large table
+    """
+    def __init__(self, df, on):
+        self.df = df.reset_index(drop=True)
+        self.on = on
+        self.keys = self.key_index(self.df)
+        self.unique = self.keys.is_unique
+        # extra all-NA row for unmatched keys
+        self.df_na = self.df.reindex(range(len(self.df) + 1))
+        self.token = uuid.uuid4().hex
+
+    def __dask_tokenize__(self):
+        # by identity; hashing the table for each graph layer is slow
+        return self.token
+
+    def key_index(self, df, on=None):
+        if on is None:
+            on = self.on
+        if len(on) == 1:
+            return pd.Index(df[on[0]].values)
+        return pd.MultiIndex.from_frame(df[on])
+
+    def lookup(self, df, on):
+        """Row positions in the table for each row's keys (-1 = no match)
+        """
+        return self.keys.get_indexer(self.key_index(df, on))
+
+
+def broadcast_merge(df, table, on, how='inner', large_is_left=True):
+    """Joining a partition (df) of the large table with a BroadcastTable.
+    The output is the same as pd.merge of the left & right tables.
+    """
+    left,right = (df, table.df) if large_is_left else (table.df, df)
+    left_on,right_on = (on, table.on) if large_is_left else (table.on, on)
+    check_key_dtypes([left[x].dtype for x in left_on],
+                     [right[x].dtype for x in right_on], left_on, right_on)
+    template = pd.merge(left.iloc[:0], right.iloc[:0], how=how,
+                        left_on=left_on, right_on=right_on)
+    if not table.unique:
+        return pd.merge(left, right, how=how, left_on=left_on, right_on=right_on)
+    # gathering the matched rows of the small table
+    pos = table.lookup(df, on)
+    if how == 'inner':
+        keep = pos >= 0
+        df = df[keep]
+        pos = pos[keep]
+    if (pos < 0).any():
+        small = table.df_na.take(np.where(pos < 0, len(table.df), pos))
+    else:
+        small = table.df.take(pos)
+    df = df.reset_index(drop=True)
+    small = small.reset_index(drop=True)
+    # column names as in pd.merge: shared key names collapse to the
+    # large table column, other shared names get suffixes
+    same = [x for x,y in zip(left_on, right_on) if x == y]
+    if large_is_left:
+        small = small.drop(same, axis=1)
+    else:
+        for x in same:
+            small[x] = df[x]
+        df = df.drop(same, axis=1)
+    left,right = (df, small) if large_is_left else (small, df)
+    shared = set(left.columns) & set(right.columns)
+    left = left.rename(columns={x : x + '_x' for x in shared})
+    right = right.rename(columns={x : x + '_y' for x in shared})
+    out = pd.concat([left, right], axis=1)
+    if list(out.columns) != list(template.columns):
+        msg = 'Broadcast join column mismatch: {} != {}'
+        raise ValueError(msg.format(list(out.columns), list(template.columns)))
+    return out
+
+
+def broadcast_join(tables, join_on, small=1, how='inner', sep='\t',
+                   dtypes=None, blocksize=64 * 1024 ** 2, columns=None,
+                   filters=None, profile=None):
+    """Broadcast hash join: the small table is read into memory & hashed
+    once; the large table is joined with it partition by partition
+    (no shuffle).
+    tables : [left, right] table files
+    join_on : {'left' : [cols], 'right' : [cols]}
+    small : index of the small table in tables
+    columns, filters : [left, right] columns to read & row filters
+    Returns a dask dataframe
+    """
+    sides = ['left', 'right']
+    if dtypes is None:
+        dtypes = [None, None]
+    if columns is None:
+        columns = [None, None]
+    if filters is None:
+        filters = [None, None]
+    large = 1 - small
+    logging.info('loading the small table: {}'.format(tables[small]))
+    table = read_table(tables[small], sep=sep, dtype=dtypes[small],
+                       columns=columns[small], filters=filters[small],
+                       profile=profile)
+    table = BroadcastTable(table, join_on[sides[small]])
+    ddf = get_table(tables[large], sep=sep, dtype=dtypes[large],
+                    blocksize=blocksize, columns=columns[large],
+                    filters=filters[large], profile=profile)
+    large_is_left = large == 0
+    meta = broadcast_merge(ddf._meta, table, join_on[sides[large]], how=how,
+                           large_is_left=large_is_left)
+    return ddf.map_partitions(broadcast_merge, table, join_on[sides[large]],
+                              how=how, large_is_left=large_is_left, meta=meta)
+
+
+INDEX_DTYPE = np.dtype([('hash', '<u8'), ('offset', '<u8'), ('length', '<u4')])
+
+def index_files(ref):
+    """Index (.npy) & metadata (.json) files of a join index of ref
+    """
+    return ref + '.idx.npy', ref + '.idx.json'
+
+
+def hash_keys(keys):
+    """Join keys (as strings) to uint64 hashes
+    """
+    keys = np.asarray(keys, dtype=object)
+    return pd.util.hash_array(keys.astype(str).astype(object))
+
+
+def line_offsets(infile, block_size=64 * 1024 ** 2):
+    """Offsets & lengths (without the newline) of all lines in a file
+    """
+    size = os.path.getsize(infile)
+    newlines = []
+    with open(infile, 'rb') as inF:
+        pos = 0
+        while True:
+            block = inF.read(block_size)
+            if not block:
+                break
+            x = np.frombuffer(block, dtype=np.uint8)
+            newlines.append(np.flatnonzero(x == 10) + pos)
+            pos += len(block)
+    ends = np.concatenate(newlines + [np.zeros(0, dtype=np.int64)])
+    starts = np.concatenate([[0], ends + 1])
+    if len(ends) == 0 or ends[-1] != size - 1:
+        # no trailing newline
+        ends = np.append(ends, size)
+    starts = starts[:len(ends)]
+    return starts, ends - starts
+
+
+def build_index(ref, key=None, sep='\t', chunksize=1000000):
+    """Building a join index of the table ref on column key
+    (see INDEX). Returns the number of indexed rows.
+    """
+    if table_format(ref) != 'text' or ref.endswith('.gz'):
+        raise ValueError('Only uncompressed text tables can be indexed: {}'.format(ref))
+    stat = os.stat(ref)
+    starts,lengths = line_offsets(ref)
+    with open(ref, 'rb') as inF:
+        header = inF.read(int(lengths[0])).decode('utf-8').rstrip('\r')
+    columns = header.split(sep)
+    if key is None:
+        key = columns[0]
+    if key not in columns:
+        raise ValueError('Column "{}" not in {}'.format(key, ref))
+    # keys of all rows (1 per line)
+    reader = pd.read_csv(ref, sep=sep, usecols=[key], dtype=str, na_filter=False,
+                         quoting=csv.QUOTE_NONE, skip_blank_lines=False,
+                         chunksize=chunksize)
+    keys = np.concatenate([x[key].values.astype(object) for x in reader]
+                          + [np.zeros(0, dtype=object)])
+    starts = starts[1:]
+    lengths = lengths[1:]
+    if len(keys) != len(starts):
+        msg = '{}: {} rows parsed, but {} lines; quoted newlines are not supported'
+        raise ValueError(msg.format(ref, len(keys), len(starts)))
+    keep = keys != ''
+    index = np.empty(keep.sum(), dtype=INDEX_DTYPE)
+    index['hash'] = hash_keys(keys[keep])
+    index['offset'] = starts[keep]
+    index['length'] = lengths[keep]
+    index = index[np.argsort(index['hash'], kind='stable')]
+    # writing (atomic)
+    idx_file,meta_file = index_files(ref)
+    meta = {'key' : key, 'sep' : sep, 'header' : header, 'rows' : len(index),
+            'size' : stat.st_size, 'mtime_ns' : stat.st_mtime_ns}
+    for outfile,write in ((idx_file, lambda F: np.save(F, index)),
+                          (meta_file, lambda F: F.write(json.dumps(meta).encode('utf-8')))):
+        fd,tmpfile = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(outfile)),
+                                      prefix='.tmp_')
+        try:
+            with os.fdopen(fd, 'wb') as outF:
+                write(outF)
+            os.chmod(tmpfile, 0o644)
+            os.replace(tmpfile, outfile)
+        except:
+            os.unlink(tmpfile)
+            raise
+    logging.info('{}: {} rows indexed on "{}"'.format(ref, len(index), key))
+    return len(index)
+
+
+class JoinIndex(object):
+    """Join index of a table (see build_index). The index & the table
+    are memory-mapped (lazily, once per process).
+    """
+    def __init__(self, ref):
+        self.ref = ref
+        self.idx_file,self.meta_file = index_files(ref)
+        with open(self.meta_file) as inF:
+            self.meta = json.load(inF)
+        self.key = self.meta['key']
+        self.sep = self.meta['sep']
+        self._index = None
+        self._mm = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_index'] = None
+        state['_mm'] = None
+        return state
+
+    def fresh(self):
+        """Is the index up-to-date with the table?
+        """
+        stat = os.stat(self.ref)
+        return (stat.st_size == self.meta['size'] and
+                stat.st_mtime_ns == self.meta['mtime_ns'])
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = np.load(self.idx_file, mmap_mode='r')
+        return self._index
+
+    @property
+    def mm(self):
+        if self._mm is None:
+            with open(self.ref, 'rb') as inF:
+                self._mm = mmap.mmap(inF.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mm
+
+    def parse(self, lines, dtype=None):
+        data = '\n'.join([self.meta['header']] + lines) + '\n'
+        return pd.read_csv(io.StringIO(data), sep=self.sep, dtype=dtype)
+
+    def sample(self, dtype=None, nrows=1000):
+        """The 1st rows of the table"""
+        return pd.read_csv(self.ref, sep=self.sep, dtype=dtype, nrows=nrows)
+
+    def rows(self, keys, dtype=None):
+        """Rows of the table (pandas, in table order) with hashes of any of
+        the keys. Hash collisions (rows with other keys) are dropped by
+        the merge on the keys.
+        """
+        hashes = np.unique(hash_keys(keys))
+        index = self.index
+        lo = np.searchsorted(index['hash'], hashes, side='left')
+        hi = np.searchsorted(index['hash'], hashes, side='right')
+        n = hi - lo
+        pos = np.repeat(lo - np.cumsum(n) + n, n) + np.arange(n.sum())
+        hits = np.sort(index[pos], order='offset')
+        mm = self.mm
+        lines = [mm[x:x+y].decode('utf-8').rstrip('\r')
+                 for x,y in zip(hits['offset'].tolist(), hits['length'].tolist())]
+        return self.parse(lines, dtype=dtype)
+
+
+def find_index(tables, join_on, how='inner'):
+    """Finding the table (of 2) with an up-to-date join index on the
+    join column that can be used for the join.
+    Returns (table index, JoinIndex) or None
+    """
+    for i,side in enumerate(['left', 'right']):
+        if not os.path.isfile(index_files(tables[i])[1]):
+            continue
+        index = JoinIndex(tables[i])
+        if join_on[side] != [index.key]:
+            continue
+        if not index.fresh():
+            logging.warning('The index of {} is out of date; not used'.format(tables[i]))
+            continue
+        if not broadcast_supported(how, large_is_left=(i == 1)):
+            continue
+        return i, index
+    return None
+
+
+def index_merge(df, index, on, how='inner', large_is_left=True, dtype=None,
+                columns=None, filters=None):
+    """Joining a partition (df) of the large table with the rows of
+    the indexed table that match its keys
+    """
+    rows = index.rows(df[on[0]].dropna().values, dtype=dtype)
+    rows = select_rows(rows, dtype, columns, filters)
+    left,right = (df, rows) if large_is_left else (rows, df)
+    left_on,right_on = (on, [index.key]) if large_is_left else ([index.key], on)
+    return pd.merge(left, right, how=how, left_on=left_on, right_on=right_on)
+
+
+def index_meta(meta, index, on, how='inner', large_is_left=True, dtype=None,
+               columns=None, filters=None):
+    """Empty output of index_merge (with the dtypes of the 1st rows of
+    the indexed table) for the partitions of the large table (meta)
+    """
+    sample = index.sample(dtype=dtype)
+    sample = select_rows(sample, dtype, columns, filters).iloc[:0]
+    left,right = (meta, sample) if large_is_left else (sample, meta)
+    left_on,right_on = (on, [index.key]) if large_is_left else ([index.key], on)
+    return pd.merge(left, right, how=how, left_on=left_on, right_on=right_on)
+
+
+def index_join(tables, join_on, indexed=1, index=None, how='inner', sep='\t',
+               dtypes=None, blocksize=64 * 1024 ** 2, columns=None,
+               filters=None, profile=None):
+    """Index join: the table with the join index (indexed) is not read;
+    each partition of the other table fetches its matching rows.
+    Returns a dask dataframe
+    """
+    sides = ['left', 'right']
+    if dtypes is None:
+        dtypes = [None, None]
+    if columns is None:
+        columns = [None, None]
+    if filters is None:
+        filters = [None, None]
+    if profile is None:
+        profile = Profile()
+    if index is None:
+        index = JoinIndex(tables[indexed])
+    large = 1 - indexed
+    logging.info('using the join index of: {}'.format(tables[indexed]))
+    profile.add_rows(tables[indexed], index.meta['rows'])
+    ddf = get_table(tables[large], sep=sep, dtype=dtypes[large],
+                    blocksize=blocksize, columns=columns[large],
+                    filters=filters[large], profile=profile)
+    kwargs = {'how' : how, 'large_is_left' : large == 0,
+              'dtype' : dtypes[indexed], 'columns' : columns[indexed],
+              'filters' : filters[indexed]}
+    on = join_on[sides[large]]
+    meta = index_meta(ddf._meta, index, on, **kwargs)
+    return ddf.map_partitions(index_merge, index, on, meta=meta, **kwargs)
+
+
+def key_set(infile, on, sep='\t', dtype=None, filters=None, profile=None):
+    """Unique (non-missing) keys of a table, as a pandas Index;
+    only the key columns (& filter columns) are read
+    """
+    df = read_table(infile, sep=sep, dtype=dtype, columns=list(on),
+                    filters=filters, profile=profile)
+    df = df[on].dropna().drop_duplicates()
+    if len(on) == 1:
+        keys = pd.Index(df[on[0]].values, name=on[0])
+    else:
+        keys = pd.MultiIndex.from_frame(df)
+    logging.info('{}: {} unique keys'.format(infile, len(keys)))
+    return keys
+
+
+def semi_filter(df, keys, on, anti=False):
+    """Rows of a partition with key(s) in keys (or not in keys if anti)
+    """
+    if len(on) == 1:
+        x = pd.Index(df[on[0]].values)
+        dtypes = [keys.dtype]
+    else:
+        x = pd.MultiIndex.from_frame(df[on])
+        dtypes = [y.dtype for y in keys.levels]
+    check_key_dtypes([df[y].dtype for y in on], dtypes, on, keys.names)
+    found = keys.get_indexer(x) >= 0
+    return df[~found] if anti else df[found]
+
+
+def semi_join(tables, join_on, how='semi', sep='\t', dtypes=None,
+              blocksize=64 * 1024 ** 2, columns=None, filters=None,
+              profile=None):
+    """Semi (or anti) join: the left table rows with keys in (or not
+    in) the right table, which is loaded as a set of keys.
+    Returns a dask dataframe
+    """
+    if dtypes is None:
+        dtypes = [None, None]
+    if columns is None:
+        columns = [None, None]
+    if filters is None:
+        filters = [None, None]
+    keys = key_set(tables[1], join_on['right'], sep=sep, dtype=dtypes[1],
+                   filters=filters[1], profile=profile)
+    ddf = get_table(tables[0], sep=sep, dtype=dtypes[0], blocksize=blocksize,
+                    columns=columns[0], filters=filters[0], profile=profile)
+    anti = how == 'anti'
+    meta = semi_filter(ddf._meta, keys, join_on['left'], anti=anti)
+    return ddf.map_partitions(semi_filter, keys, join_on['left'], anti=anti,
+                              meta=meta)
+
+
+def multi_join(tables, join_ons, how='inner', sep='\t', dtypes=None,
+               blocksize=64 * 1024 ** 2, engine='auto', broadcast_max=256,
+               columns=None, filters=None, left_dtypes=None,
+               key_encoding='auto', npartitions=None, profile=None):
+    """Joining >=2 tables in 1 dask pipeline: the 1st table is joined
+    with the 2nd, that result with the 3rd, etc.
+    join_ons : [{'left' : [cols], 'right' : [cols]}], 1 per joined table
+    dtypes : [{col : dtype}], 1 per table
+    left_dtypes : [{col : dtype}] of the left join columns, 1 per joined
+      table (applied to the joined table so far)
+    engine : 'auto' = use the join index of each joined table that has
+      one (see INDEX), else broadcast it if <= broadcast_max (Mb) and
+      supported; 'broadcast' = broadcast all joined tables (or use
+      their index); 'index' = use the join index of all joined tables;
+      'dask' = hash join all tables
+    columns, filters : columns to read & row filters, 1 per table
+    key_encoding, npartitions : of the hash joins (see hash_merge)
+    profile : Profile of the join
+    Returns a dask dataframe
+    """
+    if profile is None:
+        profile = Profile()
+    n = len(tables)
+    if dtypes is None:
+        dtypes = [None] * n
+    if columns is None:
+        columns = [None] * n
+    if filters is None:
+        filters = [None] * n
+    if engine == 'broadcast' and not broadcast_supported(how, large_is_left=True):
+        msg = 'The broadcast engine does not support --how {} for >2 tables'
+        raise ValueError(msg.format(how))
+    df = get_table(tables[0], sep=sep, dtype=dtypes[0], blocksize=blocksize,
+                   columns=columns[0], filters=filters[0], profile=profile)
+    for i in range(1, n):
+        on = join_ons[i-1]
+        if left_dtypes is not None and i > 1:
+            df = df.astype(left_dtypes[i-1])
+        if how in ('semi', 'anti'):
+            keys = key_set(tables[i], on['right'], sep=sep, dtype=dtypes[i],
+                           filters=filters[i], profile=profile)
+            anti = how == 'anti'
+            meta = semi_filter(df._meta, keys, on['left'], anti=anti)
+            df = df.map_partitions(semi_filter, keys, on['left'], anti=anti,
+                                   meta=meta)
+            continue
+        broadcast = broadcast_supported(how, large_is_left=True)
+        # the join index is used whatever the table size
+        index = None
+        if (broadcast and engine != 'dask' and
+            os.path.isfile(index_files(tables[i])[1])):
+            index = JoinIndex(tables[i])
+            if on['right'] != [index.key] or not index.fresh():
+                index = None
+        if engine == 'auto':
+            broadcast &= path_size(tables[i]) <= broadcast_max * 1024 ** 2
+        elif engine == 'dask':
+            broadcast = False
+        if engine == 'index' and index is None:
+            msg = 'No up-to-date index on the join column of table {} that supports --how {}'
+            raise ValueError(msg.format(i + 1, how))
+        if index is not None:
+            logging.info('using the join index of table {}: {}'.format(i + 1, tables[i]))
+            profile.add_rows(tables[i], index.meta['rows'])
+            kwargs = {'how' : how, 'dtype' : dtypes[i], 'columns' : columns[i],
+                      'filters' : filters[i]}
+            meta = index_meta(df._meta, index, on['left'], **kwargs)
+            df = df.map_partitions(index_merge, index, on['left'], meta=meta,
+                                   **kwargs)
+        elif broadcast:
+            logging.info('broadcasting table {}: {}'.format(i + 1, tables[i]))
+            table = read_table(tables[i], sep=sep, dtype=dtypes[i],
+                               columns=columns[i], filters=filters[i],
+                               profile=profile)
+            table = BroadcastTable(table, on['right'])
+            meta = broadcast_merge(df._meta, table, on['left'], how=how)
+            df = df.map_partitions(broadcast_merge, table, on['left'],
+                                   how=how, meta=meta)
+        else:
+            logging.info('hash joining table {}: {}'.format(i + 1, tables[i]))
+            df2 = get_table(tables[i], sep=sep, dtype=dtypes[i],
+                            blocksize=blocksize, columns=columns[i],
+                            filters=filters[i], profile=profile)
+            df = hash_merge(df, df2, on['left'], on['right'], how=how,
+                            npartitions=npartitions, key_encoding=key_encoding)
+    return df
+
+
+def is_string_dtype(dtype, python_only=False):
+    """String dtype? python_only = only strings stored as python
+    objects (not arrow-backed strings)
+    """
+    if dtype == object:
+        return True
+    if python_only:
+        return isinstance(dtype, pd.StringDtype) and dtype.storage == 'python'
+    return pd.api.types.is_string_dtype(dtype) and \
+        not isinstance(dtype, pd.CategoricalDtype)
+
+
+def arrow_keys(df, on):
+    """Converting join keys stored as python objects to pyarrow strings
+    (dask dataframe). Returns the dataframe & the converted columns.
+    """
+    cols = [x for x in on if is_string_dtype(df._meta[x].dtype, python_only=True)]
+    if len(cols) == 0:
+        return df, cols
+    if importlib.util.find_spec('pyarrow') is None:
+        return df, []
+    return df.astype({x : 'string[pyarrow]' for x in cols}), cols
+
+
+def key_dictionaries(dfs, ons):
+    """Shared dictionaries of the string join keys of 2 dask dataframes.
+    ons : [left cols, right cols]
+    Returns ({i : KeyDictionary} for each string key
+    column pair i, [{key column : memory usage (bytes)}, n rows] of each
+    dataframe)
+    """
+    pairs = [i for i,(x,y) in enumerate(zip(*ons)) if
+             is_string_dtype(dfs[0]._meta[x].dtype) and
+             is_string_dtype(dfs[1]._meta[y].dtype)]
+    uniq = [[df[on[i]].dropna().unique() for i in pairs] for df,on in zip(dfs, ons)]
+    mem = [[{x : df[x].memory_usage(deep=True, index=False) for x in on},
+            df[on[0]].size] for df,on in zip(dfs, ons)]
+    uniq,mem = dask.compute(uniq, mem)
+    dicts = {}
+    for j,i in enumerate(pairs):
+        keys = np.concatenate([np.asarray(uniq[0][j], dtype=object),
+                               np.asarray(uniq[1][j], dtype=object)])
+        dicts[i] = KeyDictionary(pd.Index(pd.unique(keys)).sort_values())
+    return dicts, mem
+
+
+class KeyDictionary(object):
+    """Sorted unique keys (pandas Index) shared by the tasks of all
+    partitions; tokenized by identity (see BroadcastTable)
+    """
+    def __init__(self, keys):
+        self.keys = keys
+        self.token = uuid.uuid4().hex
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __dask_tokenize__(self):
+        return self.token
+
+
+def encode_keys(df, cols, dicts):
+    """Replacing key columns with their codes in the dictionaries
+    (KeyDictionary; -1 = missing key)
+    """
+    df = df.copy()
+    for col,d in zip(cols, dicts):
+        keys = d.keys
+        dtype = np.int32 if len(keys) < 2 ** 31 else np.int64
+        df[col] = keys.get_indexer(df[col].values).astype(dtype)
+    return df
+
+
+def decode_keys(df, cols, dicts, dtypes):
+    """Replacing key codes with the keys (missing codes = NA)
+    """
+    df = df.copy()
+    for col,d,dtype in zip(cols, dicts, dtypes):
+        keys = d.keys
+        codes = df[col].fillna(-1).astype(np.int64).values
+        values = keys.values.take(np.where(codes < 0, 0, codes)) \
+                 if len(keys) > 0 else np.full(len(codes), None, dtype=object)
+        values = pd.Series(values, index=df.index, dtype=object)
+        df[col] = values.where(codes >= 0, None).astype(dtype)
+    return df
+
+
+def encoded_merge(df1, df2, left_on, right_on, how='inner', npartitions=None):
+    """dd.merge of 2 dask dataframes on dictionary-encoded string keys
+    (see KEY ENCODING); the output has the original keys
+    """
+    dicts,mem = key_dictionaries([df1, df2], [left_on, right_on])
+    if len(dicts) == 0:
+        return dd.merge(df1, df2, left_on=left_on, right_on=right_on, how=how,
+                        npartitions=npartitions)
+    pairs = sorted(dicts.keys())
+    # encoding both tables with the shared dictionaries
+    dfs = []
+    for df,on in ((df1, left_on), (df2, right_on)):
+        cols = [on[i] for i in pairs]
+        meta = encode_keys(df._meta, cols, [dicts[i] for i in pairs])
+        dfs.append(df.map_partitions(encode_keys, cols, [dicts[i] for i in pairs],
+                                     meta=meta))
+    # key memory usage: before & after encoding
+    dict_mem = sum([x.keys.memory_usage(deep=True) for x in dicts.values()])
+    for side,on,df,(usage,n_rows) in zip(['left', 'right'], (left_on, right_on),
+                                         dfs, mem):
+        before = sum(usage.values())
+        after = sum([n_rows * df._meta[x].dtype.itemsize if i in dicts else usage[x]
+                     for i,x in enumerate(on)])
+        msg = '{} table key memory: {:.2f} Mb -> {:.2f} Mb encoded (+{:.2f} Mb shared dictionaries)'
+        logging.info(msg.format(side, before / 1024 ** 2, after / 1024 ** 2,
+                                dict_mem / 1024 ** 2))
+    df = dd.merge(dfs[0], dfs[1], left_on=left_on, right_on=right_on, how=how,
+                  npartitions=npartitions)
+    # decoding all key columns in the output
+    cols,keys,dtypes = [],[],[]
+    for i in pairs:
+        for on,src in ((left_on, df1), (right_on, df2)):
+            if on[i] in df.columns and on[i] not in cols:
+                cols.append(on[i])
+                keys.append(dicts[i])
+                dtypes.append(src._meta[on[i]].dtype)
+    meta = decode_keys(df._meta, cols, keys, dtypes)
+    return df.map_partitions(decode_keys, cols, keys, dtypes, meta=meta)
+
+
+def hash_merge(df1, df2, left_on, right_on, how='inner', npartitions=None,
+               key_encoding='auto'):
+    """dd.merge of 2 dask dataframes, with the join keys encoded
+    (see KEY ENCODING): key_encoding = 'auto', 'dict' or 'none'
+    """
+    if key_encoding == 'auto':
+        df1,x = arrow_keys(df1, left_on)
+        df2,y = arrow_keys(df2, right_on)
+        if len(x + y) > 0:
+            logging.info('join keys as pyarrow strings: {}'.format(','.join(x + y)))
+    if key_encoding == 'dict':
+        return encoded_merge(df1, df2, left_on, right_on, how=how,
+                             npartitions=npartitions)
+    return dd.merge(df1, df2, left_on=left_on, right_on=right_on, how=how,
+                    npartitions=npartitions)
+
+
+def parse_size(size_str):
+    """Parsing a size (eg., '500M' or '4G') to bytes
+    """
+    m = re.match(r'^\s*([0-9.]+)\s*([KMGT]?)B?\s*$', str(size_str).upper())
+    if m is None:
+        msg = 'Cannot parse size "{}"; use eg., 500M or 4G'
+        raise ValueError(msg.format(size_str))
+    power = {'' : 0, 'K' : 1, 'M' : 2, 'G' : 3, 'T' : 4}[m.group(2)]
+    return int(float(m.group(1)) * 1024 ** power)
+
+
+def key_lt(df, on, bound):
+    """Rows with key(s) < bound (lexicographic for >1 key column)
+    """
+    lt = np.zeros(len(df), dtype=bool)
+    eq = np.ones(len(df), dtype=bool)
+    for col,b in zip(on, bound):
+        x = df[col].values
+        lt |= eq & (x < b)
+        eq &= (x == b)
+    return lt
+
+
+def last_key(df, on):
+    return tuple(df[on].iloc[-1])
+
+
+def write_run(outfile, df, block_rows):
+    """Writing a sorted run: gzip'ed, pickled blocks of <= block_rows rows
+    """
+    with gzip.open(outfile, 'wb', compresslevel=1) as outF:
+        for i in range(0, max(len(df), 1), block_rows):
+            pickle.dump(df.iloc[i:i+block_rows], outF,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def read_run(infile):
+    """Reading the blocks of a sorted run
+    """
+    with gzip.open(infile, 'rb') as inF:
+        while True:
+            try:
+                yield pickle.load(inF)
+            except EOFError:
+                break
+
+
+def sort_runs(infile, on, sep='\t', dtype=None, memory=2 * 1024 ** 3,
+              tmpdir=None, prefix='run', block_rows=10000, columns=None,
+              filters=None, profile=None):
+    """Splitting a table into sorted runs (written to tmpdir) that fit
+    in memory. Rows with missing key(s) are returned separately.
+    profile : Profile counting the rows of the table
+    Returns (list of run files, dataframe of rows with missing keys)
+    """
+    # rows per run (sorting needs ~2x the size of the run)
+    read = functools.partial(read_chunks, infile, sep=sep, dtype=dtype,
+                             columns=columns, filters=filters)
+    sample = next(read(chunksize=block_rows))
+    row_size = max(sample.memory_usage(deep=True).sum() / max(len(sample), 1), 1)
+    run_rows = max(int(memory / (3 * row_size)), block_rows)
+    runs = []
+    na_rows = []
+    for df in read(chunksize=run_rows, profile=profile):
+        na = df[on].isnull().any(axis=1)
+        if na.any():
+            na_rows.append(df[na])
+            df = df[~na]
+        df = df.sort_values(on, kind='mergesort')
+        outfile = '{}{}.pkl.gz'.format(prefix, len(runs))
+        outfile = os.path.join(tmpdir, outfile)
+        write_run(outfile, df, block_rows)
+        runs.append(outfile)
+    logging.info('{}: {} sorted runs of <= {} rows'.format(infile, len(runs), run_rows))
+    if len(na_rows) > 0:
+        na_rows = pd.concat(na_rows)
+    else:
+        na_rows = sample.iloc[:0]
+    return runs, na_rows
+
+
+def key_eq(df, on, key):
+    """Rows with key(s) == key
+    """
+    eq = np.ones(len(df), dtype=bool)
+    for col,k in zip(on, key):
+        eq &= (df[col].values == k)
+    return eq
+
+
+def aligned_blocks(streams, ons, inclusive=False, max_bytes=None):
+    """Aligning sorted streams of dataframes on their keys.
+    streams : iterables of dataframes, each sorted by its key(s)
+    ons : key column(s) of each stream
+    inclusive : yield the rows with keys <= the bound of the buffered
+      keys, instead of < the bound. For merging sorted streams: the
+      rows of a key can then be split across >1 yielded block, so
+      the buffers never grow past 1 block per stream.
+    max_bytes : max size of each buffer (join alignment; see below)
+    Yields a list of dataframes (1 per stream) with all rows (of all
+    streams) that have keys in the same key range; the key ranges are
+    yielded in order.
+    A key with more rows than fit in max_bytes (a heavy key) would
+    otherwise grow its buffer until the key is exhausted in every
+    stream. If the rows of that key in all other streams are buffered,
+    the heavy buffer is yielded in chunks, each with all rows of the
+    key in the other streams (each chunk joins to part of the key's
+    cross product). If >1 stream has a heavy key, all of its rows must
+    be buffered & a warning is logged.
+    """
+    streams = [iter(x) for x in streams]
+    n = len(streams)
+    bufs = [None] * n
+    done = [False] * n
+    max_rows = [None] * n
+    warned = [False]
+    def fill(i):
+        # adding the next non-empty block to buffer i
+        while not done[i]:
+            try:
+                df = next(streams[i])
+            except StopIteration:
+                done[i] = True
+                break
+            if len(df) == 0:
+                continue
+            if max_bytes is not None and max_rows[i] is None:
+                row_size = max(df.memory_usage(deep=True).sum() / len(df), 1)
+                max_rows[i] = max(int(max_bytes / row_size), 1)
+            if bufs[i] is None or len(bufs[i]) == 0:
+                bufs[i] = df
+            else:
+                bufs[i] = pd.concat([bufs[i], df])
+            break
+    def complete(j, bound):
+        # are all rows of stream j with keys <= bound buffered?
+        return (done[j] or bufs[j] is None or len(bufs[j]) == 0 or
+                last_key(bufs[j], ons[j]) > bound)
+    def heavy(i, bound):
+        # is buffer i over budget & all at the bound key?
+        return (max_rows[i] is not None and not done[i] and
+                len(bufs[i]) > max_rows[i] and
+                last_key(bufs[i], ons[i]) == bound)
+    for i in range(n):
+        fill(i)
+    while not all(done):
+        # all rows with keys < bound (or <= bound) are in the buffers
+        bounds = [last_key(bufs[i], ons[i]) for i in range(n) if not done[i]]
+        bound = min(bounds)
+        parts = []
+        for i in range(n):
+            if bufs[i] is None or len(bufs[i]) == 0:
+                parts.append(bufs[i])
+                continue
+            lt = key_lt(bufs[i], ons[i], bound)
+            if inclusive:
+                lt |= key_eq(bufs[i], ons[i], bound)
+            parts.append(bufs[i][lt])
+            bufs[i] = bufs[i][~lt]
+        if any([x is not None and len(x) > 0 for x in parts]):
+            yield parts
+        # heavy keys: chunks of the cross product
+        for i in range(n):
+            if not heavy(i, bound):
+                continue
+            if all([complete(j, bound) for j in range(n) if j != i]):
+                parts = [bufs[j] if j == i or bufs[j] is None else
+                         bufs[j][key_eq(bufs[j], ons[j], bound)] for j in range(n)]
+                bufs[i] = bufs[i].iloc[:0]
+                yield parts
+            elif not warned[0]:
+                msg = 'join key {} has > {} rows in >1 table; buffering them exceeds --memory'
+                logging.warning(msg.format(bound, max_rows[i]))
+                warned[0] = True
+        # refilling the buffers at the bound (or empty)
+        for i in range(n):
+            if done[i]:
+                continue
+            if len(bufs[i]) == 0 or last_key(bufs[i], ons[i]) == bound:
+                fill(i)
+    # remaining rows
+    if any([x is not None and len(x) > 0 for x in bufs]):
+        yield bufs
+
+
+def merge_runs(runs, on):
+    """k-way merge of sorted runs; yields sorted dataframes
+    """
+    streams = [read_run(x) for x in runs]
+    for parts in aligned_blocks(streams, [on] * len(streams), inclusive=True):
+        parts = [x for x in parts if x is not None and len(x) > 0]
+        yield pd.concat(parts).sort_values(on, kind='mergesort')
+
+
+def sort_merge_join(tables, join_on, how='inner', sep='\t', dtypes=None,
+                    memory=2 * 1024 ** 3, tmpdir=None, columns=None,
+                    filters=None, profile=None):
+    """External sort-merge join of 2 tables, using ~memory bytes.
+    Yields the joined table in chunks (pandas dataframes), in key order.
+    """
+    if profile is None:
+        profile = Profile()
+    if dtypes is None:
+        dtypes = [None, None]
+    if columns is None:
+        columns = [None, None]
+    if filters is None:
+        filters = [None, None]
+    tmpdir = tempfile.mkdtemp(dir=tmpdir, prefix='LLP_join_')
+    logging.info('writing sorted runs to: {}'.format(tmpdir))
+    try:
+        # sorted runs (each table uses the full memory budget in turn)
+        runs = []
+        empty = []
+        na_rows = []
+        for i,side in enumerate(['left', 'right']):
+            with profile.stage('sort_runs'):
+                x,na = sort_runs(tables[i], join_on[side], sep=sep, dtype=dtypes[i],
+                                 memory=memory, tmpdir=tmpdir, prefix=side,
+                                 columns=columns[i], filters=filters[i],
+                                 profile=profile)
+            runs.append(x)
+            na_rows.append(na)
+            empty.append(na.iloc[:0])
+        # merging the runs of each table & merge-joining
+        # (the run buffers share the memory budget; each join buffer
+        # gets 1/4, leaving room for the merged output)
+        streams = [merge_runs(runs[0], join_on['left']),
+                   merge_runs(runs[1], join_on['right'])]
+        ons = [join_on['left'], join_on['right']]
+        merge = functools.partial(pd.merge, how=how, left_on=join_on['left'],
+                                  right_on=join_on['right'])
+        n = 0
+        for left,right in aligned_blocks(streams, ons, max_bytes=memory // 4):
+            left = empty[0] if left is None else left
+            right = empty[1] if right is None else right
+            df = merge(left, right)
+            if len(df) > 0:
+                n += 1
+                yield df
+        # rows with missing keys (or just the header if no rows)
+        if len(na_rows[0]) > 0 or len(na_rows[1]) > 0 or n == 0:
+            yield merge(na_rows[0], na_rows[1])
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+class KeyReader(object):
+    """Parsing the join key(s) of the lines of a (sorted) text table,
+    for comparisons in the order of the key dtypes
+    """
+    def __init__(self, infile, on, sep='\t', dtype=None):
+        if table_format(infile) != 'text' or infile.endswith('.gz'):
+            msg = 'Only uncompressed text tables can be joined with --presorted: {}'
+            raise ValueError(msg.format(infile))
+        self.infile = infile
+        self.sep = sep
+        self.size = os.path.getsize(infile)
+        with open(infile, 'rb') as inF:
+            self.header = inF.readline()
+        columns = self.header.decode('utf-8').rstrip('\r\n').split(sep)
+        self.idx = [columns.index(x) for x in on]
+        dtype = dtype if dtype else {}
+        self.numeric = [self._numeric(dtype.get(x)) for x in on]
+
+    def _numeric(self, dtype):
+        if dtype is None:
+            return False
+        try:
+            return pd.api.types.pandas_dtype(dtype).kind in 'iuf'
+        except TypeError:
+            return False
+
+    def key(self, line):
+        """Key of a line (missing keys are the smallest keys)"""
+        fields = line.decode('utf-8').rstrip('\r\n').split(self.sep)
+        key = []
+        for i,numeric in zip(self.idx, self.numeric):
+            x = fields[i] if i < len(fields) else ''
+            if x == '':
+                key.append((0, 0))
+            else:
+                key.append((1, float(x) if numeric else x))
+        return tuple(key)
+
+    def offset(self, inF, key, lo=None, hi=None, scan=65536):
+        """Offset of the 1st line with a key >= key (binary search)"""
+        lo = len(self.header) if lo is None else lo
+        hi = self.size if hi is None else hi
+        # the offset is in [lo, hi]; lo is a line start
+        while hi - lo > scan:
+            mid = (lo + hi) // 2
+            inF.seek(mid - 1)
+            inF.readline()
+            pos = inF.tell()
+            if pos >= hi:
+                break
+            line = inF.readline()
+            if self.key(line) < key:
+                lo = pos + len(line)
+            else:
+                hi = pos
+        inF.seek(lo)
+        while lo < hi:
+            line = inF.readline()
+            if not line or self.key(line) >= key:
+                break
+            lo += len(line)
+        return min(lo, hi)
+
+    def sample(self, n):
+        """Keys at n-1 evenly spaced offsets"""
+        keys = []
+        with open(self.infile, 'rb') as inF:
+            for i in range(1, n):
+                inF.seek(max(len(self.header), self.size * i // n) - 1)
+                inF.readline()
+                line = inF.readline()
+                if line:
+                    keys.append(self.key(line))
+        if keys != sorted(keys):
+            raise ValueError('{} is not sorted by the join key(s)'.format(self.infile))
+        return sorted(set(keys))
+
+    def offsets(self, keys):
+        """Offsets of the key ranges split at keys (sorted)"""
+        offsets = [len(self.header)]
+        with open(self.infile, 'rb') as inF:
+            for key in keys:
+                offsets.append(self.offset(inF, key, lo=offsets[-1]))
+        return offsets + [self.size]
+
+    def read(self, start, end, dtype=None, columns=None, filters=None,
+             profile=None):
+        """Rows in [start, end) (pandas), counted by profile (if any)"""
+        with open(self.infile, 'rb') as inF:
+            inF.seek(start)
+            data = inF.read(end - start)
+        df = pd.read_csv(io.BytesIO(self.header + data), sep=self.sep, dtype=dtype,
+                         usecols=read_columns(columns, filters))
+        if profile is not None:
+            profile.add_rows(self.infile, len(df), start)
+        return select_rows(df, dtype, columns, filters)
+
+
+def keys_sorted(df, on):
+    """Are the rows sorted by the key(s) (lexicographic for >1 key
+    column; missing keys first, as for KeyReader)?
+    """
+    if len(df) < 2:
+        return True
+    # comparing each row (y) with the previous row (x)
+    eq = np.ones(len(df) - 1, dtype=bool)
+    for col in on:
+        na = df[col].isnull().to_numpy()
+        values = df[col].to_numpy()
+        if na.any() and not na.all():
+            # any non-missing key as a placeholder for the missing keys
+            values = np.where(na, values[~na][0], values)
+        na_x,na_y = na[:-1],na[1:]
+        x,y = values[:-1],values[1:]
+        both = ~na_x & ~na_y
+        gt = (~na_x & na_y) | (both & (x > y))
+        if (eq & gt).any():
+            return False
+        eq &= (na_x & na_y) | (both & (x == y))
+    return True
+
+
+def range_merge(ranges, readers, join_on, how='inner', dtypes=None,
+                columns=None, filters=None, profile=None):
+    """Merging the rows of 1 key range of each (sorted) table
+    ranges : [(start, end)] offsets of the range in each table
+    profile : Profile counting the rows of each range (see
+      Profile.task_rows)
+    """
+    dfs = []
+    for (start,end),reader,side,i in zip(ranges, readers, ['left', 'right'], range(2)):
+        df = reader.read(start, end, dtype=dtypes[i], columns=columns[i],
+                         filters=filters[i], profile=profile)
+        if not keys_sorted(df, join_on[side]):
+            msg = '{} is not sorted by the join key(s) at offset {}'
+            raise ValueError(msg.format(reader.infile, start))
+        dfs.append(df)
+    return pd.merge(dfs[0], dfs[1], how=how, left_on=join_on['left'],
+                    right_on=join_on['right'])
+
+
+def presorted_join(tables, join_on, how='inner', sep='\t', dtypes=None,
+                   blocksize=64 * 1024 ** 2, npartitions=None, columns=None,
+                   filters=None, profile=None):
+    """Key-range partitioned join of 2 tables sorted by the join key(s)
+    (see PRESORTED); no shuffle.
+    Returns a dask dataframe (1 partition per key range, in key order)
+    """
+    if dtypes is None:
+        dtypes = [None, None]
+    if columns is None:
+        columns = [None, None]
+    if filters is None:
+        filters = [None, None]
+    readers = [KeyReader(x, join_on[side], sep=sep, dtype=dtype) for
+               x,side,dtype in zip(tables, ['left', 'right'], dtypes)]
+    large = 0 if readers[0].size >= readers[1].size else 1
+    if npartitions is None:
+        npartitions = max(int(readers[large].size / blocksize), 1)
+    keys = readers[large].sample(npartitions)
+    offsets = [x.offsets(keys) for x in readers]
+    ranges = [list(zip(x[:-1], x[1:])) for x in offsets]
+    logging.info('presorted: {} key ranges'.format(len(ranges[0])))
+    # output dtypes from the 1st rows
+    meta = [select_rows(pd.read_csv(x.infile, sep=sep, dtype=dtypes[i], nrows=100,
+                                    usecols=read_columns(columns[i], filters[i])),
+                        dtypes[i], columns[i], filters[i]).iloc[:0]
+            for i,x in enumerate(readers)]
+    meta = pd.merge(meta[0], meta[1], how=how, left_on=join_on['left'],
+                    right_on=join_on['right'])
+    if profile is None:
+        profile = Profile()
+    if not all([profile.task_rows(x) for x in tables]):
+        profile = None
+    parts = [dask.delayed(range_merge)(x, readers, join_on, how=how, dtypes=dtypes,
+                                       columns=columns, filters=filters,
+                                       profile=profile)
+             for x in zip(*ranges)]
+    return dd.from_delayed(parts, meta=meta, verify_meta=False)
+
+
+def write_chunks(chunks, outfile='-', sep='\t', profile=None):
+    """Writing an iterable of dataframes to outfile (in order).
+    Returns the number of bytes written.
+    """
+    if profile is None:
+        profile = Profile()
+    fmt = output_format(outfile)
+    outF = open_output(outfile)
+    writer = OrderedWriter(outF)
+    try:
+        with profile.stage('execute'):
+            for i,df in enumerate(chunks):
+                writer.put(i, partition_block(df, sep=sep, header=(i == 0), fmt=fmt),
+                           len(df))
+        profile_writer(writer, profile)
+    finally:
+        writer.close()
+        if outfile == '-':
+            outF.flush()
+        else:
+            outF.close()
+    return writer.n_bytes
+
+
 def main(args=None):
     # Input
     if args is None:
         args = parse_args()
+    check_args(args, args.join_parser)
+
+    if args.profile is None:
+        join(args)
+        return
+    # profiling
+    profile = Profile(enabled=True, scheduler=args.scheduler)
+    tmp_dirs = set([x for x in (tempfile.gettempdir(), args.tmp_dir,
+                                dask.config.get('temporary_directory', None))
+                    if x is not None])
+    with profile.monitor_spill(tmp_dirs):
+        join(args, profile)
+    profile.write(args.profile)
+
+
+def join(args, profile=None):
+    """Running the join (see main)
+    profile : Profile of the join
+    """
+    if profile is None:
+        profile = Profile()
+    # building a join index
+    if args.build_index is not None:
+        build_index(args.build_index, key=args.index_key, sep=args.sep)
+        if len(args.table) == 0:
+            return
+    if len(args.table) < 2:
+        raise ValueError('At least 2 tables are needed for a join')
+    if len(args.table) > 2:
+        multi_main(args, profile)
+        return
 
-    # clean tmp directory
-    if args.clean:
-        clean_partd()
- 
     # parsing the join arg
-    join_on = parse_join(args.join)
+    join_on = parse_join(args.join[0] if args.join else '1=1')
     ## parsing dtypes
     args.dtypeL = parse_dtype(args.dtypeL, join_on['left'])
     args.dtypeR = parse_dtype(args.dtypeR, join_on['right'])
+    dtypes = [args.dtypeL, args.dtypeR]
+    ## parsing the columns to read & row filters
+    columns = [parse_columns(args.columnsL, join_on['left']),
+               parse_columns(args.columnsR, join_on['right'])]
+    filters = [parse_filters(args.filterL), parse_filters(args.filterR)]
 
-    # creating table objects
-    df1 = get_table(args.table[0], sep=args.sep, dtype=args.dtypeL)
-    df2 = get_table(args.table[1], sep=args.sep, dtype=args.dtypeR)
+    # join engine
+    memory = parse_size(args.memory)
+    indexed = None
+    if args.engine in ('auto', 'index') and args.how not in ('semi', 'anti'):
+        indexed = find_index(args.table, join_on, how=args.how)
+    if args.how in ('semi', 'anti'):
+        engine,small = 'semi', 1
+        logging.info('join engine: {} (key set)'.format(engine))
+    elif args.presorted:
+        engine,small = 'presorted', 1
+        logging.info('join engine: {}'.format(engine))
+    elif indexed is not None:
+        engine,small = 'index', indexed[0]
+        logging.info('join engine: {}'.format(engine))
+    elif args.engine == 'index':
+        msg = 'No up-to-date index on the join column that supports --how {}'
+        raise ValueError(msg.format(args.how))
+    else:
+        engine,small = select_engine(args.table, how=args.how, engine=args.engine,
+                                     broadcast_max=args.broadcast_max,
+                                     memory=memory)
 
-    # joining (merging)
-    df = dd.merge(df1, df2, left_on=join_on['left'], right_on=join_on['right'], how=args.how) #, npartitions=args.procs)
-    
-    # writing out temporary files
-    tempFile_str = write_tmp(df)
-    
-    # cat files
-    for i,infile in enumerate(glob.glob(tempFile_str)):
-        if i == 0:
-            conn = 'w'
-            header = True
+    if engine == 'sort':
+        chunks = sort_merge_join(args.table, join_on, how=args.how,
+                                 sep=args.sep, dtypes=dtypes, memory=memory,
+                                 tmpdir=args.tmp_dir, columns=columns,
+                                 filters=filters, profile=profile)
+        write_chunks(chunks, args.outfile, sep='\t', profile=profile)
+        return
+
+    blocksize = parse_size(args.blocksize)
+    with dask_scheduler(args.scheduler, procs=args.procs,
+                        worker_memory=args.worker_memory) as client:
+        if engine == 'presorted':
+            df = presorted_join(args.table, join_on, how=args.how, sep=args.sep,
+                                dtypes=dtypes, blocksize=blocksize,
+                                npartitions=args.npartitions, columns=columns,
+                                filters=filters, profile=profile)
+        elif engine == 'semi':
+            df = semi_join(args.table, join_on, how=args.how, sep=args.sep,
+                           dtypes=dtypes, blocksize=blocksize, columns=columns,
+                           filters=filters, profile=profile)
+        elif engine == 'index':
+            df = index_join(args.table, join_on, indexed=small, index=indexed[1],
+                            how=args.how, sep=args.sep, dtypes=dtypes,
+                            blocksize=blocksize, columns=columns, filters=filters,
+                            profile=profile)
+        elif engine == 'broadcast':
+            df = broadcast_join(args.table, join_on, small=small, how=args.how,
+                                sep=args.sep, dtypes=dtypes, blocksize=blocksize,
+                                columns=columns, filters=filters, profile=profile)
         else:
-            conn = 'a'
-            header = False        
-        write_table(infile, args.outfile, conn=conn, header=header)
-            
-        
+            # clean tmp directory
+            if args.clean:
+                clean_partd()
+            # creating table objects
+            df1 = get_table(args.table[0], sep=args.sep, dtype=args.dtypeL,
+                            blocksize=blocksize, columns=columns[0],
+                            filters=filters[0], profile=profile)
+            df2 = get_table(args.table[1], sep=args.sep, dtype=args.dtypeR,
+                            blocksize=blocksize, columns=columns[1],
+                            filters=filters[1], profile=profile)
+            # joining (merging)
+            df = hash_merge(df1, df2, join_on['left'], join_on['right'],
+                            how=args.how, npartitions=args.npartitions,
+                            key_encoding=args.key_encoding)
+        logging.info('joined table: {} partitions'.format(df.npartitions))
+    
+        # writing out the partitions (streaming)
+        write_partitions(df, args.outfile, sep='\t', client=client,
+                         profile=profile)
+
+
+def multi_main(args, profile=None):
+    """Joining >2 tables (see MULTI-TABLE JOIN)
+    """
+    # parsing the join args (1 per joined table)
+    n = len(args.table)
+    joins = args.join if args.join else ['1=1']
+    if len(joins) == 1:
+        joins = joins * (n - 1)
+    elif len(joins) != n - 1:
+        msg = 'The number of --join should be 1 or the number of tables - 1'
+        raise ValueError(msg)
+    join_ons = [parse_join(x) for x in joins]
+    ## dtypes, columns & filters of each table
+    left_dtypes = [parse_dtype(args.dtypeL, on['left']) for on in join_ons]
+    dtypes = [left_dtypes[0]]
+    columns = [parse_columns(args.columnsL, join_ons[0]['left'])]
+    filters = [parse_filters(args.filterL)]
+    for on in join_ons:
+        dtypes.append(parse_dtype(args.dtypeR, on['right']))
+        columns.append(parse_columns(args.columnsR, on['right']))
+        filters.append(parse_filters(args.filterR))
+
+    blocksize = parse_size(args.blocksize)
+    with dask_scheduler(args.scheduler, procs=args.procs,
+                        worker_memory=args.worker_memory) as client:
+        if args.clean:
+            clean_partd()
+        df = multi_join(args.table, join_ons, how=args.how, sep=args.sep,
+                        dtypes=dtypes, blocksize=blocksize, engine=args.engine,
+                        broadcast_max=args.broadcast_max, columns=columns,
+                        filters=filters, left_dtypes=left_dtypes,
+                        key_encoding=args.key_encoding,
+                        npartitions=args.npartitions, profile=profile)
+        logging.info('joined table: {} partitions'.format(df.npartitions))
+        write_partitions(df, args.outfile, sep='\t', client=client,
+                         profile=profile)
@@ -16,6 +16,7 @@ from leylab_pipelines.DB import Acc2TaxID
 from leylab_pipelines.DB import TaxID2Lin
 from leylab_pipelines.DB import TaxID2LinTbl
 from leylab_pipelines.DB import EggNOG
+from leylab_pipelines.DB import IDMap
 ### LLP
 from leylab_pipelines import Join
 
@@ -62,6 +63,7 @@ def LLP_DB_arg_parse():
   epi = epi + '  taxID2lin - ' + TaxID2Lin.get_desc() + '\n'
   epi = epi + '  taxID2linTbl - ' + TaxID2LinTbl.get_desc() + '\n'
   epi = epi + '  eggnog - ' + EggNOG.get_desc() + '\n'
+  epi = epi + '  idmap - ' + IDMap.get_desc() + '\n'
   
   # main command arg parser
   parser = argparse.ArgumentParser(description=desc, epilog=epi,
@@ -74,6 +76,7 @@ def LLP_DB_arg_parse():
   parser_taxID2lintbl = TaxID2LinTbl.parse_args(subparsers=subparsers)
   parser_acc2taxID = Acc2TaxID.parse_args(subparsers=subparsers)
   parser_eggnog = EggNOG.parse_args(subparsers=subparsers)
+  IDMap.parse_args(subparsers=subparsers)
   # parsing args
   args = parser.parse_args()
   
@@ -88,6 +91,8 @@ def LLP_DB_arg_parse():
     Acc2TaxID.main(args)
   elif args.subparser_name.lower() == 'eggnog':
     EggNOG.main(args)
+  elif args.subparser_name.lower() == 'idmap':
+    IDMap.main(args)
   else:
     msg = 'Command not recognized: "{}"'
     raise ValueError(msg.format(args.subparser_name))
@@ -48,6 +48,8 @@ def parse_args(test_args=None, subparsers=None):
                          help='An excel or tab-delim file of concentrations')
     groupIO.add_argument('--prefix', type=str, default='TECAN_dilute',
                          help='Output file name prefix (default: %(default)s)')
+    groupIO.add_argument('--win-only', action='store_true', default=False,
+                         help='Only write the robot-ready output files with Windows line breaks ("_win"), (default: %(default)s)')
 
     ## concentration file
     conc = parser.add_argument_group('Concentation file')
@@ -273,15 +275,14 @@ def pip_dilutant(df_conc, outFH, src_labware='100ml[001]'):
 
     # making multi-disp object
     outFH.write('C;Dilutant\n')
-    MD = Fluent.multi_disp()
-    MD.SrcRackLabel = src_labware
-    MD.SrcPosition = 1                               # need to set for all channels?
-    MD.DestRackLabel = df_conc.dest_labware
-    MD.DestPositions = df_conc.dest_location
-    MD.Volume = df_conc.dilutant_volume             
-    MD.NoOfMultiDisp = n_disp
+    MD = Fluent.multi_disp(SrcRackLabel=src_labware,
+                           SrcPosition=1,            # need to set for all channels?
+                           DestRackLabel=df_conc.dest_labware,
+                           DestPositions=df_conc.dest_location,
+                           Volume=df_conc.dilutant_volume,
+                           NoOfMultiDisp=n_disp)
     # writing
-    outFH.write(MD.cmd() + '\n')
+    Fluent.write_gwl(outFH, [MD])
 
 
 def pip_samples(df_conc, outFH):
@@ -289,25 +290,11 @@ def pip_samples(df_conc, outFH):
     """
     outFH.write('C;Samples\n')
     # for each Sample-PCR_rxn_rep, write out asp/dispense commands
-    for i in range(df_conc.shape[0]):
-        # aspiration
-        asp = Fluent.aspirate()
-        asp.RackLabel = df_conc.ix[i,'labware']
-        asp.Position = df_conc.ix[i,'location']
-        asp.Volume = round(df_conc.ix[i,'sample_volume'], 2)
-        asp.LiquidClass = 'Water Contact Wet Single'
-        outFH.write(asp.cmd() + '\n')
-
-        # dispensing
-        disp = Fluent.dispense()
-        disp.RackLabel = df_conc.ix[i,'dest_labware']
-        disp.Position = df_conc.ix[i,'dest_location']
-        disp.Volume = round(df_conc.ix[i,'sample_volume'], 2)
-        disp.LiquidClass = 'Water Contact Wet Single'
-        outFH.write(disp.cmd() + '\n')
-
-        # tip to waste
-        outFH.write('W;\n')
+    cmds = Fluent.transfers(df_conc['labware'], df_conc['location'],
+                            df_conc['dest_labware'], df_conc['dest_location'],
+                            df_conc['sample_volume'].round(2),
+                            LiquidClass='Water Contact Wet Single')
+    Fluent.write_gwl(outFH, cmds)
 
 
 def main(args=None):
@@ -349,7 +336,7 @@ def main(args=None):
     
     # Writing out gwl file
     gwl_file = args.prefix + '.gwl'
-    with open(gwl_file, 'w') as gwlFH:
+    with Utils.LineEndWriter(gwl_file, win_only=args.win_only) as gwlFH:
         ## Dilutant
         pip_dilutant(df_conc, outFH=gwlFH, src_labware=args.dlabware)
         ## Sample
@@ -357,14 +344,11 @@ def main(args=None):
 
     # Writing out table
     conc_file = args.prefix + '_conc.txt'
-    df_conc.round(1).to_csv(conc_file, sep='\t', index=False)
+    with Utils.LineEndWriter(conc_file, win_only=args.win_only) as concFH:
+        df_conc.round(1).to_csv(concFH, sep='\t', index=False)
 
-    # Create windows-line breaks formatted versions
-    gwl_file_win = Utils.to_win(gwl_file)
-    conc_file_win = Utils.to_win(conc_file)
-
-    # end
-    return (gwl_file, gwl_file_win, conc_file, conc_file_win)
+    # end (unix & windows-line breaks formatted versions)
+    return gwlFH.files + concFH.files
 
 
 # main
@@ -4,6 +4,8 @@
 from __future__ import print_function
 import os
 import sys
+from itertools import repeat, islice
+from operator import attrgetter
 import numpy as np
 
 
@@ -13,19 +15,160 @@ def xstr(x):
     else:
         return x
 
+LIQUID_CLASSES = frozenset(['Water Free Multi', 'Water Free Single',
+                            'MasterMix Free Multi', 'MasterMix Free Single', 
+                            'Ethanol Free Multi', 'Ethanol Free Single', 
+                            'DMSO Free Multi', 'DMSO Free Single', 
+                            'Serum Free Multi', 'Serum Free Single',
+                            'Water Contact Wet Multi', 'Water Contact Wet Single',
+                            'Water Mix'])
+
 def _psbl_liq_cls():
     """Returns a set of possible liquid classes available for Fluent
     """
-    x = ('Water Free Multi', 'Water Free Single',
-         'MasterMix Free Multi', 'MasterMix Free Single', 
-         'Ethanol Free Multi', 'Ethanol Free Single', 
-         'DMSO Free Multi', 'DMSO Free Single', 
-         'Serum Free Multi', 'Serum Free Single',
-         'Water Contact Wet Multi', 'Water Contact Wet Single',
-         'Water Mix')
+    return LIQUID_CLASSES
+
+def _check_liq_cls(value):
+    if value not in LIQUID_CLASSES:
+        msg = 'Liquid class "{}" not allowed'
+        raise TypeError(msg.format(value))
+    return value
+
+def _is_scalar(x):
+    return x is None or isinstance(x, str) or not hasattr(x, '__iter__')
+
+def _as_tuple(x):
+    """Sequences (eg., a DataFrame column) as tuples; scalars as is
+    """
+    if _is_scalar(x):
+        return x
+    try:
+        x = x.tolist()
+    except AttributeError:
+        pass
+    return tuple(x)
+
+def _field_str(x):
+    """A command field value as a string (None as blank)
+    """
+    return str(xstr(x))
+
+def _positions(x):
+    """Well/tube positions as a tuple of ints (>0)
+    """
+    x = tuple(int(y) for y in _as_tuple(x))
+    assert min(x) > 0, 'Min position is 1'
     return x
 
-class asp_disp():
+
+class _record(object):
+    """Immutable worklist command record.
+    Subclasses set the command ID (_ID), the field order (_fields; also
+    the __slots__), the defaults of all fields (_defaults), the field value
+    converters/validators (_converters) and a getter of all field values
+    in order (_values).
+    Fields are set via keywords: aspirate(RackLabel='plate', Position=3);
+    use _replace() to get a modified copy.
+    """
+    __slots__ = ()
+    _ID = ''
+    _fields = ()
+    _defaults = {}
+    _converters = ()
+    _values = None
+    psbl_liq_cls = LIQUID_CLASSES
+
+    def __init__(self, **kwargs):
+        values = self._defaults.copy()
+        values.update(kwargs)
+        if len(values) != len(self._fields):
+            x = ','.join(k for k in kwargs if k not in self._defaults)
+            msg = '{}: unknown parameter(s) "{}"'
+            raise TypeError(msg.format(type(self).__name__, x))
+        for k,func in self._converters:
+            values[k] = func(values[k])
+        set_value = object.__setattr__
+        for k in self._fields:
+            set_value(self, k, values[k])
+
+    def __setattr__(self, name, value):
+        msg = '{} is immutable; use _replace()'
+        raise AttributeError(msg.format(type(self).__name__))
+
+    def __delattr__(self, name):
+        self.__setattr__(name, None)
+
+    def _asdict(self):
+        return dict((k, getattr(self, k)) for k in self._fields)
+
+    def _replace(self, **kwargs):
+        x = self._asdict()
+        x.update(kwargs)
+        return type(self)(**x)
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return all(getattr(self, k) == getattr(other, k) for k in self._fields)
+
+    def __ne__(self, other):
+        x = self.__eq__(other)
+        return x if x is NotImplemented else not x
+
+    def __hash__(self):
+        return hash((type(self),) + tuple(getattr(self, k) for k in self._fields))
+
+    def __repr__(self):
+        x = ', '.join('{}={!r}'.format(k, getattr(self, k)) for k in self._fields)
+        return '{}({})'.format(type(self).__name__, x)
+
+    def cmd(self):
+        # values in field order; None as blank string
+        vals = [self._ID]
+        vals.extend([_field_str(x) for x in self._values(self)])
+        return ';'.join(vals)
+
+    @classmethod
+    def cmds(cls, n, **kwargs):
+        """cmd() of n records, built column-wise (no record objects).
+        Each field is a scalar (the same for all records) or an
+        iterable of n values (eg., a DataFrame column); the values are
+        converted/validated as for a single record.
+        Returns : list of n command strings
+        """
+        values = cls._defaults.copy()
+        values.update(kwargs)
+        if len(values) != len(cls._fields):
+            x = ','.join(k for k in kwargs if k not in cls._defaults)
+            msg = '{}: unknown parameter(s) "{}"'
+            raise TypeError(msg.format(cls.__name__, x))
+        converters = dict(cls._converters)
+        cols = [repeat(cls._ID, n)]
+        for k in cls._fields:
+            x = values[k]
+            func = converters.get(k)
+            if _is_scalar(x):
+                x = _field_str(x if func is None else func(x))
+                cols.append(repeat(x, n))
+                continue
+            x = list(x)
+            if len(x) != n:
+                msg = 'Length of {} ({}) != number of commands ({})'
+                raise ValueError(msg.format(k, len(x), n))
+            if func is not None:
+                # converting each unique value once
+                conv = {}
+                x = [conv[y] if y in conv else conv.setdefault(y, func(y)) for y in x]
+            cols.append([_field_str(y) for y in x])
+        return [';'.join(x) for x in zip(*cols)]
+
+    def lines(self):
+        """Yields the gwl line(s) of the command
+        """
+        yield self.cmd()
+
+
+class asp_disp(_record):
     """Commands for aliquoting mastermix
     *Parameters*
     RackLabel
@@ -40,74 +183,87 @@ class asp_disp():
     ForceRack
     MinDetected
     """
-
-    def __init__(self):
-        self._ID = ''
-        # aspirate parameters
-        self.RackLabel = None
-        self.RackID = None
-        self.RackType = None
-        self._Position = 1
-        self.TubeID = None
-        self.Volume = None
-        self._LiquidClass = 'Water Free Single'
-        self.TipType = None
-        self.TipMask = None
-        self.key_order = ['_ID',
-                          'RackLabel', 'RackID', 'RackType',
-                          'Position', 'TubeID', 'Volume',
-                          'LiquidClass', 'TipType', 'TipMask']
-        self.psbl_liq_cls = _psbl_liq_cls()
-
-
-    def cmd(self):
-        # list of values in correct order
-        vals = [getattr(self, x) for x in self.key_order]
-        # None to blank string
-        vals = [xstr(x) for x in vals]
-        # convert all to strings
-        vals = [str(x) for x in vals]
-        # return
-        return ';'.join(vals)
+    _fields = ('RackLabel', 'RackID', 'RackType',
+               'Position', 'TubeID', 'Volume',
+               'LiquidClass', 'TipType', 'TipMask')
+    __slots__ = _fields
+    _defaults = dict(dict.fromkeys(_fields), Position=1,
+                     LiquidClass='Water Free Single')
+    _converters = (('Position', int), ('LiquidClass', _check_liq_cls))
+    _values = attrgetter(*_fields)
 
     def liquid_classes(self):
-        x = '\n,'.join(list(self.psbl_liq_cls))
+        x = '\n,'.join(sorted(self.psbl_liq_cls))
         print(x)        
 
-    @property
-    def Position(self):
-        return self._Position
-
-    @Position.setter
-    def Position(self, value):
-        self._Position = int(value)
 
-    @property
-    def LiquidClass(self):
-        return self._LiquidClass
+class aspirate(asp_disp):
+    __slots__ = ()
+    _ID = 'A'
 
-    @LiquidClass.setter
-    def LiquidClass(self, value):
-        if value not in self.psbl_liq_cls:
-            msg = 'Liquid class "{}" not allowed'
-            raise TypeError(msg.format(value))
-        self._LiquidClass = value
 
+class dispense(asp_disp):
+    __slots__ = ()
+    _ID = 'D'
 
 
-class aspirate(asp_disp):
-    def __init__(self):
-        asp_disp.__init__(self)
-        self._ID = 'A'
+def transfers(SrcRackLabel, SrcPosition, DestRackLabel, DestPosition,
+              Volume, LiquidClass='Water Free Single', chunksize=10000):
+    """Lazily yields the aspirate, dispense & waste ('W;') gwl lines
+    of each transfer, built column-wise in chunks of chunksize
+    transfers (see _record.cmds).
+    Each parameter is a scalar or an iterable (eg., a DataFrame column);
+    the number of transfers is set by DestPosition.
+    """
+    def _chunks(x):
+        if _is_scalar(x):
+            return repeat(x)
+        x = iter(x)
+        return iter(lambda: list(islice(x, chunksize)), [])
+    src, src_pos, dest, vol, liq_cls = [_chunks(x) for x in
+                                        (SrcRackLabel, SrcPosition, DestRackLabel,
+                                         Volume, LiquidClass)]
+    for pos in _chunks(DestPosition):
+        n = len(pos)
+        v, lc = next(vol, []), next(liq_cls, [])
+        asp = aspirate.cmds(n, RackLabel=next(src, []), Position=next(src_pos, []),
+                            Volume=v, LiquidClass=lc)
+        disp = dispense.cmds(n, RackLabel=next(dest, []), Position=pos,
+                             Volume=v, LiquidClass=lc)
+        for x in zip(asp, disp, repeat('W;')):
+            for line in x:
+                yield line
+
+
+def gwl_lines(cmds):
+    """Lazily yields gwl lines (no line breaks) from commands.
+    cmds : iterable of command records, gwl lines (eg., 'C;comment')
+           and/or nested iterables of these (eg., transfers())
+    """
+    for x in cmds:
+        if isinstance(x, str):
+            yield x
+        elif isinstance(x, _record):
+            for line in x.lines():
+                yield line
+        else:
+            for line in gwl_lines(x):
+                yield line
 
 
-class dispense(asp_disp):
-    def __init__(self):
-        asp_disp.__init__(self)
-        self._ID = 'D'
+def write_gwl(outFH, cmds, block_lines=30000):
+    """Writing commands (see gwl_lines) to a file handle; 1 line each,
+    written in blocks of block_lines lines
+    """
+    lines = gwl_lines(cmds)
+    while True:
+        block = list(islice(lines, block_lines))
+        if len(block) == 0:
+            break
+        outFH.write('\n'.join(block) + '\n')
 
 
-class multi_disp():
+class multi_disp(_record):
     """Commands for aliquoting mastermix
     *AspirateParameters*
     SrcRackLabel
@@ -118,111 +274,67 @@ class multi_disp():
     DestRackLabel
     DestRackID
     DestRackType
-    DestPosStart
-    DestPosEnd
-    *Samples*
-    SampleCount
+    DestPositions
     *Other*
-    Volume = How much volume per dispense?
+    Volume = How much volume per dispense? (single value or 1 per dispense)
     LiquidClass = Which liquid class to use? Default: 'Water Free Multi'
     NoOfMultiDisp = How many multi-dispenses?
     
     Returns
     * string of commands
     """
+    _ID = 'R'
+    _fields = ('SrcRackLabel', 'SrcRackID', 'SrcRackType', 'SrcPosition',
+               'DestRackLabel', 'DestRackID', 'DestRackType', 'DestPositions',
+               'Volume', 'LiquidClass', 'NoOfMultiDisp')
+    __slots__ = _fields
+    _defaults = dict(dict.fromkeys(_fields), SrcPosition=1,
+                     DestRackLabel=(), DestRackID=(), DestRackType=(),
+                     DestPositions=(1,), Volume=1,
+                     LiquidClass='Water Free Multi', NoOfMultiDisp=2)
+    _converters = (('DestRackLabel', _as_tuple), ('DestRackID', _as_tuple),
+                   ('DestRackType', _as_tuple), ('DestPositions', _positions),
+                   ('Volume', _as_tuple), ('LiquidClass', _check_liq_cls),
+                   ('NoOfMultiDisp', int))
+    _values = attrgetter(*_fields)
 
-    def __init__(self):
-        self._ID = 'R'
-        # aspirate parameters
-        self.SrcRackLabel = None
-        self.SrcRackID = None
-        self.SrcRackType = None
-        self.SrcPosition = 1
-        # dispense parameters
-        self.DestRackLabel = []
-        self.DestRackID = []
-        self.DestRackType = []
-        self._DestPositions = [1]
-        # other
-        self.Volume = 1
-        self._LiquidClass = 'Water Free Multi'
-        self.NoOfMultiDisp = 2
-        self.psbl_liq_cls = _psbl_liq_cls()
-
-    def xstr(self, x):
-        if x is None:
-            return ''
-        else:
-            return x
-
-    def cmd(self):
-        # volume as interable
-        if hasattr(self.Volume, '__iter__'):
-            self.Volumes = self.Volume
+    @property
+    def SampleCount(self):
+        return len(self.DestPositions)
+
+    def lines(self):
+        """Yields the gwl lines: 1 aspirate + NoOfMultiDisp dispenses (+ waste)
+        per multi-dispense
+        """
+        # volume per dispense
+        if isinstance(self.Volume, tuple):
+            volumes = self.Volume
         else:
-            self.Volumes = [self.Volume] * len(self.DestPositions)
+            volumes = (self.Volume,) * self.SampleCount
         # each multi-disp
-        steps = []
         for i in range(0, self.SampleCount, self.NoOfMultiDisp):
             # number of dispenses
-            if self.SampleCount - i < self.NoOfMultiDisp:
-                n_disp = self.SampleCount - i
-            else:
-                n_disp = self.NoOfMultiDisp
-            # amount to aspirate
-            asp_vol = round(self.Volume * n_disp, 2)
+            n_disp = min(self.SampleCount - i, self.NoOfMultiDisp)
             # single-asp
-            asp = aspirate()
-            asp.RackLabel = self.SrcRackLabel
-            asp.Position = self.SrcPosition
-            asp.Volume = sum(self.Volumes[i:(i+n_disp)])   #asp_vol
-            asp.Volume = round(asp.Volume, 2)
-            asp.LiquidClass = self.LiquidClass
-            steps.append(asp.cmd())
+            asp = aspirate(RackLabel=self.SrcRackLabel,
+                           Position=self.SrcPosition,
+                           Volume=round(sum(volumes[i:(i+n_disp)]), 2),
+                           LiquidClass=self.LiquidClass)
+            yield asp.cmd()
             # multi-disp
-            for ii in range(n_disp):
-                disp = dispense()
-                disp.RackLabel = self.DestRackLabel[i+ii]
-                disp.Position = self.DestPositions[i+ii]
-                disp.Volume = round(self.Volumes[i+ii], 2)
-                disp.LiquidClass = self.LiquidClass
-                steps.append(disp.cmd())
-            steps.append('W;')
-                
-        return '\n'.join(steps)
-
-    @property
-    def LiquidClass(self):
-        return self._LiquidClass
-
-    @LiquidClass.setter
-    def LiquidClass(self, value):
-        if value not in self.psbl_liq_cls:
-            msg = 'Liquid class "{}" not allowed'
-            raise TypeError(msg.format(value))
-        self._LiquidClass = value
-
-    @property
-    def DestPositions(self):
-        return self._DestPositions
-
-    @DestPositions.setter
-    def DestPositions(self, values):
-        try:
-            values = values.tolist()
-        except AttributeError:
-            pass
-        values = [int(x) for x in values]
-        assert min(values) > 0, 'Min position is 1'
-        self._DestPositions = values 
-
-    @property
-    def SampleCount(self):
-        return len(self._DestPositions)
+            for ii in range(i, i + n_disp):
+                disp = dispense(RackLabel=self.DestRackLabel[ii],
+                                Position=self.DestPositions[ii],
+                                Volume=round(volumes[ii], 2),
+                                LiquidClass=self.LiquidClass)
+                yield disp.cmd()
+            yield 'W;'
 
+    def cmd(self):
+        return '\n'.join(self.lines())
 
 
-class reagent_distribution():
+class reagent_distribution(_record):
     """Commands for aliquoting mastermix
     *AspirateParameters*
     SrcRackLabel
@@ -249,51 +361,20 @@ class reagent_distribution():
 
     # Example: R;100ml_2;;Trough 100ml;1;1;96 Well Skirted PCR[003];;96 Well Skirted PCR;1;96;20;Water Free Multi;1;5;0
     """
-
-    def __init__(self, ):
-        self._ID = 'R'
-        # aspirate parameters
-        self.SrcRackLabel = None
-        self.SrcRackID = None
-        self.SrcRackType = None
-        self.SrcPosStart = 1
-        self.SrcPosEnd = 1
-        # dispense parameters
-        self.DestRackLabel = None
-        self.DestRackID = None
-        self.DestRackType = None
-        self.DestPositions = 1
-        self.DestPosEnd = 1
-        # other
-        self.Volume = 1
-        self.LiquidClass = 'Water Free Multi'
-        self.NoOfDiTiReuses = 1
-        self.NoOfMultiDisp = 5
-        self.Direction = 0
-        self.ExcludedDestWell = None
-        self.key_order = ['_ID',
-                          'SrcRackLabel', 'SrcRackID', 'SrcRackType',
-                          'SrcPosStart', 'SrcPosEnd',
-                          'DestRackLabel', 'DestRackID', 'DestRackType',
-                          'DestPosStart', 'DestPosEnd',
-                          'Volume', 'LiquidClass', 'NoOfDiTiReuses',
-                          'NoOfMultiDisp', 'Direction', 'ExcludedDestWell']
-
-    def xstr(self, x):
-        if x is None:
-            return ''
-        else:
-            return x
-
-    def cmd(self):
-        # list of values in correct order
-        vals = [getattr(self, x) for x in self.key_order]
-        # None to blank string
-        vals = [xstr(x) for x in vals]
-        # convert all to strings
-        vals = [str(x) for x in vals]
-        # return
-        return ';'.join(vals)
+    _ID = 'R'
+    _fields = ('SrcRackLabel', 'SrcRackID', 'SrcRackType',
+               'SrcPosStart', 'SrcPosEnd',
+               'DestRackLabel', 'DestRackID', 'DestRackType',
+               'DestPosStart', 'DestPosEnd',
+               'Volume', 'LiquidClass', 'NoOfDiTiReuses',
+               'NoOfMultiDisp', 'Direction', 'ExcludedDestWell')
+    __slots__ = _fields
+    _defaults = dict(dict.fromkeys(_fields), SrcPosStart=1, SrcPosEnd=1,
+                     DestPosStart=1, DestPosEnd=1, Volume=1,
+                     LiquidClass='Water Free Multi', NoOfDiTiReuses=1,
+                     NoOfMultiDisp=5, Direction=0)
+    _converters = (('LiquidClass', _check_liq_cls),)
+    _values = attrgetter(*_fields)
 
 
 
@@ -44,6 +44,7 @@ def parse_args(test_args=None, subparsers=None):
 
     OUTPUT FILES:
     * The output files ending in "_win" have Windows line breads (needed for the robot)
+    * Use "--win-only" to just write the "_win" files
 
     MISC NOTES:
     * All volumes are in ul
@@ -66,6 +67,8 @@ def parse_args(test_args=None, subparsers=None):
                          help='Which rows of the mapping file to use (eg., "all"=all rows; "1-48"=rows1-48; "1,3,5-6"=rows1+3+5+6), (default: %(default)s)')
     groupIO.add_argument('--prefix', type=str, default='TECAN_NGS_amplicon',
                          help='Output file name prefix (default: %(default)s)')
+    groupIO.add_argument('--win-only', action='store_true', default=False,
+                         help='Only write the robot-ready output files with Windows line breaks ("_win"), (default: %(default)s)')
 
     ## Destination plate
     dest = parser.add_argument_group('Destination plate')
@@ -237,7 +240,7 @@ def add_dest(df_map, dest_labware, dest_type='96',
     df_dest = pd.DataFrame(np.nan, index=range(nrow), columns=cols)
 
     # filling destination df
-    for i,(sample,rep) in enumerate(product(df_map.ix[:,0], range(rxn_reps))):
+    for i,(sample,rep) in enumerate(product(df_map.iloc[:,0], range(rxn_reps))):
         # dest location
         dest_location = i + dest_start
         msg = 'WARNING: Not enough wells for the number of samples'
@@ -286,16 +289,15 @@ def pip_mastermix(df_map, outFH, mmvolume=13.1, mmtube=1, liq_cls='Water Free Si
     mmtube = int(mmtube)
     outFH.write('C;MasterMix\n')
 
-    MD = Fluent.multi_disp()
-    MD.SrcRackLabel = 'micro15[{0:0>3}]'.format(mmtube)
-    MD.SrcPosition = mmtube
-    MD.DestRackLabel = df_map.ix[:,'TECAN_dest_labware']    
-    MD.DestPositions = df_map.ix[:,'TECAN_dest_location']
-    MD.Volume = mmvolume
-    MD.LiquidClass = liq_cls
-    MD.NoOfMultiDisp = int(np.floor(160 / mmvolume))  # using 200 ul tips
+    MD = Fluent.multi_disp(SrcRackLabel='micro15[{0:0>3}]'.format(mmtube),
+                           SrcPosition=mmtube,
+                           DestRackLabel=df_map.loc[:,'TECAN_dest_labware'],
+                           DestPositions=df_map.loc[:,'TECAN_dest_location'],
+                           Volume=mmvolume,
+                           LiquidClass=liq_cls,
+                           NoOfMultiDisp=int(np.floor(160 / mmvolume)))  # using 200 ul tips
 
-    outFH.write(MD.cmd() + '\n')
+    Fluent.write_gwl(outFH, [MD])
 
 
 def pip_nonbarcode_primer(df_map, outFH, volume, tube, liq_cls='Water Free Single'):
@@ -308,26 +310,12 @@ def pip_nonbarcode_primer(df_map, outFH, volume, tube, liq_cls='Water Free Singl
     """
     tube = int(tube)
     outFH.write('C;Non-barcoded primers\n')
-    # for each Sample-PCR_rxn_rep, write out asp/dispense commands
-    for i in range(df_map.shape[0]):
-        # aspiration
-        asp = Fluent.aspirate()
-        asp.RackLabel = 'micro15[{0:0>3}]'.format(tube)
-        asp.Position = tube
-        asp.Volume = volume
-        asp.LiquidClass = liq_cls
-        outFH.write(asp.cmd() + '\n')
-
-        # dispensing
-        disp = Fluent.dispense()
-        disp.RackLabel = df_map.ix[i,'TECAN_dest_labware']
-        disp.Position = df_map.ix[i,'TECAN_dest_location']
-        disp.Volume = volume
-        disp.LiquidClass = liq_cls
-        outFH.write(disp.cmd() + '\n')
-
-        # tip to waste
-        outFH.write('W;\n')
+    # asp/dispense commands for each Sample-PCR_rxn_rep (1 block)
+    cmds = Fluent.transfers('micro15[{0:0>3}]'.format(tube), tube,
+                            df_map['TECAN_dest_labware'],
+                            df_map['TECAN_dest_location'],
+                            volume, LiquidClass=liq_cls)
+    Fluent.write_gwl(outFH, cmds)
 
 def pip_primers(df_map, outFH, fp_volume=0, rp_volume=0,
                 fp_tube=0, rp_tube=0, liq_cls='Water Free Single'):
@@ -349,51 +337,26 @@ def pip_primers(df_map, outFH, fp_volume=0, rp_volume=0,
 
     # pipetting barcoded primers
     outFH.write('C;Barcoded primers\n')
-    ## for each Sample-PCR_rxn_rep, write out asp/dispense commands
-    for i in range(df_map.shape[0]):
-        # aspiration
-        asp = Fluent.aspirate()
-        asp.RackLabel = df_map.ix[i,'TECAN_primer_labware']
-        asp.Position = df_map.ix[i,'TECAN_primer_location']
-        asp.Volume = primer_plate_volume
-        asp.LiquidClass = liq_cls
-        outFH.write(asp.cmd() + '\n')
-
-        # dispensing
-        disp = Fluent.dispense()
-        disp.RackLabel = df_map.ix[i,'TECAN_dest_labware']
-        disp.Position = df_map.ix[i,'TECAN_dest_location']
-        disp.Volume = primer_plate_volume
-        asp.LiquidClass = liq_cls
-        outFH.write(disp.cmd() + '\n')
-
-        # tip to waste
-        outFH.write('W;\n')
+    ## asp/dispense commands for each Sample-PCR_rxn_rep (1 block)
+    cmds = Fluent.transfers(df_map['TECAN_primer_labware'],
+                            df_map['TECAN_primer_location'],
+                            df_map['TECAN_dest_labware'],
+                            df_map['TECAN_dest_location'],
+                            primer_plate_volume, LiquidClass=liq_cls)
+    Fluent.write_gwl(outFH, cmds)
 
 def pip_samples(df_map, outFH, liq_cls='Water Free Single'):
     """Commands for aliquoting samples to each PCR rxn
     """
     outFH.write('C;Samples\n')
-    # for each Sample-PCR_rxn_rep, write out asp/dispense commands
-    for i in range(df_map.shape[0]):
-        # aspiration
-        asp = Fluent.aspirate()
-        asp.RackLabel = df_map.ix[i,'TECAN_sample_labware']
-        asp.Position = df_map.ix[i,'TECAN_sample_location']
-        asp.Volume = df_map.ix[i,'TECAN_sample_rxn_volume']
-        asp.LiquidClass = liq_cls
-        outFH.write(asp.cmd() + '\n')
-
-        # dispensing
-        disp = Fluent.dispense()
-        disp.RackLabel = df_map.ix[i,'TECAN_dest_labware']
-        disp.Position = df_map.ix[i,'TECAN_dest_location']
-        disp.Volume = df_map.ix[i,'TECAN_sample_rxn_volume']
-        disp.LiquidClass = liq_cls
-        outFH.write(disp.cmd() + '\n')
-
-        # tip to waste
-        outFH.write('W;\n')
+    # asp/dispense commands for each Sample-PCR_rxn_rep (1 block)
+    cmds = Fluent.transfers(df_map['TECAN_sample_labware'],
+                            df_map['TECAN_sample_location'],
+                            df_map['TECAN_dest_labware'],
+                            df_map['TECAN_dest_location'],
+                            df_map['TECAN_sample_rxn_volume'],
+                            LiquidClass=liq_cls)
+    Fluent.write_gwl(outFH, cmds)
 
 def pip_water(df_map, outFH, pcr_volume=25.0, mm_volume=13.1, 
               fp_volume=2.0, rp_volume=2.0, liq_cls='Water Free Single'):
@@ -401,34 +364,19 @@ def pip_water(df_map, outFH, pcr_volume=25.0, mm_volume=13.1,
     """
     outFH.write('C;Water\n')
     # calculate the amount of water
-    water_volume = []
-    for i in range(df_map.shape[0]):
-        samp_volume = df_map.ix[i,'TECAN_sample_rxn_volume']
-        w_need = pcr_volume - (samp_volume + mm_volume + fp_volume + rp_volume)
-        assert w_need >= 0, 'Water volume is negative: {}'.format(w_need)
-        water_volume.append(w_need)
+    samp_volume = df_map['TECAN_sample_rxn_volume']
+    water_volume = pcr_volume - (samp_volume + mm_volume + fp_volume + rp_volume)
+    assert (water_volume >= 0).all(), \
+        'Water volume is negative: {}'.format(water_volume.min())
     df_map['TECAN_water_rxn_volume'] = water_volume
 
-    # for each Sample-PCR_rxn_rep, write out asp/dispense commands
-    for i in range(df_map.shape[0]):
-        # aspiration
-        asp = Fluent.aspirate()
-        asp.RackLabel = df_map.ix[i,'TECAN_sample_labware']
-        asp.Position = df_map.ix[i,'TECAN_sample_location']
-        asp.Volume = water_volume[i]
-        asp.LiquidClass = liq_cls
-        outFH.write(asp.cmd() + '\n')
-
-        # dispensing
-        disp = Fluent.dispense()
-        disp.RackLabel = df_map.ix[i,'TECAN_dest_labware']
-        disp.Position = df_map.ix[i,'TECAN_dest_location']
-        disp.LiquidClass = liq_cls
-        disp.Volume = water_volume[i]
-        outFH.write(disp.cmd() + '\n')
-
-        # tip to waste
-        outFH.write('W;\n')
+    # asp/dispense commands for each Sample-PCR_rxn_rep (1 block)
+    cmds = Fluent.transfers(df_map['TECAN_sample_labware'],
+                            df_map['TECAN_sample_location'],
+                            df_map['TECAN_dest_labware'],
+                            df_map['TECAN_dest_location'],
+                            water_volume, LiquidClass=liq_cls)
+    Fluent.write_gwl(outFH, cmds)
 
 def add_error(x, error_perc):
     if x is None:
@@ -520,7 +468,7 @@ def main(args=None):
     # GWL file construction
     ## gwl open
     gwl_file = args.prefix + '.gwl'
-    with open(gwl_file, 'w') as gwlFH:
+    with Utils.LineEndWriter(gwl_file, win_only=args.win_only) as gwlFH:
         ## mastermix
         pip_mastermix(df_map, gwlFH,
                       mmtube=args.mmtube,
@@ -546,7 +494,7 @@ def main(args=None):
 
     # Report (total volumes; sample truncation; samples)
     report_file = args.prefix + '.report'
-    with open(report_file, 'w') as repFH:
+    with Utils.LineEndWriter(report_file, win_only=args.win_only) as repFH:
         write_report(df_map, outFH=repFH,
                      pcr_volume=args.pcrvolume,
                      mm_volume=args.mmvolume,
@@ -562,17 +510,11 @@ def main(args=None):
     df_map['TECAN_water_rxn_volume'] = df_map['TECAN_water_rxn_volume'].round(2)
     df_map['TECAN_dest_location'] = df_map['TECAN_dest_location'].astype(int)
     df_map['TECAN_pcr_rxn_rep'] = df_map['TECAN_pcr_rxn_rep'].astype(int)
-    df_map.to_csv(df_file, sep='\t', index=False, na_rep='NA')
+    with Utils.LineEndWriter(df_file, win_only=args.win_only) as dfFH:
+        df_map.to_csv(dfFH, sep='\t', index=False, na_rep='NA')
 
-    # Create windows-line breaks formatted versions
-    gwl_file_win = Utils.to_win(gwl_file)
-    report_file_win = Utils.to_win(report_file)
-    df_file_win = Utils.to_win(df_file)
-
-    # Return
-    return (gwl_file, gwl_file_win,
-            report_file, report_file_win, 
-            df_file, df_file_win)
+    # Return (unix & windows-line breaks formatted versions)
+    return gwlFH.files + repFH.files + dfFH.files
 
 # main
 if __name__ == '__main__':
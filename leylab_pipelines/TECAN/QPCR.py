@@ -55,6 +55,8 @@ def parse_args(test_args=None, subparsers=None):
                          help='An Excel or CSV file with experimental setup')
     groupIO.add_argument('--prefix', type=str, default='TECAN_qPCR',
                          help='Output file name prefix (default: %(default)s)')
+    groupIO.add_argument('--win-only', action='store_true', default=False,
+                         help='Only write the robot-ready output files with Windows line breaks ("_win"), (default: %(default)s)')
     groupIO.add_argument('--format', type=str, default=None,
                         help='File format (Excel or CSV). If not provided, the format is determined from the file extension (default: %(default)s)') 
 
@@ -234,16 +236,15 @@ def pip_mastermix(df_setup, outFH, src_labware, src_start=1, liq_cls='Water Free
             n_disp= int(np.floor(160.0 / max_vol))   # using 200 ul tips
 
         # making multi-disp object
-        MD = Fluent.multi_disp()
-        MD.SrcRackLabel = src_labware
-        MD.SrcPosition = src_start + i
-        MD.DestRackLabel = df.dest_labware
-        MD.DestPositions = df.dest_location
-        MD.Volume = df['mm volume']
-        MD.NoOfMultiDisp = n_disp
-        MD.LiquidClass = liq_cls
+        MD = Fluent.multi_disp(SrcRackLabel=src_labware,
+                               SrcPosition=src_start + i,
+                               DestRackLabel=df.dest_labware,
+                               DestPositions=df.dest_location,
+                               Volume=df['mm volume'],
+                               NoOfMultiDisp=n_disp,
+                               LiquidClass=liq_cls)
         # writing
-        outFH.write(MD.cmd() + '\n')
+        Fluent.write_gwl(outFH, [MD])
 
 
 def pip_samples(df_setup, outFH, liq_cls='Water Contact Wet Single'):
@@ -257,25 +258,10 @@ def pip_samples(df_setup, outFH, liq_cls='Water Contact Wet Single'):
     df.index = range(df.shape[0])
     
     # for each Sample, write out asp/dispense commands
-    for i in range(df.shape[0]):
-        # aspiration
-        asp = Fluent.aspirate()
-        asp.RackLabel = df.ix[i,'sample labware']
-        asp.Position = df.ix[i,'sample location']
-        asp.Volume = round(df.ix[i,'sample volume'], 2)
-        asp.LiquidClass = liq_cls
-        outFH.write(asp.cmd() + '\n')
-
-        # dispensing
-        disp = Fluent.dispense()
-        disp.RackLabel = df.ix[i,'dest_labware']
-        disp.Position = df.ix[i,'dest_location']
-        disp.Volume = round(df.ix[i,'sample volume'], 2)
-        disp.LiquidClass = liq_cls
-        outFH.write(disp.cmd() + '\n')
-
-        # tip to waste
-        outFH.write('W;\n')
+    cmds = Fluent.transfers(df['sample labware'], df['sample location'],
+                            df['dest_labware'], df['dest_location'],
+                            df['sample volume'].round(2), LiquidClass=liq_cls)
+    Fluent.write_gwl(outFH, cmds)
 
 def pip_water(df_setup, outFH, src_labware, src_start=1, 
               liq_cls='Water Contact Wet Single'):
@@ -288,25 +274,11 @@ def pip_water(df_setup, outFH, src_labware, src_start=1,
     df = df_setup.loc[x]
     df.index = range(df.shape[0])
             
-    for i in range(df.shape[0]):
-        # aspiration
-        asp = Fluent.aspirate()
-        asp.RackLabel = src_labware
-        asp.Position = src_start
-        asp.Volume = round(df.ix[i,'water volume'], 2)
-        asp.LiquidClass = liq_cls
-        outFH.write(asp.cmd() + '\n')
-
-        # dispensing
-        disp = Fluent.dispense()
-        disp.RackLabel = df.ix[i,'dest_labware']
-        disp.Position = df.ix[i,'dest_location']
-        disp.Volume = round(df.ix[i,'water volume'], 2)
-        disp.LiquidClass = liq_cls
-        outFH.write(disp.cmd() + '\n')
-
-        # tip to waste
-        outFH.write('W;\n')
+    # for each well, write out asp/dispense commands
+    cmds = Fluent.transfers(src_labware, src_start,
+                            df['dest_labware'], df['dest_location'],
+                            df['water volume'].round(2), LiquidClass=liq_cls)
+    Fluent.write_gwl(outFH, cmds)
 
 def add_error(x, error_perc):
     if x is None:
@@ -374,7 +346,7 @@ def main(args=None):
     
     # Writing out gwl file
     gwl_file = args.prefix + '.gwl'
-    with open(gwl_file, 'w') as gwlFH:
+    with Utils.LineEndWriter(gwl_file, win_only=args.win_only) as gwlFH:
         ## Master mix(es)
         pip_mastermix(df_setup, outFH=gwlFH, 
                       src_labware=args.mm,
@@ -388,16 +360,11 @@ def main(args=None):
 
     # Creating report file
     report_file = args.prefix + '_report.txt'
-    with open(report_file, 'w') as repFH:
+    with Utils.LineEndWriter(report_file, win_only=args.win_only) as repFH:
         write_report(df_setup, outFH=repFH)
-        
-
-    # Create windows-line breaks formatted versions
-    gwl_file_win = Utils.to_win(gwl_file)
-    report_file_win = Utils.to_win(report_file)
 
-    # end
-    return(gwl_file, gwl_file_win, report_file, report_file_win)
+    # end (unix & windows-line breaks formatted versions)
+    return gwlFH.files + repFH.files
 
 
 # main
@@ -65,8 +65,7 @@ def to_win(file_name, suffix='_win'):
     suffix : added to file name of copy
     Returns : name of new file
     """
-    x = os.path.splitext(file_name)
-    out_file = x[0] + suffix + x[1]
+    out_file = win_file_name(file_name, suffix)
     with open(file_name) as inFH, open(out_file, 'w') as outFH:
         for line in inFH:
             line = line.replace('\n', '\r\n')
@@ -74,6 +73,65 @@ def to_win(file_name, suffix='_win'):
     return out_file
 
 
+def win_file_name(file_name, suffix='_win'):
+    """Name of the windows line break version of a file (see to_win)
+    """
+    x = os.path.splitext(file_name)
+    return x[0] + suffix + x[1]
+
+
+class LineEndWriter(object):
+    """Writing a file with unix line breaks and a copy with windows line
+    breaks (needed for the robot) in 1 pass; line breaks are translated
+    on write, so no re-reading of the file (as with to_win).
+    file_name : str, name of the (unix line break) file
+    win_only : only write the windows line break version
+    suffix : added to file name of the windows line break version
+    Usage: 
+      with LineEndWriter('x.gwl') as outFH:
+          outFH.write('W;\n')
+      outFH.files  # ('x.gwl', 'x_win.gwl')
+    """
+    def __init__(self, file_name, win_only=False, suffix='_win'):
+        self.file_name = None if win_only else file_name
+        self.win_file_name = win_file_name(file_name, suffix)
+        self._FHs = [open(self.win_file_name, 'w', newline='\r\n')]
+        if self.file_name is not None:
+            self._FHs.append(open(self.file_name, 'w', newline='\n'))
+
+    @property
+    def files(self):
+        """(unix_file, win_file); unix_file = None if win_only
+        """
+        return (self.file_name, self.win_file_name)
+
+    def write(self, x):
+        for FH in self._FHs:
+            FH.write(x)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        for FH in self._FHs:
+            FH.flush()
+
+    def close(self):
+        for FH in self._FHs:
+            FH.close()
+
+    @property
+    def closed(self):
+        return all(FH.closed for FH in self._FHs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
 def backup_file(f):
     """
     Back up a file, old_file will be renamed to #old_file.n#, where n is a
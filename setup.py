@@ -13,7 +13,7 @@ requirements = [
     'dask',
     'toolz',
     'cloudpickle',
-    'xmltodict'
+    'requests'
 ]
 
 test_requirements = [
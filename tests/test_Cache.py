@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# import
+## batteries
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+## package
+from leylab_pipelines.DB import Cache
+from leylab_pipelines.DB import Convert
+from leylab_pipelines.DB import TaxID2Lin
+
+
+# global variables
+EMAIL = 'dummy@dummy.info'
+
+
+class NoNetwork(object):
+    """Stand-in HTTP client that fails on any request
+    """
+    def get(self, *args, **kwargs):
+        raise AssertionError('Network used')
+
+
+# tests
+class Test_Cache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'cache.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_set(self):
+        cache = Cache.Cache(self.path)
+        self.assertIsNone(cache.get('efetch/nuccore', 'AC131209'))
+        cache.set('efetch/nuccore', 'AC131209', '9606')
+        self.assertEqual(cache.get('efetch/nuccore', ' AC131209\n'), '9606')
+        self.assertIsNone(cache.get('esearch/gene', 'AC131209'))
+        cache.close()
+        # persistent
+        cache = Cache.Cache(self.path)
+        self.assertEqual(cache.get('efetch/nuccore', 'AC131209'), '9606')
+        self.assertEqual(cache.hits, 1)
+        cache.close()
+
+    def test_ttl(self):
+        cache = Cache.Cache(self.path, ttl=0.1)
+        cache.set('efetch/taxonomy', '9606', ['Eukaryota', 'Metazoa'])
+        self.assertListEqual(cache.get('efetch/taxonomy', '9606'),
+                             ['Eukaryota', 'Metazoa'])
+        time.sleep(0.2)
+        self.assertIsNone(cache.get('efetch/taxonomy', '9606'))
+        cache.close()
+
+    def test_lru(self):
+        cache = Cache.Cache(self.path, max_size=100)
+        for i in range(10):
+            cache.set('test', str(i), 'x' * 18)
+        cache.get('test', '0')
+        cache.evict()
+        self.assertIsNotNone(cache.get('test', '0'))
+        self.assertIsNone(cache.get('test', '1'))
+        self.assertIsNotNone(cache.get('test', '9'))
+        cache.close()
+
+    def test_threads(self):
+        cache = Cache.Cache(self.path)
+        def func(i):
+            for j in range(50):
+                cache.set('test', '{}_{}'.format(i, j), j)
+        threads = [threading.Thread(target=func, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(cache.get('test', '3_49'), 49)
+        cache.close()
+
+    def test_cache_hit_skips_network(self):
+        cache = Cache.Cache(self.path)
+        cache.set('efetch/nuccore', 'AC131209', '9606')
+        cache.set('efetch/taxonomy', '9606', ['Eukaryota', 'Metazoa'])
+        # conversion
+        conv = Convert.Conversion(EMAIL, client=NoNetwork(), cache=cache)
+        ret = conv.convert_accession_to_taxid('AC131209')
+        self.assertListEqual(ret, ['AC131209', '9606'])
+        # lineage
+        ret = TaxID2Lin.query_ncbi_lineage('9606', levels=3,
+                                           client=NoNetwork(), cache=cache)
+        self.assertListEqual(ret, ['9606', 'Eukaryota', 'Metazoa', 'unclassified'])
+        cache.close()
@@ -4,8 +4,17 @@
 # import
 ## batteries
 import os
+import io
 import sys
+import threading
+import tracemalloc
 import unittest
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from urlparse import urlparse, parse_qs
 ## package
 from leylab_pipelines.DB import Convert
 
@@ -26,6 +35,92 @@ EMAIL = 'dummy@dummy.info'
 FAKE_EMAIL = 'pyentrez.info'
 
 
+# stand-in UniProt server
+UNIPROT_ENTRIES = [
+    ('Q9BWD1', ['39']),
+    ('X99999', ['100']),
+    ('P12345', ['100', '200']),
+]
+
+class UniProtHandler(BaseHTTPRequestHandler):
+    """Returns the UniProt XML entries matching a query of
+    'geneid:X OR accession:Y ...'
+    """
+    queries = []
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)['query'][0]
+        self.queries.append(query)
+        terms = [x.split(':') for x in query.split(' OR ')]
+        xml = ['<?xml version="1.0" encoding="UTF-8"?>',
+               '<uniprot xmlns="http://uniprot.org/uniprot">']
+        for acc,geneIDs in UNIPROT_ENTRIES:
+            hit = False
+            for field,value in terms:
+                if field == 'geneid' and value in geneIDs:
+                    hit = True
+                elif field == 'accession' and value.lower() == acc.lower():
+                    hit = True
+            if not hit:
+                continue
+            xml.append('<entry><accession>{}</accession>'.format(acc))
+            for x in geneIDs:
+                xml.append('<dbReference type="GeneID" id="{}"/>'.format(x))
+            xml.append('</entry>')
+        xml.append('</uniprot>')
+        body = '\n'.join(xml).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+# stand-in NCBI efetch server
+def genbank_xml(taxid, n_features=1000, seq_len=100000):
+    """Synthetic GenBank (GBSet) XML record"""
+    qual = ('<GBQualifier><GBQualifier_name>{}</GBQualifier_name>'
+            '<GBQualifier_value>{}</GBQualifier_value></GBQualifier>')
+    xml = ['<?xml version="1.0" encoding="UTF-8"?>',
+           '<GBSet><GBSeq><GBSeq_locus>TEST</GBSeq_locus>',
+           '<GBSeq_feature-table>',
+           '<GBFeature><GBFeature_key>source</GBFeature_key><GBFeature_quals>',
+           qual.format('organism', 'Homo sapiens'),
+           qual.format('db_xref', 'taxon:{}'.format(taxid)),
+           '</GBFeature_quals></GBFeature>']
+    for i in range(n_features):
+        xml += ['<GBFeature><GBFeature_key>CDS</GBFeature_key><GBFeature_quals>',
+                qual.format('db_xref', 'GeneID:{}'.format(i)),
+                '</GBFeature_quals></GBFeature>']
+    xml += ['</GBSeq_feature-table>',
+            '<GBSeq_sequence>{}</GBSeq_sequence>'.format('a' * seq_len),
+            '</GBSeq></GBSet>']
+    return '\n'.join(xml).encode('utf-8')
+
+
+class EfetchHandler(BaseHTTPRequestHandler):
+    """Returns a GenBank record for ACCESSION_ID; HTTP 400 otherwise"""
+    def do_GET(self):
+        ID = parse_qs(urlparse(self.path).query)['id'][0]
+        if ID != ACCESSION_ID:
+            self.send_response(400)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = genbank_xml('9606')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (IOError, OSError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
 # tests
 class Test_Convert(unittest.TestCase):
 
@@ -75,3 +170,109 @@ class Test_Convert(unittest.TestCase):
         ID = self.Id.convert_accession_to_taxid(ACCESSION_ID + '_FAKEID')
         self.assertListEqual(ID, [ACCESSION_ID + '_FAKEID', None])
     
+
+class Test_Convert_dedup(unittest.TestCase):
+
+    def setUp(self):
+        self.IDs = ['A', 'B', 'A', 'C', 'B', 'A']
+
+    def tearDown(self):
+        pass
+
+    def test_dedup_IDs(self):
+        uniq, codes = Convert.dedup_IDs(iter(self.IDs))
+        self.assertListEqual(uniq, ['A', 'B', 'C'])
+        self.assertListEqual(list(codes), [0, 1, 0, 2, 1, 0])
+
+    def test_expand_IDs(self):
+        uniq, codes = Convert.dedup_IDs(self.IDs)
+        conv = [[x, x.lower()] for x in uniq]
+        # ordered
+        ret = list(Convert.expand_IDs(iter(conv), uniq, codes))
+        self.assertListEqual(ret, [[x, x.lower()] for x in self.IDs])
+        # unordered
+        ret = list(Convert.expand_IDs(reversed(conv), uniq, codes,
+                                      ordered=False))
+        self.assertEqual(ret[0], ['C', 'c'])
+        self.assertListEqual(sorted(ret), sorted([[x, x.lower()] for x in self.IDs]))
+
+
+class Test_Convert_batch(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), UniProtHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.Id = Convert.Conversion(EMAIL)
+        self.Id.UNIPROT_URL = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+        UniProtHandler.queries = []
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_convert_entrez_to_uniprot_batch(self):
+        IDs = self.Id.convert_entrez_to_uniprot_batch(['39', '200', '0'])
+        self.assertListEqual(IDs, [['39', 'Q9BWD1'], ['200', 'P12345'], ['0', None]])
+        self.assertEqual(len(UniProtHandler.queries), 1)
+
+    def test_convert_uniprot_to_entrez_batch(self):
+        IDs = self.Id.convert_uniprot_to_entrez_batch(['Q9BWD1', 'P12345', 'FAKE'])
+        self.assertListEqual(IDs, [['Q9BWD1', '39'], ['P12345', '200'], ['FAKE', None]])
+        # 1 bulk query + 1 bulk disambiguation query
+        self.assertEqual(len(UniProtHandler.queries), 2)
+
+
+class RawResponse(object):
+    """Stand-in for a streamed requests.Response"""
+    def __init__(self, body):
+        self.raw = io.BytesIO(body)
+
+
+class Test_Convert_iterparse(unittest.TestCase):
+
+    def test_iterparse_response(self):
+        xml = b'<a><b><c>1</c></b><x/><b><c>2</c></b></a>'
+        ret = [elem.find('c').text for elem in
+               Convert.iterparse_response(RawResponse(xml), ('b',))]
+        self.assertListEqual(ret, ['1', '2'])
+
+    def peak_memory(self, n_features):
+        body = genbank_xml('9606', n_features=n_features, seq_len=10)
+        r = RawResponse(body)
+        tracemalloc.start()
+        n = sum(1 for x in Convert.iterparse_response(r, ('GBQualifier',)))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.assertEqual(n, n_features + 2)
+        return peak
+
+    def test_iterparse_response_memory(self):
+        # processed elements are dropped: memory does not grow with size
+        small = self.peak_memory(1000)
+        large = self.peak_memory(50000)
+        self.assertLess(large, small * 3)
+
+
+class Test_Convert_efetch(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), EfetchHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.Id = Convert.Conversion(EMAIL)
+        self.Id.NCBI_URL = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_convert_accesion_to_taxid(self):
+        # real ID
+        ID = self.Id.convert_accession_to_taxid(ACCESSION_ID)
+        self.assertListEqual(ID, [ACCESSION_ID, '9606'])
+        # fake ID
+        ID = self.Id.convert_accession_to_taxid(ACCESSION_ID + '_FAKEID')
+        self.assertListEqual(ID, [ACCESSION_ID + '_FAKEID', None])
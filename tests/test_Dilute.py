@@ -152,3 +152,23 @@ class Test_Dilute_main2(unittest.TestCase):
     def test_main_gwl(self):
         ret = Utils.check_gwl(self.files[0])
         self.assertIsNone(ret)
+
+
+class Test_Dilute_main_win_only(unittest.TestCase):
+
+    def setUp(self):
+        concfile = os.path.join(data_dir, 'conc_file1.txt')
+        self.args = Dilute.parse_args(['--prefix', '/tmp/DIL3', '--win-only',
+                                       concfile])
+        self.files = Dilute.main(self.args)
+
+    def tearDown(self):
+        pass
+
+    def test_main_gwl(self):
+        self.assertIsNone(self.files[0])
+        self.assertIsNone(self.files[2])
+        ret = Utils.check_gwl(self.files[1])
+        self.assertIsNone(ret)
+        with open(self.files[1], 'rb') as inF:
+            self.assertTrue(inF.readline().endswith(b'\r\n'))
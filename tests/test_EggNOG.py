@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# import
+## batteries
+import os
+import gzip
+import shutil
+import tempfile
+import threading
+import unittest
+from email.utils import formatdate, parsedate_tz, mktime_tz
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+## package
+from leylab_pipelines.DB import EggNOG
+
+
+# global variables
+MTIME = 1500000000
+
+
+# stand-in EggNOG server
+class EggNOGHandler(BaseHTTPRequestHandler):
+    """Returns a fasta file named after the NOG, with If-Modified-Since support
+    """
+    requests = []
+    def do_GET(self):
+        self.requests.append(self.path)
+        since = self.headers.get('If-Modified-Since')
+        if since is not None and mktime_tz(parsedate_tz(since)) >= MTIME:
+            self.send_response(304)
+            self.end_headers()
+            return
+        nog_name = self.path.rstrip('/').split('/')[-1]
+        body = ('>' + nog_name + '\n' + 'ACGT' * 1000 + '\n').encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Last-Modified', formatdate(MTIME, usegmt=True))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+# tests
+class Test_EggNOG(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = HTTPServer(('127.0.0.1', 0), EggNOGHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = EggNOG.EGGNOG_URL
+        EggNOG.EGGNOG_URL = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+        EggNOGHandler.requests = []
+
+    def tearDown(self):
+        EggNOG.EGGNOG_URL = self.url
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_write_content(self):
+        outfile = EggNOG.write_content('COG0575', 'fasta', self.tmpdir)
+        self.assertEqual(os.path.basename(outfile), 'COG0575_fasta.fa')
+        with open(outfile) as inF:
+            self.assertEqual(inF.readline(), '>COG0575\n')
+        self.assertEqual(os.path.getmtime(outfile), MTIME)
+        # no temporary files left
+        self.assertListEqual(os.listdir(self.tmpdir), ['COG0575_fasta.fa'])
+
+    def test_sync(self):
+        EggNOG.write_content('COG0575', 'fasta', self.tmpdir)
+        # skip
+        ret = EggNOG.write_content('COG0575', 'fasta', self.tmpdir, sync='skip')
+        self.assertIsNone(ret)
+        self.assertEqual(len(EggNOGHandler.requests), 1)
+        # conditional: not modified
+        ret = EggNOG.write_content('COG0575', 'fasta', self.tmpdir,
+                                   sync='conditional')
+        self.assertIsNone(ret)
+        self.assertEqual(len(EggNOGHandler.requests), 2)
+        # conditional: older local file
+        outfile = os.path.join(self.tmpdir, 'COG0575_fasta.fa')
+        os.utime(outfile, (MTIME - 100, MTIME - 100))
+        ret = EggNOG.write_content('COG0575', 'fasta', self.tmpdir,
+                                   sync='conditional')
+        self.assertEqual(ret, outfile)
+        self.assertEqual(os.path.getmtime(outfile), MTIME)
+
+    def test_atomic_write(self):
+        outfile = os.path.join(self.tmpdir, 'out.txt')
+        def chunks():
+            yield b'partial'
+            raise IOError('connection lost')
+        with self.assertRaises(IOError):
+            EggNOG.atomic_write(outfile, chunks())
+        self.assertListEqual(os.listdir(self.tmpdir), [])
+
+    def test_archive(self):
+        archive_file = os.path.join(self.tmpdir, 'nogs.gz')
+        nog_names = ['COG{:04d}'.format(x) for x in range(20)]
+        args = EggNOG.parse_args(nog_names + ['-A', archive_file, '-p', '4',
+                                              '--no-cache', '-o', self.tmpdir])
+        EggNOG.main(args)
+        self.assertListEqual(sorted(os.listdir(self.tmpdir)),
+                             ['nogs.gz', 'nogs.gz.idx'])
+        # random access
+        archive = EggNOG.Archive(archive_file)
+        self.assertEqual(len(archive.names()), 20)
+        content = archive.read('COG0007_fasta.fa').decode('utf-8')
+        self.assertTrue(content.startswith('>COG0007\n'))
+        self.assertEqual(archive.mtime('COG0007_fasta.fa'), MTIME)
+        # all members
+        with gzip.open(archive_file, 'rt') as inF:
+            headers = [x for x in inF if x.startswith('>')]
+        self.assertEqual(len(headers), 20)
+        # sync: only new NOGs are downloaded
+        EggNOGHandler.requests = []
+        args = EggNOG.parse_args(['COG0001', 'COG0100', '-A', archive_file,
+                                  '-s', 'skip', '--no-cache'])
+        EggNOG.main(args)
+        self.assertEqual(len(EggNOGHandler.requests), 1)
+        archive = EggNOG.Archive(archive_file)
+        self.assertEqual(len(archive.names()), 21)
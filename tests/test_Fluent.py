@@ -4,6 +4,7 @@
 # import
 ## batteries
 import os
+import io
 import sys
 import unittest
 ## 3rd party
@@ -39,3 +40,97 @@ class Test_Fluent(unittest.TestCase):
     def test_init_rd(self):
         cmd = self.disp.cmd()
         self.assertTrue(isinstance(cmd, str))
+
+    def test_record(self):
+        asp = Fluent.aspirate(RackLabel='plate', Position='3', Volume=2.5)
+        self.assertEqual(asp.cmd(), 'A;plate;;;3;;2.5;Water Free Single;;')
+        self.assertFalse(hasattr(asp, '__dict__'))
+        # immutable
+        with self.assertRaises(AttributeError):
+            asp.Volume = 1
+        disp = asp._replace(Volume=1.0)
+        self.assertEqual(asp.Volume, 2.5)
+        self.assertEqual(disp.Volume, 1.0)
+        self.assertEqual(asp, asp._replace())
+        self.assertEqual(len(set([asp, asp._replace(), disp])), 2)
+        # validation
+        with self.assertRaises(TypeError):
+            Fluent.dispense(LiquidClass='foo')
+        with self.assertRaises(TypeError):
+            Fluent.dispense(Foo=1)
+
+    def test_multi_disp(self):
+        MD = Fluent.multi_disp(SrcRackLabel='micro15[001]',
+                               DestRackLabel=pd.Series(['96 Well[008]'] * 5),
+                               DestPositions=pd.Series([1.0, 2, 3, 4, 5]),
+                               Volume=13.1, NoOfMultiDisp=2)
+        self.assertEqual(MD.SampleCount, 5)
+        lines = MD.cmd().split('\n')
+        self.assertEqual(len(lines), 5 + 3 * 2)
+        self.assertEqual(lines[0], 'A;micro15[001];;;1;;26.2;Water Free Multi;;')
+        self.assertEqual(lines[-2], 'D;96 Well[008];;;5;;13.1;Water Free Multi;;')
+
+    def test_gwl_lines(self):
+        cmds = Fluent.transfers('micro15[002]', 2, '96 Well[008]', range(1, 1001),
+                                (x / 10.0 for x in range(1000)))
+        lines = Fluent.gwl_lines(['C;Samples', cmds])
+        self.assertEqual(next(lines), 'C;Samples')
+        lines = list(lines)
+        self.assertEqual(len(lines), 3000)
+        self.assertEqual(lines[4], 'D;96 Well[008];;;2;;0.1;Water Free Single;;')
+        self.assertEqual(lines[5], 'W;')
+
+
+class Test_Fluent_block(unittest.TestCase):
+
+    def setUp(self):
+        n = 2000
+        self.df = pd.DataFrame({'src_labware' : ['plate{}'.format(i % 3) for i in range(n)],
+                                'src_location' : [i % 96 + 1 for i in range(n)],
+                                'dest_labware' : '96 Well[008]',
+                                'dest_location' : [float(i % 384 + 1) for i in range(n)],
+                                'volume' : [round(1.1 + i % 7 * 0.3, 2) for i in range(n)]})
+
+    def tearDown(self):
+        pass
+
+    def per_row(self, liq_cls='Water Free Single'):
+        lines = []
+        for i in range(self.df.shape[0]):
+            asp = Fluent.aspirate(RackLabel=self.df.loc[i,'src_labware'],
+                                  Position=self.df.loc[i,'src_location'],
+                                  Volume=self.df.loc[i,'volume'],
+                                  LiquidClass=liq_cls)
+            disp = Fluent.dispense(RackLabel=self.df.loc[i,'dest_labware'],
+                                   Position=self.df.loc[i,'dest_location'],
+                                   Volume=self.df.loc[i,'volume'],
+                                   LiquidClass=liq_cls)
+            lines += [asp.cmd(), disp.cmd(), 'W;']
+        return '\n'.join(lines) + '\n'
+
+    def block(self, *args, **kwargs):
+        outFH = io.StringIO()
+        Fluent.write_gwl(outFH, Fluent.transfers(*args, **kwargs))
+        return outFH.getvalue()
+
+    def test_transfers(self):
+        liq_cls = 'Water Contact Wet Single'
+        cmds = self.block(self.df['src_labware'], self.df['src_location'],
+                          self.df['dest_labware'], self.df['dest_location'],
+                          self.df['volume'], LiquidClass=liq_cls, chunksize=300)
+        self.assertEqual(cmds, self.per_row(liq_cls))
+
+    def test_transfers_scalar(self):
+        cmds = self.block('micro15[002]', 2, self.df['dest_labware'],
+                          self.df['dest_location'], 2.0)
+        lines = cmds.splitlines()
+        self.assertEqual(len(lines), self.df.shape[0] * 3)
+        self.assertEqual(lines[0], 'A;micro15[002];;;2;;2.0;Water Free Single;;')
+        self.assertEqual(lines[1], 'D;96 Well[008];;;1;;2.0;Water Free Single;;')
+        self.assertEqual(self.block('a', 1, [], [], 1.0), '')
+
+    def test_transfers_errors(self):
+        with self.assertRaises(TypeError):
+            self.block('a', 1, 'b', [1, 2], 1.0, LiquidClass='foo')
+        with self.assertRaises(ValueError):
+            self.block('a', [1, 2, 3], 'b', [1, 2], 1.0)
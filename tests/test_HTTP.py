@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# import
+## batteries
+import time
+import asyncio
+import threading
+import unittest
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+## package
+from leylab_pipelines.DB import HTTP
+
+
+# stand-in server
+class Handler(BaseHTTPRequestHandler):
+    """Returns HTTP 429 for the first `fails` requests of each path,
+    then the path as the response body
+    """
+    fails = {}
+    def do_GET(self):
+        n = self.fails.get(self.path, 0)
+        if n > 0:
+            self.fails[self.path] = n - 1
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = self.path.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+# tests
+class Test_TokenBucket(unittest.TestCase):
+
+    def test_rate(self):
+        bucket = HTTP.TokenBucket(20)
+        start = time.time()
+        for i in range(11):
+            bucket.acquire()
+        self.assertGreaterEqual(time.time() - start, 0.45)
+
+    def test_ncbi_rate(self):
+        self.assertEqual(HTTP.ncbi_rate(), 3)
+        self.assertEqual(HTTP.ncbi_rate('KEY'), 10)
+
+
+class Test_Client(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_retry(self):
+        Handler.fails['/retry'] = 2
+        with HTTP.Client(tries=3, backoff=0.01) as client:
+            r = client.get(self.url + '/retry')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.text, '/retry')
+
+    def test_retry_giveup(self):
+        Handler.fails['/giveup'] = 5
+        with HTTP.Client(tries=2, backoff=0.01) as client:
+            r = client.get(self.url + '/giveup')
+        self.assertEqual(r.status_code, 429)
+
+    def test_map(self):
+        host = self.url.split('//')[1]
+        with HTTP.Client(workers=4, rates={host : 100}) as client:
+            func = lambda x: client.get(self.url + '/' + x).text
+            ret = client.map(func, [str(x) for x in range(20)])
+        self.assertListEqual(ret, ['/' + str(x) for x in range(20)])
+
+    def test_imap_unordered(self):
+        def func(x):
+            time.sleep(0.01 * (5 - x))
+            return x
+        with HTTP.Client(workers=5) as client:
+            ret = list(client.imap(func, range(5), ordered=False))
+            self.assertListEqual(sorted(ret), list(range(5)))
+            self.assertNotEqual(ret, list(range(5)))
+            ret = list(client.imap(func, range(5), ordered=True))
+            self.assertListEqual(ret, list(range(5)))
+
+    def test_imap_lazy(self):
+        consumed = []
+        def items():
+            for x in range(100):
+                consumed.append(x)
+                yield x
+        with HTTP.Client(workers=2) as client:
+            ret = client.imap(lambda x: x, items(), window=4)
+            self.assertEqual(next(ret), 0)
+            self.assertLessEqual(len(consumed), 6)
+            self.assertEqual(sum(ret), sum(range(1, 100)))
+
+    def test_imap_threads(self):
+        def func(x):
+            time.sleep(0.01 * (5 - x))
+            return x
+        with HTTP.Client(workers=5, executor='threads') as client:
+            ret = list(client.imap(func, range(5), ordered=False))
+            self.assertListEqual(sorted(ret), list(range(5)))
+            self.assertNotEqual(ret, list(range(5)))
+            self.assertListEqual(client.map(func, range(5)), list(range(5)))
+
+    def test_imap_running_loop(self):
+        # eg., called from a Jupyter notebook
+        async def run():
+            with HTTP.Client(workers=2) as client:
+                return client.map(lambda x: x * 2, range(10))
+        loop = asyncio.new_event_loop()
+        try:
+            ret = loop.run_until_complete(run())
+        finally:
+            loop.close()
+        self.assertListEqual(ret, [x * 2 for x in range(10)])
+
+    def test_executor(self):
+        with self.assertRaises(ValueError):
+            HTTP.Client(executor='processes')
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# import
+## batteries
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+try:
+    from http.server import HTTPServer
+except ImportError:
+    from BaseHTTPServer import HTTPServer
+## package
+from leylab_pipelines.DB import IDMap
+from leylab_pipelines.DB import Convert
+from tests.test_Convert import UniProtHandler
+
+
+# data dir
+test_dir = os.path.join(os.path.dirname(__file__))
+data_dir = os.path.join(test_dir, 'data')
+
+# global variables
+EMAIL = 'dummy@dummy.info'
+IDMAPPING = ['Q9BWD1\tGeneID\t39',
+             'Q9BWD1\tUniProtKB-ID\tTHIL_HUMAN',
+             'P99999\tGeneID\t54205']
+HGNC = ['HGNC ID\tApproved symbol\tNCBI Gene ID',
+        'HGNC:9245\tPPIB\t5479',
+        'HGNC:5\tA1BG\t']
+
+
+def write_lines(path, lines):
+    with open(path, 'w') as outF:
+        outF.write('\n'.join(lines) + '\n')
+
+
+# tests
+class Test_IDMap(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'idmap.sqlite')
+        self.idmap = IDMap.IDMap(self.path)
+
+    def tearDown(self):
+        self.idmap.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_acc2taxid(self):
+        infile = os.path.join(data_dir, 'nucl_wg.acc2taxid')
+        n = self.idmap.ingest(IDMap.read_mapfile(infile, 'acc2taxid'))
+        self.assertGreater(n, 0)
+        found = self.idmap.lookup('accession', 'taxid',
+                                  ['T02634', 'T02635.1', 'FAKE'])
+        self.assertDictEqual(found, {'T02634' : '5833', 'T02635.1' : '5833'})
+        # re-ingesting adds nothing
+        n = self.idmap.ingest(IDMap.read_mapfile(infile, 'acc2taxid'))
+        self.assertEqual(n, 0)
+
+    def test_uniprot(self):
+        infile = os.path.join(self.tmpdir, 'idmapping.dat')
+        write_lines(infile, IDMAPPING)
+        self.idmap.ingest(IDMap.read_mapfile(infile, 'uniprot'))
+        ret = list(self.idmap.convert('uniprot', 'entrez', ['Q9BWD1', 'FAKE']))
+        self.assertListEqual(ret, [['Q9BWD1', '39'], ['FAKE', None]])
+        ret = list(self.idmap.convert('entrez', 'uniprot', ['54205']))
+        self.assertListEqual(ret, [['54205', 'P99999']])
+
+    def test_hgnc(self):
+        infile = os.path.join(self.tmpdir, 'hgnc.txt')
+        write_lines(infile, HGNC)
+        self.idmap.ingest(IDMap.read_mapfile(infile, 'hgnc'))
+        found = self.idmap.lookup('hgnc', 'entrez', ['9245', 'HGNC:9245', '5'])
+        self.assertDictEqual(found, {'9245' : '5479', 'HGNC:9245' : '5479'})
+
+    def test_offline_conversion(self):
+        infile = os.path.join(data_dir, 'nucl_wg.acc2taxid')
+        self.idmap.ingest(IDMap.read_mapfile(infile, 'acc2taxid'))
+        IDs = Convert.get_conversion(['T02634', 'FAKE'], EMAIL,
+                                     'Accession2Taxonomy',
+                                     idmap=self.idmap, offline=True)
+        self.assertListEqual(list(IDs), [['T02634', '5833'], ['FAKE', None]])
+
+
+class Test_IDMap_remote(unittest.TestCase):
+    """Local conversions, with the misses queried remotely
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.idmap = IDMap.IDMap(os.path.join(self.tmpdir, 'idmap.sqlite'))
+        self.idmap.ingest([('entrez', 'uniprot', '54205', 'P99999')])
+        self.server = HTTPServer(('127.0.0.1', 0), UniProtHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.uniprot_url = Convert.Conversion.UNIPROT_URL
+        Convert.Conversion.UNIPROT_URL = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+        UniProtHandler.queries = []
+
+    def tearDown(self):
+        Convert.Conversion.UNIPROT_URL = self.uniprot_url
+        self.server.shutdown()
+        self.server.server_close()
+        self.idmap.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_local_and_remote(self):
+        IDs = ['54205', '39', '54205x', '200']
+        for ordered in (True, False):
+            UniProtHandler.queries = []
+            ret = Convert.get_conversion(IDs, EMAIL, 'EntrezGene2Uniprot',
+                                         procs=2, idmap=self.idmap,
+                                         ordered=ordered, batch_size=2)
+            ret = list(ret)
+            if ordered:
+                self.assertListEqual([x[0] for x in ret], IDs)
+            self.assertListEqual(sorted(ret),
+                                 sorted([['54205', 'P99999'], ['39', 'Q9BWD1'],
+                                         ['54205x', None], ['200', 'P12345']]))
+            # only the misses are queried
+            self.assertEqual(len(UniProtHandler.queries), 2)
+            for query in UniProtHandler.queries:
+                self.assertNotIn('geneid:54205 ', query + ' ')
@@ -0,0 +1,536 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# import
+## batteries
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+## 3rd party
+import pandas as pd
+import dask
+import dask.dataframe as dd
+## package
+from leylab_pipelines import Join
+
+
+# global variables
+LEFT = pd.DataFrame({'id' : [str(x) for x in range(100)],
+                     'a' : ['a{}'.format(x) for x in range(100)]})
+RIGHT = pd.DataFrame({'acc' : [str(x) for x in range(50, 150)],
+                      'b' : ['b{}'.format(x) for x in range(50, 150)]})
+
+
+def read_output(outfile):
+    if outfile.endswith('.gz'):
+        inF = gzip.open(outfile, 'rt')
+    else:
+        inF = open(outfile)
+    with inF:
+        return pd.read_csv(inF, sep='\t', dtype=str)
+
+
+# tests
+class JoinTestCase(unittest.TestCase):
+    """Temp dir with the LEFT & RIGHT tables (left.txt & right.txt)
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.left = self.table('left.txt', LEFT)
+        self.right = self.table('right.txt', RIGHT)
+        self.outfile = os.path.join(self.tmpdir, 'out.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def table(self, name, df):
+        """Writing a table (format by extension) to the temp dir"""
+        path = os.path.join(self.tmpdir, name)
+        if name.endswith('.parquet'):
+            df.to_parquet(path, index=False, row_group_size=10)
+        elif name.endswith('.feather'):
+            df.reset_index(drop=True).to_feather(path)
+        else:
+            df.to_csv(path, sep='\t', index=False)
+        return path
+
+    def run_join(self, tables, *args):
+        """Running LLP join on tables; returns the output file"""
+        args = list(args)
+        if '-o' in args:
+            outfile = args[args.index('-o') + 1]
+        else:
+            outfile = self.outfile
+            args += ['-o', outfile]
+        Join.main(Join.parse_args(list(tables) + args))
+        return outfile
+
+    def join(self, *args):
+        """Joining left.txt & right.txt on id=acc; returns the output"""
+        outfile = self.run_join([self.left, self.right], '-j', 'id=acc', '-c', *args)
+        return read_output(outfile)
+
+
+class Test_Join(JoinTestCase):
+
+    def test_inner(self):
+        df = self.join()
+        self.assertListEqual(list(df.columns), ['id', 'a', 'acc', 'b'])
+        self.assertListEqual(sorted(df['id'].astype(int)), list(range(50, 100)))
+        self.assertTrue((df['b'] == 'b' + df['id']).all())
+
+    def test_outer(self):
+        df = self.join('-H', 'outer')
+        self.assertEqual(df.shape[0], 150)
+
+    def test_gzip(self):
+        outfile = os.path.join(self.tmpdir, 'out.txt.gz')
+        df = self.join('-o', outfile)
+        self.assertEqual(df.shape[0], 50)
+
+    def test_engines(self):
+        # left table is the smaller table
+        for how in ('inner', 'right'):
+            df1 = self.join('-H', how, '-e', 'dask')
+            df2 = self.join('-H', how, '-e', 'broadcast')
+            df1 = df1.sort_values('acc').reset_index(drop=True)
+            df2 = df2.sort_values('acc').reset_index(drop=True)
+            pd.testing.assert_frame_equal(df1, df2)
+
+    def test_engines_missing_keys(self):
+        left = pd.concat([LEFT] * 3, ignore_index=True)
+        left.loc[::7, 'id'] = None
+        right = RIGHT.copy()
+        right.loc[::9, 'acc'] = None
+        # sorted, missing keys first (for --presorted)
+        left = left.sort_values('id', na_position='first')
+        right = right.sort_values('acc', na_position='first')
+        self.table('left.txt', left)
+        self.table('right.txt', right)
+        exp = pd.merge(left, right, how='left', left_on='id', right_on='acc')
+        dfs = []
+        for args in (('-e', 'dask'), ('-e', 'broadcast'), ('-e', 'sort'),
+                     ('--presorted', '--npartitions', '3')):
+            df = self.join('-H', 'left', *args)
+            with open(self.outfile) as inF:
+                self.assertNotIn('nan', inF.read())
+            self.assertEqual(df.shape, exp.shape)
+            dfs.append(df.sort_values(['a', 'b']).reset_index(drop=True))
+        for df in dfs[1:]:
+            pd.testing.assert_frame_equal(dfs[0], df)
+        # missing keys are not in the key set
+        self.assertEqual(len(Join.key_set(self.right, ['acc'], dtype={'acc' : 'str'})),
+                         len(right['acc'].dropna()))
+
+    def test_sort_engine(self):
+        outfile = os.path.join(self.tmpdir, 'out.txt.gz')
+        df = self.join('-H', 'outer', '-e', 'sort', '-M', '1M', '-o', outfile)
+        self.assertEqual(df.shape[0], 150)
+        self.assertListEqual(list(df.columns), ['id', 'a', 'acc', 'b'])
+
+    def test_key_encoding(self):
+        exp = self.join('-e', 'dask', '--key-encoding', 'none')
+        for enc in ('auto', 'dict'):
+            df = self.join('-e', 'dask', '--key-encoding', enc, '-L', 'object',
+                           '-R', 'object')
+            pd.testing.assert_frame_equal(df, exp)
+
+    def test_scheduler(self):
+        for scheduler in ('threads', 'processes'):
+            for engine in ('dask', 'broadcast'):
+                df = self.join('-e', engine, '--scheduler', scheduler,
+                               '-p', '2', '--blocksize', '500')
+                self.assertEqual(df.shape[0], 50)
+
+    def test_select_engine(self):
+        tables = [self.left, self.right]
+        self.assertEqual(Join.select_engine(tables)[0], 'broadcast')
+        self.assertEqual(Join.select_engine(tables, broadcast_max=0)[0], 'dask')
+        self.assertEqual(Join.select_engine(tables, how='outer')[0], 'dask')
+        self.assertEqual(Join.select_engine(tables, how='outer', memory=10)[0], 'sort')
+        with self.assertRaises(ValueError):
+            Join.select_engine(tables, how='outer', engine='broadcast')
+
+    def test_formats(self):
+        left = self.table('left.parquet', LEFT)
+        right = self.table('right.feather', RIGHT.assign(score=range(100), extra='x'))
+        # columns & row filters
+        for engine in ('dask', 'broadcast', 'sort'):
+            self.run_join([left, right], '-j', 'id=acc', '-c', '-e', engine,
+                          '--columnsR', 'score', '--filterR', 'score>=40',
+                          '--filterL', 'a!=a99')
+            df = read_output(self.outfile)
+            self.assertListEqual(list(df.columns), ['id', 'a', 'acc', 'score'])
+            self.assertListEqual(sorted(df['id'].astype(int)), list(range(90, 99)))
+        # arrow output
+        for outfile in ('out.parquet', 'out.feather'):
+            outfile = os.path.join(self.tmpdir, outfile)
+            self.run_join([left, right], '-j', 'id=acc', '-c', '-e', 'dask',
+                          '--blocksize', '500', '-o', outfile)
+            if outfile.endswith('.parquet'):
+                df = pd.read_parquet(outfile)
+            else:
+                df = pd.read_feather(outfile)
+            self.assertEqual(df.shape, (50, 6))
+            self.assertEqual(df['score'].dtype, 'int64')
+
+    def test_multi(self):
+        tax = pd.DataFrame({'taxid' : [str(x) for x in range(10)],
+                            'lineage' : ['L{}'.format(x) for x in range(10)]})
+        right = RIGHT.assign(taxid=[str(x % 12) for x in range(100)])
+        tables = [self.left, self.table('right.txt', right), self.table('tax.txt', tax)]
+        exp = pd.merge(LEFT, right, left_on='id', right_on='acc')
+        exp = pd.merge(exp, tax, on='taxid').sort_values('id')
+        for engine in ('auto', 'dask', 'broadcast'):
+            outfile = self.run_join(tables, '-j', 'id=acc', '-j', 'taxid=taxid',
+                                    '-e', engine, '-c')
+            df = read_output(outfile).sort_values('id').reset_index(drop=True)
+            self.assertListEqual(list(df.columns), list(exp.columns))
+            self.assertListEqual(list(df['lineage']), list(exp['lineage']))
+        # key encoding of the hash joins
+        for enc in ('auto', 'dict', 'none'):
+            outfile = self.run_join(tables, '-j', 'id=acc', '-j', 'taxid=taxid',
+                                    '-e', 'dask', '--key-encoding', enc)
+            df = read_output(outfile).sort_values('id').reset_index(drop=True)
+            self.assertListEqual(list(df['lineage']), list(exp['lineage']))
+        # 1 --join per joined table
+        with self.assertRaises(ValueError):
+            self.run_join(tables, '-j', 'id=acc', '-j', 'a=b', '-j', 'b=c')
+        # no index on the joined tables
+        with self.assertRaises(ValueError):
+            self.run_join(tables, '-j', 'id=acc', '-j', 'taxid=taxid', '-e', 'index')
+        with self.assertRaises(SystemExit):
+            self.run_join(tables, '-j', 'id=acc', '-e', 'sort')
+
+    def test_multi_index(self):
+        tax = pd.DataFrame({'taxid' : [str(x) for x in range(10)],
+                            'lineage' : ['L{}'.format(x) for x in range(10)]})
+        right = RIGHT.assign(taxid=[str(x % 12) for x in range(100)])
+        tables = [self.left, self.table('right.txt', right), self.table('tax.txt', tax)]
+        self.run_join([], '--build-index', tables[2], '--index-key', 'taxid')
+        exp = pd.merge(LEFT, right, left_on='id', right_on='acc')
+        exp = pd.merge(exp, tax, on='taxid').sort_values('id')
+        # the index is used even if the table is > --broadcast-max
+        with self.assertLogs(level='INFO') as logs:
+            outfile = self.run_join(tables, '-j', 'id=acc', '-j', 'taxid=taxid',
+                                    '-b', '0')
+        self.assertIn('using the join index of table 3', '\n'.join(logs.output))
+        self.assertIn('hash joining table 2', '\n'.join(logs.output))
+        df = read_output(outfile).sort_values('id').reset_index(drop=True)
+        self.assertListEqual(list(df['lineage']), list(exp['lineage']))
+
+    def test_index(self):
+        # duplicate & missing keys
+        right = pd.concat([RIGHT, RIGHT.iloc[:3]], ignore_index=True)
+        right.loc[10, 'acc'] = None
+        right = self.table('right.txt', right)
+        self.run_join([], '--build-index', right, '--index-key', 'acc')
+        exp = pd.merge(LEFT, pd.read_csv(right, sep='\t', dtype=str),
+                       left_on='id', right_on='acc')
+        for how in ('inner', 'left'):
+            df = self.join('-H', how, '-e', 'index', '--blocksize', '500')
+            self.assertListEqual(list(df.columns), list(exp.columns))
+            if how == 'inner':
+                self.assertEqual(df.shape, exp.shape)
+            else:
+                self.assertEqual(df.shape[0], 103)
+        # out-of-date index
+        with open(right, 'a') as outF:
+            outF.write('1000\tb1000\n')
+        with self.assertRaises(ValueError):
+            self.join('-e', 'index')
+
+    def test_semi_anti(self):
+        left = LEFT.copy()
+        left.loc[60, 'id'] = None
+        self.table('left.txt', left)
+        # duplicate keys
+        self.table('right.txt', pd.concat([RIGHT, RIGHT], ignore_index=True))
+        for how,exp in (('semi', 49), ('anti', 51)):
+            df = self.join('-H', how, '--blocksize', '500')
+            self.assertListEqual(list(df.columns), ['id', 'a'])
+            self.assertEqual(df.shape[0], exp)
+            # left table order
+            self.assertListEqual(list(df['a']), sorted(df['a'], key=lambda x: int(x[1:])))
+        # missing keys are kept by anti joins only
+        self.assertTrue(df['id'].isnull().any())
+
+    def test_key_dtypes(self):
+        # int & str keys never match: an error, as for pd.merge
+        for args in (('-H', 'semi'), ('-e', 'broadcast')):
+            with self.assertRaises(ValueError):
+                self.join('-L', 'int', '-R', 'str', *args)
+
+    def test_presorted(self):
+        # sorted; duplicate keys
+        left = pd.concat([LEFT] * 20, ignore_index=True).sort_values('id')
+        right = pd.concat([RIGHT] * 3, ignore_index=True).sort_values('acc')
+        self.table('left.txt', left)
+        self.table('right.txt', right)
+        for how in ('inner', 'left', 'right', 'outer'):
+            df = self.join('-H', how, '--presorted', '--npartitions', '7')
+            exp = pd.merge(left, right, left_on='id', right_on='acc', how=how)
+            self.assertEqual(df.shape, exp.shape)
+            # key order
+            keys = df['id'].fillna(df['acc'])
+            self.assertTrue(keys.is_monotonic_increasing)
+        # 2nd key column not sorted
+        left = left.assign(k=[str(9 - x % 10) for x in range(len(left))])
+        right = right.assign(k='1')
+        self.table('left.txt', left)
+        self.table('right.txt', right)
+        with self.assertRaises(ValueError):
+            self.run_join([self.left, self.right], '-j', 'id=acc,k=k', '--presorted',
+                          '--npartitions', '3')
+        # incompatible options
+        for args in (('-e', 'dask'), ('-e', 'sort'), ('-H', 'semi')):
+            with self.assertRaises(SystemExit):
+                self.join('--presorted', *args)
+        with self.assertRaises(SystemExit):
+            self.run_join([self.left, self.right, self.right], '-j', 'id=acc',
+                          '--presorted')
+
+    def test_keys_sorted(self):
+        df = pd.DataFrame({'x' : [None, '1', '1', '2'], 'y' : [9, 2, 3, 1]})
+        self.assertTrue(Join.keys_sorted(df, ['x', 'y']))
+        self.assertFalse(Join.keys_sorted(df.iloc[[1, 2, 3, 0]], ['x', 'y']))
+        self.assertFalse(Join.keys_sorted(df.iloc[[0, 2, 1, 3]], ['x', 'y']))
+        self.assertTrue(Join.keys_sorted(df.iloc[[0, 2, 1, 3]], ['x']))
+
+    def test_profile(self):
+        profile = os.path.join(self.tmpdir, 'profile.json')
+        for engine in ('dask', 'sort', 'broadcast'):
+            self.join('-e', engine, '--blocksize', '200', '-T', self.tmpdir,
+                      '--profile', profile)
+            with open(profile) as inF:
+                report = json.load(inF)
+            self.assertEqual(report['rows'][self.left], 100)
+            self.assertEqual(report['rows'][self.right], 100)
+            self.assertEqual(report['rows']['output'], 50)
+            self.assertGreater(report['stages']['execute'], 0)
+            self.assertGreater(report['peak_rss_mb']['self'], 0)
+            self.assertIn('spill_bytes', report)
+            self.assertEqual(report['unsupported'], {})
+            if engine == 'dask':
+                self.assertGreater(report['partitions'][self.left], 1)
+                self.assertIn('read', report['tasks'])
+            elif engine == 'sort':
+                self.assertIn('sort_runs', report['stages'])
+
+    def test_profile_unsupported(self):
+        profile = os.path.join(self.tmpdir, 'profile.json')
+        # rows read by dask tasks in other processes
+        self.join('-e', 'dask', '--scheduler', 'processes', '--profile', profile)
+        with open(profile) as inF:
+            report = json.load(inF)
+        self.assertIsNone(report['rows'][self.left])
+        self.assertEqual(report['rows']['output'], 50)
+        self.assertIn('rows', report['unsupported'])
+        self.assertIn('read', report['tasks'])
+        # no task timings with the distributed scheduler
+        report = Join.Profile(enabled=True, scheduler='distributed').report()
+        self.assertIsNone(report['tasks'])
+        self.assertIn('tasks', report['unsupported'])
+
+    def test_profile_per_run(self):
+        # each run has its own profile
+        profile = Join.Profile(enabled=True)
+        df = Join.get_table(self.left, blocksize=200, profile=profile)
+        df.compute()
+        df.compute()
+        self.assertEqual(profile.report()['rows'], {self.left : 100})
+        self.assertEqual(Join.Profile(enabled=True).report()['rows'], {})
+
+
+class Test_Join_engines(JoinTestCase):
+
+    def test_sort_merge_join(self):
+        # >1 run per table
+        left = pd.concat([LEFT] * 300, ignore_index=True)
+        left.loc[3, 'id'] = None
+        tables = [self.table('left.txt', left), self.right]
+        join_on = {'left' : ['id'], 'right' : ['acc']}
+        dtypes = [{'id' : 'str'}, {'acc' : 'str'}]
+        left = pd.read_csv(tables[0], sep='\t', dtype=dtypes[0])
+        right = pd.read_csv(tables[1], sep='\t', dtype=dtypes[1])
+        for how in ('inner', 'left', 'right', 'outer'):
+            chunks = Join.sort_merge_join(tables, join_on, how=how,
+                                          dtypes=dtypes, memory=100000,
+                                          tmpdir=self.tmpdir)
+            df = pd.concat(list(chunks), ignore_index=True)
+            exp = pd.merge(left, right, how=how, left_on='id', right_on='acc')
+            self.assertListEqual(list(df.columns), list(exp.columns))
+            self.assertEqual(df.shape, exp.shape)
+            # key order
+            keys = df['id'].dropna()
+            self.assertTrue((keys.values[1:] >= keys.values[:-1]).all())
+        # runs removed
+        self.assertListEqual(sorted(os.listdir(self.tmpdir)),
+                             ['left.txt', 'right.txt'])
+
+    def test_heavy_key(self):
+        # 1 key with most rows of the left table
+        left = pd.DataFrame({'id' : ['1'] * 10 + ['5'] * 5000 + ['7'] * 10,
+                             'a' : range(5020)})
+        right = pd.DataFrame({'acc' : [str(x) for x in range(10)] + ['5'],
+                              'b' : range(11)}).sort_values('acc')
+        blocks = [left.iloc[i:i+100] for i in range(0, len(left), 100)]
+        row_size = blocks[0].memory_usage(deep=True).sum() / 100.0
+        ons = [['id'], ['acc']]
+        for how in ('inner', 'left', 'right', 'outer'):
+            parts = list(Join.aligned_blocks([iter(blocks), [right]], ons,
+                                             max_bytes=500 * row_size))
+            # the heavy key is yielded in chunks
+            self.assertLessEqual(max([len(x) for x,y in parts]), 600)
+            df = pd.concat([pd.merge(x, y, how=how, left_on='id', right_on='acc')
+                            for x,y in parts])
+            exp = pd.merge(left, right, how=how, left_on='id', right_on='acc')
+            self.assertEqual(df.shape, exp.shape)
+        # heavy in both tables: all rows are buffered
+        right = pd.DataFrame({'acc' : ['5'] * 1000, 'b' : range(1000)})
+        with self.assertLogs(level='WARNING'):
+            parts = list(Join.aligned_blocks([iter(blocks), [right.iloc[:500], right.iloc[500:]]],
+                                             ons, max_bytes=200 * row_size))
+        self.assertEqual(sum([len(pd.merge(x, y, left_on='id', right_on='acc'))
+                              for x,y in parts]), 5000 * 1000)
+
+    def test_broadcast_merge(self):
+        right = RIGHT.rename(columns={'acc' : 'id'})
+        # non-unique keys
+        right_dup = pd.concat([right, right.iloc[:5]], ignore_index=True)
+        for small in (right, right_dup):
+            table = Join.BroadcastTable(small, ['id'])
+            for how in ('inner', 'left'):
+                df = Join.broadcast_merge(LEFT, table, ['id'], how=how)
+                exp = pd.merge(LEFT, small, how=how, on='id')
+                self.assertListEqual(list(df.columns), list(exp.columns))
+                self.assertEqual(df.shape, exp.shape)
+            # larger table on the right
+            df = Join.broadcast_merge(LEFT, table, ['id'], how='right',
+                                      large_is_left=False)
+            exp = pd.merge(small, LEFT, how='right', on='id')
+            self.assertListEqual(list(df.columns), list(exp.columns))
+            self.assertEqual(df.shape, exp.shape)
+
+    def test_build_index(self):
+        # duplicate & missing keys
+        right = pd.concat([RIGHT, RIGHT.iloc[:3]], ignore_index=True)
+        right.loc[10, 'acc'] = None
+        right = self.table('right.txt', right)
+        n = Join.build_index(right, key='acc')
+        self.assertEqual(n, 102)
+        index = Join.JoinIndex(right)
+        self.assertTrue(index.fresh())
+        df = index.rows(['50', '120', 'nope'], dtype={'acc' : 'str'})
+        self.assertListEqual(list(df['acc']), ['50', '120', '50'])
+        with self.assertRaises(ValueError):
+            Join.build_index(right, key='nope')
+
+    def test_semi_filter(self):
+        right = self.table('right.txt', pd.concat([RIGHT, RIGHT], ignore_index=True))
+        keys = Join.key_set(right, ['acc'], dtype={'acc' : 'str'})
+        self.assertEqual(len(keys), 100)
+        df = Join.semi_filter(LEFT, keys, ['id'])
+        self.assertListEqual(list(df['id']), [str(x) for x in range(50, 100)])
+        with self.assertRaises(ValueError):
+            Join.semi_filter(LEFT.astype({'id' : int}), keys, ['id'])
+
+    def test_encoded_merge(self):
+        left = LEFT.assign(k2=['x', 'y'] * 50)
+        left.loc[5, 'id'] = None
+        right = RIGHT.assign(k2=['x'] * 100)
+        right.loc[7, 'acc'] = None
+        df1 = dd.from_pandas(left, npartitions=3)
+        df2 = dd.from_pandas(right, npartitions=4)
+        for on in (['id'], ['id', 'k2']):
+            right_on = ['acc', 'k2'][:len(on)]
+            for how in ('inner', 'left', 'right', 'outer'):
+                df = Join.encoded_merge(df1, df2, on, right_on, how=how).compute()
+                exp = pd.merge(left, right, left_on=on, right_on=right_on, how=how)
+                sort = list(exp.columns)
+                df = df.sort_values(sort).reset_index(drop=True)
+                exp = exp.sort_values(sort).reset_index(drop=True)
+                pd.testing.assert_frame_equal(df, exp, check_dtype=False)
+
+    def test_key_dictionaries(self):
+        df1 = dd.from_pandas(LEFT, npartitions=2)
+        df2 = dd.from_pandas(RIGHT, npartitions=2)
+        dicts,mem = Join.key_dictionaries([df1, df2], [['id'], ['acc']])
+        self.assertEqual(len(dicts[0]), 150)
+        self.assertTrue(dicts[0].keys.is_monotonic_increasing)
+        self.assertEqual(mem[0][1], 100)
+
+    def test_arrow_keys(self):
+        with dask.config.set({'dataframe.convert-string' : False}):
+            df1 = dd.from_pandas(LEFT.astype(object), npartitions=2)
+        df,cols = Join.arrow_keys(df1, ['id'])
+        self.assertListEqual(cols, ['id'])
+        self.assertEqual(df['id'].dtype, 'string')
+        self.assertEqual(df['a'].dtype, object)
+
+    def test_key_reader(self):
+        right = self.table('right.txt', pd.concat([RIGHT] * 3, ignore_index=True)
+                           .sort_values('acc'))
+        reader = Join.KeyReader(right, ['acc'], dtype={'acc' : 'str'})
+        keys = reader.sample(4)
+        self.assertEqual(len(keys), 3)
+        offsets = reader.offsets(keys)
+        df = reader.read(offsets[1], offsets[2], dtype={'acc' : 'str'})
+        self.assertEqual(df['acc'].iloc[0], keys[0][0][1])
+        # numeric keys
+        reader = Join.KeyReader(right, ['acc'], dtype={'acc' : 'int'})
+        with self.assertRaises(ValueError):
+            reader.sample(4)
+
+
+class Test_Join_output(JoinTestCase):
+
+    def test_write_partitions(self):
+        ddf = dd.from_pandas(LEFT, npartitions=12)
+        for scheduler in ('threads', 'processes'):
+            for outfile in ('out.txt', 'out.txt.gz'):
+                outfile = os.path.join(self.tmpdir, outfile)
+                with Join.dask_scheduler(scheduler, procs=4):
+                    Join.write_partitions(ddf, outfile)
+                df = read_output(outfile)
+                # order & 1 header
+                self.assertListEqual(list(df['id']), list(LEFT['id']))
+
+    def test_ordered_writer(self):
+        # out-of-order blocks held in memory, or spilled beyond max_buffer
+        for max_buffer,n_spilled in ((100, 0), (1, 1), (0, 2)):
+            with open(self.outfile, 'wb') as outF:
+                writer = Join.OrderedWriter(outF, max_buffer=max_buffer)
+                for i in (2, 0, 3, 1):
+                    writer.put(i, str(i).encode('utf-8'))
+                writer.close()
+            self.assertEqual(writer.n_spilled, n_spilled)
+            with open(self.outfile) as inF:
+                self.assertEqual(inF.read(), '0123')
+
+
+class Test_Join_parse(unittest.TestCase):
+
+    def test_parse_size(self):
+        self.assertEqual(Join.parse_size('500M'), 500 * 1024 ** 2)
+        self.assertEqual(Join.parse_size('1.5g'), int(1.5 * 1024 ** 3))
+        self.assertEqual(Join.parse_size('1024'), 1024)
+        with self.assertRaises(ValueError):
+            Join.parse_size('lots')
+
+    def test_parse_join(self):
+        join_on = Join.parse_join('id=acc,k2=k3')
+        self.assertDictEqual(join_on, {'left' : ['id', 'k2'], 'right' : ['acc', 'k3']})
+        for x in ('id', 'id=acc,k2', 'id=acc=x'):
+            with self.assertRaises(ValueError):
+                Join.parse_join(x)
+
+    def test_parse_filters(self):
+        filters = Join.parse_filters('evalue<1e-5,name=abc, n >= 3')
+        self.assertListEqual(filters, [('evalue', '<', 1e-5), ('name', '==', 'abc'),
+                                       ('n', '>=', 3)])
+        with self.assertRaises(ValueError):
+            Join.parse_filters('evalue')
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# import
+## batteries
+import os
+import json
+import shutil
+import tempfile
+import unittest
+## package
+from leylab_pipelines.DB import Journal
+from leylab_pipelines.DB import Convert
+from leylab_pipelines.DB import IDMap
+
+
+# tests
+class Test_Journal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'job.journal')
+        self.params = {'method' : 'test'}
+        self.queried = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def func(self, IDs):
+        for ID in IDs:
+            self.queried.append(ID)
+            yield [ID, ID.lower()]
+
+    def test_resume(self):
+        IDs = ['A', 'B', 'C', 'D']
+        # job dies after 2 results
+        journal = Journal.Journal(self.path, params=self.params)
+        ret = journal.resume(IDs, self.func)
+        self.assertListEqual([next(ret), next(ret)], [['A', 'a'], ['B', 'b']])
+        journal.close()
+        # partial last line
+        with open(self.path, 'a') as outF:
+            outF.write('C\t["C", ')
+        # resuming
+        self.queried = []
+        journal = Journal.Journal(self.path, params=self.params, resume=True)
+        self.assertListEqual(sorted(journal.done.keys()), ['A', 'B'])
+        ret = list(journal.resume(IDs, self.func))
+        self.assertListEqual(ret, [[x, x.lower()] for x in IDs])
+        self.assertListEqual(self.queried, ['C', 'D'])
+        journal.close()
+        # all done
+        journal = Journal.Journal(self.path, params=self.params, resume=True)
+        self.assertEqual(len(journal.done), 4)
+        journal.close(remove=True)
+        self.assertFalse(os.path.isfile(self.path))
+
+    def test_unordered(self):
+        journal = Journal.Journal(self.path, params=self.params)
+        list(journal.resume(['A', 'B'], self.func))
+        journal.close()
+        journal = Journal.Journal(self.path, params=self.params, resume=True)
+        ret = list(journal.resume(['C', 'B', 'A'], self.func, ordered=False))
+        self.assertListEqual(ret, [['B', 'b'], ['A', 'a'], ['C', 'c']])
+        journal.close()
+
+    def test_resume_failed(self):
+        IDs = ['A', 'B', 'C']
+        # 'B' fails on the first run
+        def flaky(IDs):
+            for ID in IDs:
+                self.queried.append(ID)
+                yield [ID, None if ID == 'B' else ID.lower()]
+        journal = Journal.Journal(self.path, params=self.params)
+        ret = list(journal.resume(IDs, flaky))
+        self.assertListEqual(ret, [['A', 'a'], ['B', None], ['C', 'c']])
+        journal.close(remove=True)
+        # journal kept for the failed ID
+        self.assertTrue(os.path.isfile(self.path))
+        # resuming only re-queries the failed ID
+        self.queried = []
+        journal = Journal.Journal(self.path, params=self.params, resume=True)
+        self.assertListEqual(sorted(journal.done.keys()), ['A', 'C'])
+        ret = list(journal.resume(IDs, self.func))
+        self.assertListEqual(ret, [[x, x.lower()] for x in IDs])
+        self.assertListEqual(self.queried, ['B'])
+        journal.close(remove=True)
+        self.assertFalse(os.path.isfile(self.path))
+
+    def test_params_mismatch(self):
+        journal = Journal.Journal(self.path, params=self.params)
+        journal.close()
+        with self.assertRaises(ValueError):
+            Journal.Journal(self.path, params={'method' : 'other'}, resume=True)
+
+    def test_convert_resume(self):
+        idmap_file = os.path.join(self.tmpdir, 'idmap.sqlite')
+        idmap = IDMap.IDMap(idmap_file)
+        idmap.ingest([('accession', 'taxid', 'T02634', '5833')])
+        idmap.close()
+        infile = os.path.join(self.tmpdir, 'IDs.txt')
+        with open(infile, 'w') as outF:
+            outF.write('T02634\nJOURNALED\nT02634\n')
+        outfile = os.path.join(self.tmpdir, 'out.txt')
+        # journal of a job that died
+        with open(outfile + '.journal', 'w') as outF:
+            outF.write(json.dumps({'method' : 'accession2taxonomy'}) + '\n')
+            outF.write('JOURNALED\t["JOURNALED", "1"]\n')
+        args = Convert.parse_args([infile, '-o', outfile, '--idmap', idmap_file,
+                                   '--offline', '--no-cache', '--resume'])
+        Convert.main(args)
+        with open(outfile) as inF:
+            lines = inF.read().splitlines()
+        self.assertListEqual(lines[1:], ['T02634\t5833', 'JOURNALED\t1', 'T02634\t5833'])
+        self.assertFalse(os.path.isfile(outfile + '.journal'))
+
+    def test_convert_resume_failed(self):
+        idmap_file = os.path.join(self.tmpdir, 'idmap.sqlite')
+        idmap = IDMap.IDMap(idmap_file)
+        idmap.ingest([('accession', 'taxid', 'T02634', '5833')])
+        idmap.close()
+        infile = os.path.join(self.tmpdir, 'IDs.txt')
+        with open(infile, 'w') as outF:
+            outF.write('T02634\nMISSING\n')
+        outfile = os.path.join(self.tmpdir, 'out.txt')
+        args = [infile, '-o', outfile, '--idmap', idmap_file,
+                '--offline', '--no-cache']
+        # 'MISSING' fails on the first run
+        Convert.main(Convert.parse_args(args))
+        with open(outfile) as inF:
+            lines = inF.read().splitlines()
+        self.assertListEqual(lines[1:], ['T02634\t5833', 'MISSING\tNA'])
+        self.assertTrue(os.path.isfile(outfile + '.journal'))
+        # the resumed run re-queries 'MISSING'
+        idmap = IDMap.IDMap(idmap_file)
+        idmap.ingest([('accession', 'taxid', 'MISSING', '9606')])
+        idmap.close()
+        Convert.main(Convert.parse_args(args + ['--resume']))
+        with open(outfile) as inF:
+            lines = inF.read().splitlines()
+        self.assertListEqual(lines[1:], ['T02634\t5833', 'MISSING\t9606'])
+        self.assertFalse(os.path.isfile(outfile + '.journal'))
@@ -5,6 +5,8 @@
 ## batteries
 import os
 import sys
+import shutil
+import tempfile
 import unittest
 ## 3rd party
 import pandas as pd
@@ -194,6 +196,50 @@ class Test_Map2Robot_pipMasterMix(unittest.TestCase):
         self.assertIsNone(ret)
 
 
+class Test_Map2Robot_pipBlocks(unittest.TestCase):
+
+    def setUp(self):
+        n = 3000
+        self.df_map = pd.DataFrame({
+            'TECAN_sample_labware' : ['sample plate{}'.format(i % 4) for i in range(n)],
+            'TECAN_sample_location' : [i % 96 + 1 for i in range(n)],
+            'TECAN_primer_labware' : 'primer plate',
+            'TECAN_primer_location' : [i % 384 + 1 for i in range(n)],
+            'TECAN_sample_rxn_volume' : [1.0 + i % 5 for i in range(n)],
+            'TECAN_dest_labware' : '384 Well[008]',
+            'TECAN_dest_location' : [float(i % 384 + 1) for i in range(n)]})
+        self.tmpdir = tempfile.mkdtemp()
+        self.gwl = os.path.join(self.tmpdir, 'BLOCKS.gwl')
+
+    def tearDown(self):
+        self.df_map = None
+        shutil.rmtree(self.tmpdir)
+
+    def test_pip_blocks(self):
+        with open(self.gwl, 'w') as gwlFH:
+            Map2Robot.pip_primers(self.df_map, gwlFH, fp_volume=1.0,
+                                  rp_volume=1.0, fp_tube=2)
+            Map2Robot.pip_samples(self.df_map, gwlFH)
+            Map2Robot.pip_water(self.df_map, gwlFH, mm_volume=13.1,
+                                fp_volume=1.0, rp_volume=1.0)
+        self.assertIsNone(Utils.check_gwl(self.gwl))
+        with open(self.gwl) as inF:
+            lines = inF.read().splitlines()
+        # 4 blocks of asp/disp/waste + comment lines
+        self.assertEqual(len(lines), 4 * 3 * 3000 + 5)
+        self.assertEqual(lines[2], 'A;micro15[002];;;2;;1.0;Water Free Single;;')
+        self.assertEqual(lines[9004], 'D;384 Well[008];;;1;;1.0;Water Free Single;;')
+        self.assertTrue(lines[-2].startswith('D;384 Well[008];;;312;;4.8'))
+        self.assertEqual(lines[-1], 'W;')
+        water = self.df_map['TECAN_water_rxn_volume']
+        self.assertAlmostEqual(water.iloc[0], 8.9)
+
+    def test_pip_water_negative(self):
+        with open(self.gwl, 'w') as gwlFH:
+            with self.assertRaises(AssertionError):
+                Map2Robot.pip_water(self.df_map, gwlFH, pcr_volume=10.0)
+
+
 class Test_Map2Robot_main(unittest.TestCase):
 
     def setUp(self):
@@ -5,6 +5,8 @@
 ## batteries
 import os
 import sys
+import shutil
+import tempfile
 import unittest
 ## 3rd party
 import pandas as pd
@@ -60,3 +62,37 @@ class Test_Utils(unittest.TestCase):
         gwl_file = os.path.join(data_dir, 'multi_dispense.gwl')
         ret = Utils.check_gwl(gwl_file)
         self.assertIsNone(ret)
+
+
+class Test_Utils_LineEndWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.gwl = os.path.join(self.tmpdir, 'test.gwl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_unix_win(self):
+        with Utils.LineEndWriter(self.gwl) as outFH:
+            outFH.write('C;test\nW;\n')
+            pd.DataFrame({'x' : [1, 2]}).to_csv(outFH, index=False)
+        unix_file, win_file = outFH.files
+        self.assertEqual(unix_file, self.gwl)
+        self.assertEqual(win_file, os.path.join(self.tmpdir, 'test_win.gwl'))
+        with open(unix_file, 'rb') as inF:
+            self.assertEqual(inF.read(), b'C;test\nW;\nx\n1\n2\n')
+        with open(win_file, 'rb') as inF:
+            self.assertEqual(inF.read(), b'C;test\r\nW;\r\nx\r\n1\r\n2\r\n')
+        # same as to_win
+        to_win_file = Utils.to_win(unix_file, suffix='_to_win')
+        with open(win_file, 'rb') as inF1, open(to_win_file, 'rb') as inF2:
+            self.assertEqual(inF1.read(), inF2.read())
+
+    def test_win_only(self):
+        with Utils.LineEndWriter(self.gwl, win_only=True) as outFH:
+            outFH.write('W;\n')
+        self.assertIsNone(outFH.files[0])
+        self.assertListEqual(os.listdir(self.tmpdir), ['test_win.gwl'])
+        ret = Utils.check_gwl(outFH.files[1])
+        self.assertIsNone(ret)